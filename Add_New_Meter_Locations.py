@@ -8,7 +8,9 @@ try:
 	print "Importing libraries..."
 	import arcpy
 	from arcpy import env
-	import xlrd
+	import hnglib.customers
+	import hnglib.gdb
+	import hnglib.meters
 
 	# Environment settings
 	print "Setting environment..."
@@ -19,88 +21,71 @@ try:
 	print "Setting local variables..."
 	ESRI_meters = "meter_ref"
 	CUSI_meters = "S:\Hughes_ArcGIS\current_customer_info.xls"
-	CUSI_reader = xlrd.open_workbook(CUSI_meters)
-	CUSI_sheet = CUSI_reader.sheet_by_index(0)
+	# Set to True to list the meters which would be created without writing them
+	dry_run = False
 	print
 
-	# Getting lists of meters in the ESRI and CUSI databases
-	print "Getting ESRI service IDs..."
-	ESRI_cursor = arcpy.SearchCursor(ESRI_meters)
-	ESRI_list = []
-	for feature in ESRI_cursor:
-		ESRI_list.append(int(feature.serv_id))
-	ESRI_set = set(ESRI_list)
-	print "ESRI has %i features (%i unique), last service ID is %i" % (len(ESRI_list),len(ESRI_set),ESRI_list[-1])
-	print
+	# Reading both sides once and reconciling them by service ID
+	print "Getting ESRI and CUSI service IDs..."
+	ESRI_rows = arcpy.da.SearchCursor(ESRI_meters,["serv_id","latitude","longitude"])
+	diff = hnglib.meters.reconcile(ESRI_rows,hnglib.customers.read_customers(CUSI_meters))
+	del ESRI_rows
 
-	print "Getting CUSI service IDs..."
-	CUSI_list = map(int,CUSI_sheet.col_values(2)[1:])
-	CUSI_set = set(CUSI_list)
-	print "CUSI has %i features (%i unique), last service ID is %i" % (len(CUSI_list), len(CUSI_set),CUSI_list[-1])
+	print "ESRI has %i features (%i unique), last service ID is %i" % (diff.ESRI_count,diff.ESRI_unique,diff.ESRI_last)
+	if diff.ESRI_blank > 0:
+		print "%i ESRI features have no service ID" % (diff.ESRI_blank)
+	print
+	print "CUSI has %i features (%i unique), last service ID is %i" % (diff.CUSI_count,diff.CUSI_unique,diff.CUSI_last)
 	print
 
-	union = list(ESRI_set|CUSI_set)
-	not_in_ESRI = list(CUSI_set-ESRI_set)
-	print "Together they have %i unique features total, and %i meters are missing from ESRI" % (len(union),len(not_in_ESRI))
+	print "Together they have %i unique features total, and %i meters are missing from ESRI" % (diff.union_count,len(diff.not_in_ESRI))
 
-	ESRI_doubles_list = ESRI_list[:]
-	for entry in list(ESRI_set):
-		ESRI_doubles_list.remove(entry)
-	if len(ESRI_doubles_list) > 0:
-		print str(len(set(ESRI_doubles_list))) + " service IDs occur more than once in ESRI."
+	if len(diff.doubles) > 0:
+		print str(len(diff.doubles)) + " service IDs occur more than once in ESRI."
+		for serv_id in sorted(diff.doubles):
+			print "Service ID %i occurs %i times" % (serv_id,diff.doubles[serv_id])
 
-		# Create new search cursor to go through ESRI data, deleting old if nec.
-		if ESRI_cursor: del ESRI_cursor
-		ESRI_cursor = arcpy.SearchCursor(ESRI_meters)
 		# This will print an array of lat/long/serv_id of all muliple data points
-		ESRI_doubles_data = []
-		for feature in ESRI_cursor:
-			if int(feature.serv_id) in ESRI_doubles_list:
-				ESRI_doubles_data.append([feature.serv_id,feature.latitude,feature.longitude])
 		print "All ESRI features which have the same service ID as another feature:"
 		print
-		for feature in ESRI_doubles_data:
+		for feature in diff.doubles_data:
 			print feature
 		print
 	else:
 		print "Every service ID in ESRI is unique (no doubles)"
 		print
 
+	# Meters in ESRI which CUSI has no customer record for
+	if len(diff.not_in_CUSI) > 0:
+		print "%i service IDs in ESRI are missing from CUSI:" % (len(diff.not_in_CUSI))
+		print diff.not_in_CUSI
+	else:
+		print "Every service ID in ESRI is in CUSI"
+	print
+
 	print "Service IDs missing from ESRI:"
-	print not_in_ESRI
+	print diff.not_in_ESRI
 	print
 	# now to see if we have lat/long data for the missing meters
-	missing_meters = []
-	dead_meters = []
-	for i in range(CUSI_sheet.nrows)[1:]:
-		if int(CUSI_sheet.row_values(i)[2]) in not_in_ESRI:
-			missing_meters.append(CUSI_sheet.row_values(i)[:3])
-	for feature in missing_meters:
-		if str(feature[0]) != '':
-			print "Service ID %i should be located at lat/long %s/%s" % (int(feature[2]),str(feature[0]),str(feature[1]))
-		else:
-			dead_meters.append(feature)
+	missing_meters = diff.missing_meters
+	dead_meters = diff.dead_meters
+	for feature in diff.located_meters:
+		print "Service ID %i should be located at lat/long %s/%s" % (feature[2],str(feature[0]),str(feature[1]))
 	print
 	print "Still %i meters without any lat/long data." % (len(dead_meters))
 	print "Service IDs: ",
 	for feature in dead_meters:
-		print str(int(feature[2])) + ",",
+		print str(feature[2]) + ",",
 	print
 	print
 
-	add_cursor = arcpy.InsertCursor(ESRI_meters)
-	# Now to create those missing meters
-	print "Creating missing meters in ESRI..."
-	for feature in missing_meters:
-		if str(feature[0]) != '':
-			new_feature = add_cursor.newRow()
-			new_feature.Shape = arcpy.Point(feature[1],feature[0])
-			new_feature.serv_id = feature[2]
-			add_cursor.insertRow(new_feature)
-			print "Added " + str(feature[2])
-		else:
-			print str(feature[2]) + " has no lat/long info and could not be added to ESRI"
-
+	# Now to create those missing meters, all in one edit operation
+	print "Creating missing meters in ESRI%s..." % (" (dry run)" if dry_run else "")
+	added = hnglib.gdb.insert_meters(ESRI_meters,missing_meters,dry_run)
+	print "%s %i new meters:" % ("Would add" if dry_run else "Added",len(added))
+	print ", ".join([str(serv_id) for serv_id in added])
+	if len(missing_meters) > len(added):
+		print "%i meters have no lat/long info and could not be added to ESRI" % (len(missing_meters) - len(added))
 
 	print
 	print "Done!"
@@ -8,6 +8,8 @@ print "Importing libraries..."
 import arcpy
 from arcpy import env
 import csv
+import hnglib.gdb
+import hnglib.pipeline
 
 # Environment settings
 print "Setting environment..."
@@ -21,8 +23,6 @@ print "Setting local variables..."
 layersuffix = "_layer"
 lines = "Gas_Lines"
 RRC = "RRC_Areas"
-intersection = "intersection"
-calculated_field = "length_ft"
 
 # Next do MakeFeatureLayer on each layer, naming the new layer using the suffix
 arcpy.MakeFeatureLayer_management(lines,lines+layersuffix)
@@ -38,35 +38,21 @@ print "Setup complete."
 print
 
 try:
-	# Grabbing only HNG lines, splitting along RRC area borders, and calculating length
-	arcpy.SelectLayerByAttribute_management(lines,"NEW_SELECTION",""" "company" = 'HNG' """)
-	arcpy.Intersect_analysis([lines,RRC],intersection,"","","LINE")
-	arcpy.CalculateField_management(intersection,calculated_field,"float(!SHAPE.length@FEET!)","PYTHON")
-
-	arcpy.MakeFeatureLayer_management(intersection,intersection+layersuffix)
-	intersection += layersuffix
+	# Grabbing only HNG lines, clipping them along RRC area borders, and calculating length. The areas are read in the lines' spatial reference, which the lengths are measured in.
+	HNG_lines = hnglib.gdb.read_polylines(lines,[],""" "company" = 'HNG' """)
+	areas = hnglib.gdb.read_polygons(RRC,["Name"],hnglib.gdb.spatial_reference(lines))
+	lengths = hnglib.pipeline.area_lengths([(line[0],"HNG") for line in HNG_lines],areas,hnglib.gdb.feet_per_unit(lines))
 
 	# Now doing the individual totals
 	totallength = 0.0
-	areas = arcpy.SearchCursor(RRC)
-	for area in areas:
-	    arcpy.SelectLayerByAttribute_management(RRC,"NEW_SELECTION",'"OBJECTID" = ' + str(area.OBJECTID))
-	    arcpy.SelectLayerByLocation_management(intersection,"WITHIN",RRC)
-	    features = arcpy.SearchCursor(intersection)
-	    length = 0.0
-	    for feature in features:
-	        if isinstance(feature.length_ft,float):
-	            length += feature.length_ft
-	    print str(int(length)) + " feet of pipe in " + str(area.Name)
-	    writer.writerow([str(area.Name),int(length)])
+	for area, arealengths in zip(areas,lengths):
+	    length = arealengths.get("HNG",0.0)
+	    print str(int(length)) + " feet of pipe in " + str(area["Name"])
+	    writer.writerow([str(area["Name"]),int(length)])
 	    totallength += length
 
 	print str(int(totallength)) + " feet of pipe total (" + str(round(totallength/5280,1)) + " miles)"
 
-
-	print "Cleaning up..."
-	arcpy.Delete_management(intersection)
-
 	print "Done!"
 	raw_input('')
 except Exception as e:
@@ -74,6 +60,4 @@ except Exception as e:
 	print "Line #%i:" % (sys.exc_info()[2].tb_lineno)
 	print e
 	raw_input('')
-	if arcpy.Exists(intersection):
-		arcpy.Delete_management(intersection)
 	raise
@@ -6,23 +6,19 @@ print "Importing libraries..."
 import arcpy
 from arcpy import env
 env.workspace = "S:\Hughes_ArcGIS\HNG new.gdb"
-import csv
+import hnglib.cusi_import
 
 print "Setting up..."
 meters = "meter_ref"
 filepath = "S:\\Hughes_ArcGIS\\Python_Output\\CUSI_Import.csv"
-
-def writePaddedRow(writer,latitude,longitude,serv_id,route,RRC):
-	row = [latitude,longitude,serv_id] + [""] * 8 + [str(route).zfill(2)] + [""] * 18 + [RRC]
-	writer.writerow(row)
-
-writer = csv.writer(open(filepath,'wb'),dialect='excel')
-writePaddedRow(writer,"latitude","longitude","serv_id","route_no","user5")
+# Split the export into numbered files of at most this many meters (None or 0 writes a single file)
+rows_per_file = None
+# Set to True to gzip the output file(s)
+compress = False
 
 print "Writing lines..."
-points = arcpy.SearchCursor(meters)
-for point in points:
-	writePaddedRow(writer, point.latitude, point.longitude, point.serv_id, point.route_no, point.RRC_Area)
+count, files = hnglib.cusi_import.export_meters(meters,filepath,rows_per_file,compress)
+print "Wrote %i meters to %s" % (count,", ".join(files))
 
 print
 print "Done!"
@@ -7,6 +7,9 @@ print "Importing libraries..."
 import arcpy
 from arcpy import env
 import csv
+import hnglib.customers
+import hnglib.gdb
+import hnglib.taxing
 
 # Environment settings
 print "Setting environment..."
@@ -24,11 +27,23 @@ districts = "Districts"
 ESDs_layer, ISDs_layer = districts + "\ESDs", districts + "\ISDs"
 filename = "S:\\Hughes_ArcGIS\\Python_Output\\Taxing_Areas.csv"
 customer_info_xls = "S:\Hughes_ArcGIS\current_customer_info.xls"
+cache_folder = "S:\\Hughes_ArcGIS\\Python_Output\\cache"
+# Every meter is assigned from scratch unless incremental is True. Incremental
+# runs keep each meter's ISD/ESD assignment in state_file and only re-assign meters
+# which moved or sit in an edited district. While verify is True they also do a
+# full recompute, compare it against the incremental result and write the full
+# recompute if the two differ, so leave it on for spreadsheets being submitted.
+incremental = False
+verify = True
+state_file = cache_folder + "\\Taxing_Areas.state"
+# Number of worker processes to spread the ISD/ESD lookups over (1 runs serially,
+# the output is the same either way)
+workers = 1
 writer = csv.writer(open(filename,'wb'),dialect='excel')
 
 # This is the header row in the *.csv file
 print "Writing header row..."
-writer.writerow(["County","ISD","ESD","ACTIVE/ON","INACTIVE/ON","OFF","TOTAL"])
+writer.writerow(hnglib.taxing.HEADER)
 
 print
 # Next do MakeFeatureLayer on each layer, naming the new layer using the suffix
@@ -38,102 +53,59 @@ arcpy.MakeFeatureLayer_management(meters,meters+layersuffix)
 ESDs_layer += layersuffix
 ISDs_layer += layersuffix
 meters += layersuffix
+# The meters and ESDs are read in the ISDs' spatial reference, so every layer lines
+# up whatever each one is stored in (the cursors project them on the fly)
+districts_sr = hnglib.gdb.spatial_reference(ISDs_layer)
 
 try:
-	# Joining the customer info for ACTIVE/INACTIVE calculation
-	print "Joining customer info to meters layer..."
-	customer_info_table = "customer_info_table"
-	arcpy.ExcelToTable_conversion(customer_info_xls,customer_info_table,"servloc")
-	arcpy.AddJoin_management(meters,"serv_id",customer_info_table,"serv_id")
+	# Joining the customer info for ACTIVE/INACTIVE calculation. The sheet is read
+	# into a dict keyed by serv_id and matched to each meter in memory.
+	print "Reading customer info..."
+	customer_status = hnglib.customers.load_status(customer_info_xls)
+	print "Reading meters..."
+	meter_data = hnglib.gdb.read_points(meters,["serv_id","OID@"],districts_sr)
+	print "Joining customer info to meters..."
+	meter_data, unjoined = hnglib.customers.join_status(meter_data,customer_status)
 
 	# Count meters for validation purposes
-	metercount = int(str(arcpy.GetCount_management(meters)))
+	metercount = len(meter_data)
 	print "%i features in meter layer" % (metercount)
 
+	# Report meters whose service ID is missing from the customer sheet (console only,
+	# the spreadsheet goes to the taxing authorities as is)
+	if len(unjoined) > 0:
+		print "%i meters have no matching serv_id in the customer info sheet and are left out of the ACTIVE/INACTIVE and ON/OFF columns:" % (len(unjoined))
+		print ", ".join([str(serv_id) for serv_id in unjoined])
+
 	print "Setup complete."
 	print
 
 
-	# Now loop inside ESDs_layer and then ISDs_layer
+	# Read the districts once, then let the engine assign each meter to its ISD and
+	# ESD in a single pass and build the report rows from that
+	print "Reading districts..."
+	ESDs = hnglib.gdb.load_polygon_index(ESDs_layer,["COUNTY","NUMBER"],cache_folder,districts_sr)
+	ISDs = hnglib.gdb.load_polygon_index(ISDs_layer,["NAME2"],cache_folder,districts_sr)
+
+	if incremental:
+		print "Updating assignments from previous run%s..." % (" and verifying against a full recompute" if verify else "")
+		rows, totals, summary, differences = hnglib.taxing.incremental_rows(state_file,ISDs,ESDs,meter_data,verify,workers)
+		if not summary["previous"]:
+			print "No previous run found, assigned all %i meters" % (len(meter_data))
+		print "%i meters reassigned, %i changed status only, %i unchanged, %i removed" % (summary["reassigned"],summary["status"],summary["unchanged"],summary["removed"])
+		if len(differences) > 0:
+			print "**Incremental result does not match full recompute, using full recompute**"
+			for difference in differences:
+				print difference
+		elif verify:
+			print "Incremental result matches full recompute"
+	else:
+		print "Assigning %i meters to %i ISDs and %i ESDs..." % (len(meter_data),len(ISDs),len(ESDs))
+		rows, totals = hnglib.taxing.build_rows(ISDs,ESDs,meter_data,workers)
+	activeontotal, inactiveontotal, offtotal, total = totals
 	print "Creating *.csv file..."
-	ESD_OBJECTID = {}
-	ESDs = arcpy.SearchCursor(ESDs_layer)
-	for ESD in ESDs:
-		ESD_OBJECTID[ESD.OBJECTID] = [ESD.COUNTY,ESD.NUMBER]
-
-	# total is the total number of meters counted, ISD_total is the total number of meters inside the current ISD, and ESD_counted is the number of meters in the current ISD which have been accounted for within an ESD. After ESD looping, the difference between ISD_total and ESD_counted is the number of meters inside the current ISD which do not have an ESD.
-	activeontotal, inactiveontotal, offtotal, total = 0, 0, 0, 0
-	ISD_total, ESD_counted = 0, 0
-	# number_of_ISDs and ISD_counter are just used to print to the terminal to give an indication of how far along the scripts is.
-	number_of_ISDs = arcpy.GetCount_management(ISDs_layer)
-	ISD_counter = 0
-	ISDs = arcpy.SearchCursor(ISDs_layer)
-	for ISD in ISDs:
-		ISD_counter += 1
-		print "Calculating " + str(ISD_counter) + "/" + str(number_of_ISDs) + " (" + str(ISD.NAME) + ")"
-		arcpy.SelectLayerByAttribute_management(ISDs_layer,"NEW_SELECTION",'"OBJECTID" = ' + str(ISD.OBJECTID))
-		arcpy.SelectLayerByLocation_management(meters,"WITHIN",ISDs_layer)
-		ISD_total = int(str(arcpy.GetCount_management(meters)))
-		ESD_counted, ESD_active_on_counted = 0, 0
-		ESD_inactive_on_counted, ESD_off_counted = 0, 0
-		if ISD_total > 0:
-			for ESD in ESD_OBJECTID:
-				arcpy.SelectLayerByAttribute_management(ISDs_layer,"NEW_SELECTION",'"OBJECTID" = ' + str(ISD.OBJECTID))
-				arcpy.SelectLayerByLocation_management(meters,"WITHIN",ISDs_layer)
-				arcpy.SelectLayerByAttribute_management(ESDs_layer,"NEW_SELECTION",'"OBJECTID" = ' + str(ESD))
-				arcpy.SelectLayerByLocation_management(meters,"WITHIN",ESDs_layer,"","SUBSET_SELECTION")
-				count = int(str(arcpy.GetCount_management(meters)))
-				print ".",
-				if count > 0:
-					arcpy.SelectLayerByAttribute_management(meters,"SUBSET_SELECTION",customer_info_table+'.serv_stat = \'ACTIVE\'')
-					arcpy.SelectLayerByAttribute_management(meters,"SUBSET_SELECTION",customer_info_table+'.meter_on = 1')
-					activeoncount = int(str(arcpy.GetCount_management(meters)))
-					arcpy.SelectLayerByLocation_management(meters,"WITHIN",ISDs_layer)
-					arcpy.SelectLayerByLocation_management(meters,"WITHIN",ESDs_layer,"","SUBSET_SELECTION")
-					arcpy.SelectLayerByAttribute_management(meters,"SUBSET_SELECTION",customer_info_table+'.serv_stat = \'INACTIVE\'')
-					arcpy.SelectLayerByAttribute_management(meters,"SUBSET_SELECTION",customer_info_table+'.meter_on = 1')
-					inactiveoncount = int(str(arcpy.GetCount_management(meters)))
-					arcpy.SelectLayerByLocation_management(meters,"WITHIN",ISDs_layer)
-					arcpy.SelectLayerByLocation_management(meters,"WITHIN",ESDs_layer,"","SUBSET_SELECTION")
-					arcpy.SelectLayerByAttribute_management(meters,"SUBSET_SELECTION",customer_info_table+'.meter_on = 0')
-					offcount = int(str(arcpy.GetCount_management(meters)))
-					writer.writerow([ESD_OBJECTID[ESD][0],ISD.NAME2,ESD_OBJECTID[ESD][0] + " " + ESD_OBJECTID[ESD][1],activeoncount,inactiveoncount,offcount,count])
-					
-					ESD_counted += count
-					ESD_active_on_counted += activeoncount
-					ESD_inactive_on_counted += inactiveoncount
-					ESD_off_counted += offcount
-
-					total += count
-					activeontotal += activeoncount
-					inactiveontotal += inactiveoncount
-					offtotal += offcount
-			print
-		if ESD_counted != ISD_total and ISD_total > 0:
-			arcpy.SelectLayerByAttribute_management(ISDs_layer,"NEW_SELECTION",'"OBJECTID" = ' + str(ISD.OBJECTID))
-			arcpy.SelectLayerByLocation_management(meters,"WITHIN",ISDs_layer)
-			count = int(str(arcpy.GetCount_management(meters)))
-			count -= ESD_counted
-			arcpy.SelectLayerByAttribute_management(meters,"SUBSET_SELECTION",customer_info_table+'.serv_stat = \'ACTIVE\'')
-			activeoncount = int(str(arcpy.GetCount_management(meters)))
-			activeoncount -= ESD_active_on_counted
-			arcpy.SelectLayerByLocation_management(meters,"WITHIN",ISDs_layer)
-			arcpy.SelectLayerByAttribute_management(meters,"SUBSET_SELECTION",customer_info_table+'.serv_stat = \'INACTIVE\'')
-			arcpy.SelectLayerByAttribute_management(meters,"SUBSET_SELECTION",customer_info_table+'.meter_on = 1')
-			inactiveoncount = int(str(arcpy.GetCount_management(meters)))
-			inactiveoncount -= ESD_inactive_on_counted
-			arcpy.SelectLayerByLocation_management(meters,"WITHIN",ISDs_layer)
-			arcpy.SelectLayerByAttribute_management(meters,"SUBSET_SELECTION",customer_info_table+'.serv_stat = \'INACTIVE\'')
-			arcpy.SelectLayerByAttribute_management(meters,"SUBSET_SELECTION",customer_info_table+'.meter_on = 0')
-			offcount = int(str(arcpy.GetCount_management(meters)))
-			offcount -= ESD_off_counted
-			writer.writerow(["",ISD.NAME2,"",activeoncount,inactiveoncount,offcount,count])
-
-			total += count
-			activeontotal += activeoncount
-			inactiveontotal += inactiveoncount
-			offtotal += offcount
-									
+	writer.writerows(rows)
+
 	writer.writerow([])	
 	writer.writerow(["","","TOTAL",activeontotal,inactiveontotal,offtotal,total])
 	print
@@ -147,11 +119,9 @@ try:
 
 	print "Done!"
 	raw_input('')
-	arcpy.Delete_management(customer_info_table)
 except Exception as e:
 	import sys
 	print "Line #%i:" % (sys.exc_info()[2].tb_lineno)
 	print e
 	raw_input('')
-	arcpy.Delete_management(customer_info_table)
 	raise
@@ -1,12 +1,16 @@
+# -*- coding: utf-8 -*-
 # Name: Data_Integrity_Report.py
 # Author: Réal R. Provencher 2014
 # ------------------------
 # Combines several other reporting style ArcPy scripts to create a single
 # spreadsheet report detailing the data integrity of our geodatabase. Each
-# section of the report is divided into its own try/except block so a failing
-# report will not prevent the entire report from being generated, and will
-# also include an error message in the spreadsheet. The following info is
-# included in the report:
+# section of the report is its own module function, run inside its own
+# try/except block so a failing report will not prevent the entire report from
+# being generated, and will also include an error message in the spreadsheet.
+# Modules which don't depend on each other run at the same time (see MODULE
+# SCHEDULER), all working from one in-memory snapshot of the layers, which are
+# each read once per run before any module starts (a layer a module writes to is
+# read again by the modules after it). The following info is included in the report:
     # - Taxing districts report (number of meters separated by ISD/ESD and 
     #    ACTIVE/INACTIVE/OFF meter location status)
     # - Pipeline length report (length of HNG lines separated by RRC area)
@@ -32,9 +36,31 @@ MODULE_ON = {
 OPTIONS = {
     "OUTPUT_FILEPATH": "S:\\Hughes_ArcGIS\\Python_Output\\Data_Integrity_Report.csv",
     "OVERWRITE_LAYERS": True,
+    # Number of worker processes modules may run in at once. Modules which don't
+    # touch anything another module writes run side by side; the report still
+    # comes out in module order (1 runs every module in turn in this process).
+    # Every stage of modules starts its own workers, each sent a copy of the
+    # datasets that stage reads (and on Windows re-importing this script and
+    # arcpy), which costs more than the modules' own work unless the layers are
+    # large, so only raise this after timing both (see PROFILE)
+    "MODULE_WORKERS": 1,
+    # Spatial indexes over the polygon layers with editor tracking are kept here
+    # between runs and reloaded without reading the layer until its row count,
+    # highest OBJECTID or last edit date changes (set to None to always rebuild)
+    "CACHE_FOLDER": "S:\\Hughes_ArcGIS\\Python_Output\\cache",
+    # Time every arcpy call and cursor per module, writing the profile next to the
+    # report (Data_Integrity_Report_profile.json/.csv) and the PROFILE_TOP slowest
+    # calls to the console
+    "PROFILE": False,
+    "PROFILE_TOP": 10,
 
     ### MODULE SPECIFIC OPTIONS
     # Organized by name of module
+    "TAXING_DISTRICTS": {
+        # Number of worker processes to spread the ISD/ESD lookups over (1 runs
+        # serially, the output is the same either way)
+        "WORKERS": 1
+    },
     "PIPELINE_LENGTH": {
         "TABLE_SETUP_QUERIES": [
             ["HNG PE", "company = 'HNG' AND (pipe_material = 'Black' OR pipe_material = 'Yellow' OR pipe_material = 'Orange')"],
@@ -49,7 +75,15 @@ OPTIONS = {
             "6\"": [6],
             "Unknown": ['NULL']
         },
-        "SIZE_ORDER": ["<2\"", "2\"", "3\"", "4\"", "6\"", "Unknown"]
+        "SIZE_ORDER": ["<2\"", "2\"", "3\"", "4\"", "6\"", "Unknown"],
+        # HNG lines running within DISTANCE_FT feet of each other and within
+        # ANGLE_DEG degrees of parallel are reported as overlapping length, i.e.
+        # pipe counted twice in the tables above (set to None to skip the check)
+        "OVERLAP_TOLERANCE": {"DISTANCE_FT": 0.5, "ANGLE_DEG": 2.0}
+    },
+    "VERIFY_METERS": {
+        # List the meters which would be created in ESRI without writing them
+        "DRY_RUN": False
     },
     "COMPANY_ID": {
         "INCLUDE_COMPANY": ["HNG", "AP"]
@@ -59,27 +93,40 @@ OPTIONS = {
 ### HELPER FUNCTIONS
 # Several helper functions that are used in multiple modules
 
-# Helpers to be used at the beginning and end of each module try block to indicate in
-# the console where these events occure (must set variable modulename)
-def print_module_start():
+# Helpers to be used at the beginning and end of each module to indicate in the
+# console where these events occure
+def print_module_start(modulename):
     print "--- STARTING %s MODULE ---" % (modulename)
-def print_module_end():
+def print_module_end(modulename):
     print "--- FINISHED %s MODULE ---" % (modulename)
     print
 
-# Prints a helpful formatted version of the passed exception, running the passed
-# block after pressing enter if one is included
-def print_formatted_error(e, block=None):
+# Prints a helpful formatted version of the passed exception (also writing it to
+# the module's report rows when a writer is passed), running the passed block
+# after pressing enter if one is included
+def print_formatted_error(e, modulename, writer=None, block=None):
     if type(e) is not SkipException:
-        import sys
-        line = sys.exc_info()[2].tb_lineno
-        send("ERROR in module %s at line #%i" % (modulename,line))
+        msg = "ERROR in module %s at line #%i" % (modulename,error_line())
+        if writer is not None:
+            writer.send(msg)
+        else:
+            print msg
     print e
     if block is not None:
         block()
     print "--- EXITED %s MODULE ---" % (modulename)
     print
 
+# Line of this script the exception being handled was raised from (the deepest
+# one, so errors inside a module point into the module)
+def error_line():
+    import os, sys, traceback
+    line = sys.exc_info()[2].tb_lineno
+    for filename, lineno, function, text in traceback.extract_tb(sys.exc_info()[2]):
+        if os.path.basename(filename) == os.path.basename(__file__):
+            line = lineno
+    return line
+
 # Custom Exception class for skipping modules
 class SkipException(Exception):
     def __init__(self,module):
@@ -87,40 +134,47 @@ class SkipException(Exception):
     def __str__(self):
         return "Skipping module %s (disabled)..." % (self.module)
 
-# Use this to send a string out to the console while running and also writer it to
-# the spreadsheet output
-def send(msg, blank=False):
-    print msg
-    if blank:
-        writer.writerow(["",msg])
-    else:
-        writer.writerow([msg])
-
-def format_query(field,value):
-    if value == "NULL":
-        return "%s IS NULL" % (field)
-    elif type(value) == str:
-        return "%s = '%s'" % (field, value)
-    elif type(value) == int:
-        return "%s = %i" %(field, value)
-    elif type(value) == float:
-        return "%s = %f" %(field, value)
-    else:
-        return "ERROR in format_query!"
-
+# Collects a module's spreadsheet rows so modules can run in any order (or in
+# other processes) and still be written out in module order. Has the writerow and
+# writerows of a csv writer, plus send.
+class ModuleWriter(object):
+    def __init__(self):
+        self.rows = []
+    def writerow(self, row):
+        self.rows.append(list(row))
+    def writerows(self, rows):
+        for row in rows:
+            self.writerow(row)
+    # Use this to send a string out to the console while running and also write it
+    # to the spreadsheet output
+    def send(self, msg, blank=False):
+        print msg
+        if blank:
+            self.writerow(["",msg])
+        else:
+            self.writerow([msg])
 
 ### SETUP MODULE
-# Imports necessary libraries, sets environment workspace, and creates CSV writer
-# object.
+# Imports necessary libraries and sets environment workspace. This also runs in
+# every module worker process, so nothing here may write anything.
 try:
     modulename = "SETUP"
-    print_module_start()
+    print_module_start(modulename)
 
     print "Importing libraries..."
     import arcpy
     from arcpy import env
     import csv
-    import xlrd
+    import multiprocessing
+    import os
+    import hnglib.customers
+    import hnglib.duplicates
+    import hnglib.gdb
+    import hnglib.meters
+    import hnglib.pipeline
+    import hnglib.profiling
+    import hnglib.snapshot
+    import hnglib.taxing
 
     # Environment settings
     print "Setting environment..."
@@ -128,153 +182,60 @@ try:
     env.workspace = gdb
     env.overwriteOutput = OPTIONS["OVERWRITE_LAYERS"]
 
-    # Local variables
-    print "Setting local variables..."
-    writer = csv.writer(open(OPTIONS["OUTPUT_FILEPATH"],'wb'),dialect='excel')
-
-    print_module_end()
+    print_module_end(modulename)
 except Exception as e:
-    print_formatted_error(e)
+    print_formatted_error(e,modulename)
 
 
 ### TAXING DISTRICTS MODULE
 # Counts meters per ISD/ESD pair and ISD w/o an ESD. Also splits count up by
 # ACTIVE/ON, INACTIVE/ON, and OFF. Checks that every meter is contained within an ISD
 # and includes the number which don't.
-try:
+def taxing_districts(writer):
     modulename = "TAXING_DISTRICTS"
-    print_module_start()
-    if not MODULE_ON[modulename]: raise SkipException(modulename)
-
-    ### Module variables 
-    # First define the suffix for MakeFeatureLayer, working polygon layers, and
-    # customer table
-    print "Setting module variables..."
-    layersuffix = "_layer"
-    meters = "meter_ref"
-    districts = "Districts"
-    ESDs_layer, ISDs_layer = districts + "\ESDs", districts + "\ISDs"
-    customer_info_xls = "S:\Hughes_ArcGIS\current_customer_info.xls"
 
     # This is the header row in the *.csv file
     print "Writing header row..."
-    writer.writerow(["County","ISD","ESD","ACTIVE/ON","INACTIVE/ON","OFF","TOTAL"])
-
-    # Next do MakeFeatureLayer on each layer, naming the new layer using the suffix
-    print "Performing MakeFeatureLayer..."
-    arcpy.MakeFeatureLayer_management(ESDs_layer,ESDs_layer+layersuffix)
-    arcpy.MakeFeatureLayer_management(ISDs_layer,ISDs_layer+layersuffix)
-    arcpy.MakeFeatureLayer_management(meters,meters+layersuffix)
-    ESDs_layer += layersuffix
-    ISDs_layer += layersuffix
-    meters += layersuffix
-    print "Module setup complete"
-    print
+    writer.writerow(hnglib.taxing.HEADER)
 
 
     ### Analysis/reporting
-    # Joining the customer info for ACTIVE/INACTIVE calculation
-    print "Joining customer info to meters layer..."
-    customer_info_table = "customer_info_table"
-    arcpy.ExcelToTable_conversion(customer_info_xls,customer_info_table,"servloc")
-    arcpy.AddJoin_management(meters,"serv_id",customer_info_table,"serv_id")
+    # Joining the customer info for ACTIVE/INACTIVE calculation. The snapshot's
+    # customer rows go into a dict keyed by serv_id and are matched to each meter
+    # in memory.
+    print "Reading customer info..."
+    customer_status = hnglib.customers.customer_status(snapshot["CUSI"])
+    print "Reading meters..."
+    meter_data = snapshot["meter_ref"].points(["serv_id"])
+    print "Joining customer info to meters..."
+    meter_data, unjoined = hnglib.customers.join_status(meter_data,customer_status)
 
     # Count meters for validation purposes
-    metercount = int(str(arcpy.GetCount_management(meters)))
+    metercount = len(meter_data)
     print "%i features in meter layer" % (metercount)
 
+    # Report meters whose service ID is missing from the customer sheet
+    if len(unjoined) > 0:
+        writer.send("**WARNING**")
+        writer.send("    %i meters have no matching serv_id in the customer info sheet and are left out of the ACTIVE/INACTIVE and ON/OFF columns:" % (len(unjoined)))
+        for servid in unjoined:
+            writer.writerow(["",servid])
+        writer.send("***********")
+
     print "Setup complete."
     print
 
-    # Now loop inside ESDs_layer and then ISDs_layer
+    # Read the districts once, then let the engine assign each meter to its ISD and
+    # ESD in a single pass and build the report rows from that
+    ESDs = snapshot["ESDs"]
+    ISDs = snapshot["ISDs"]
+
+    print "Assigning %i meters to %i ISDs and %i ESDs..." % (len(meter_data),len(ISDs),len(ESDs))
+    rows, totals = hnglib.taxing.build_rows(ISDs,ESDs,meter_data,OPTIONS[modulename]["WORKERS"])
+    activeontotal, inactiveontotal, offtotal, total = totals
     print "Writing data..."
-    ESD_OBJECTID = {}
-    ESDs = arcpy.SearchCursor(ESDs_layer)
-    for ESD in ESDs:
-        ESD_OBJECTID[ESD.OBJECTID] = [ESD.COUNTY,ESD.NUMBER]
-
-    # Check that joined table actually carried over data
-    print "Checking join..."
-    pts = arcpy.SearchCursor(meters)
-    pt = pts.next()
-    if pt.getValue(customer_info_table+".serv_id") is None:
-        send("**ERROR**")
-        send("    Data in joined table not coming through, expect zeroes for ACTIVE/INACTIVE and ON/OFF columns (did you remember to delete column \"desc\"?)")
-        send("*********")
-
-    # total is the total number of meters counted, ISD_total is the total number of meters inside the current ISD, and ESD_counted is the number of meters in the current ISD which have been accounted for within an ESD. After ESD looping, the difference between ISD_total and ESD_counted is the number of meters inside the current ISD which do not have an ESD.
-    activeontotal, inactiveontotal, offtotal, total = 0, 0, 0, 0
-    ISD_total, ESD_counted = 0, 0
-    # number_of_ISDs and ISD_counter are just used to print to the terminal to give an indication of how far along the scripts is.
-    number_of_ISDs = arcpy.GetCount_management(ISDs_layer)
-    ISD_counter = 0
-    ISDs = arcpy.SearchCursor(ISDs_layer)
-    for ISD in ISDs:
-        ISD_counter += 1
-        print "Calculating " + str(ISD_counter) + "/" + str(number_of_ISDs) + " (" + str(ISD.NAME) + ")"
-        arcpy.SelectLayerByAttribute_management(ISDs_layer,"NEW_SELECTION",'"OBJECTID" = ' + str(ISD.OBJECTID))
-        arcpy.SelectLayerByLocation_management(meters,"WITHIN",ISDs_layer)
-        ISD_total = int(str(arcpy.GetCount_management(meters)))
-        ESD_counted, ESD_active_on_counted = 0, 0
-        ESD_inactive_on_counted, ESD_off_counted = 0, 0
-        if ISD_total > 0:
-            for ESD in ESD_OBJECTID:
-                arcpy.SelectLayerByAttribute_management(ISDs_layer,"NEW_SELECTION",'"OBJECTID" = ' + str(ISD.OBJECTID))
-                arcpy.SelectLayerByLocation_management(meters,"WITHIN",ISDs_layer)
-                arcpy.SelectLayerByAttribute_management(ESDs_layer,"NEW_SELECTION",'"OBJECTID" = ' + str(ESD))
-                arcpy.SelectLayerByLocation_management(meters,"WITHIN",ESDs_layer,"","SUBSET_SELECTION")
-                count = int(str(arcpy.GetCount_management(meters)))
-                print ".",
-                if count > 0:
-                    arcpy.SelectLayerByAttribute_management(meters,"SUBSET_SELECTION",customer_info_table+'.serv_stat = \'ACTIVE\'')
-                    arcpy.SelectLayerByAttribute_management(meters,"SUBSET_SELECTION",customer_info_table+'.meter_on = 1')
-                    activeoncount = int(str(arcpy.GetCount_management(meters)))
-                    arcpy.SelectLayerByLocation_management(meters,"WITHIN",ISDs_layer)
-                    arcpy.SelectLayerByLocation_management(meters,"WITHIN",ESDs_layer,"","SUBSET_SELECTION")
-                    arcpy.SelectLayerByAttribute_management(meters,"SUBSET_SELECTION",customer_info_table+'.serv_stat = \'INACTIVE\'')
-                    arcpy.SelectLayerByAttribute_management(meters,"SUBSET_SELECTION",customer_info_table+'.meter_on = 1')
-                    inactiveoncount = int(str(arcpy.GetCount_management(meters)))
-                    arcpy.SelectLayerByLocation_management(meters,"WITHIN",ISDs_layer)
-                    arcpy.SelectLayerByLocation_management(meters,"WITHIN",ESDs_layer,"","SUBSET_SELECTION")
-                    arcpy.SelectLayerByAttribute_management(meters,"SUBSET_SELECTION",customer_info_table+'.meter_on = 0')
-                    offcount = int(str(arcpy.GetCount_management(meters)))
-                    writer.writerow([ESD_OBJECTID[ESD][0],ISD.NAME2,ESD_OBJECTID[ESD][0] + " " + ESD_OBJECTID[ESD][1],activeoncount,inactiveoncount,offcount,count])
-                    
-                    ESD_counted += count
-                    ESD_active_on_counted += activeoncount
-                    ESD_inactive_on_counted += inactiveoncount
-                    ESD_off_counted += offcount
-
-                    total += count
-                    activeontotal += activeoncount
-                    inactiveontotal += inactiveoncount
-                    offtotal += offcount
-            print
-        if ESD_counted != ISD_total and ISD_total > 0:
-            arcpy.SelectLayerByAttribute_management(ISDs_layer,"NEW_SELECTION",'"OBJECTID" = ' + str(ISD.OBJECTID))
-            arcpy.SelectLayerByLocation_management(meters,"WITHIN",ISDs_layer)
-            count = int(str(arcpy.GetCount_management(meters)))
-            count -= ESD_counted
-            arcpy.SelectLayerByAttribute_management(meters,"SUBSET_SELECTION",customer_info_table+'.serv_stat = \'ACTIVE\'')
-            activeoncount = int(str(arcpy.GetCount_management(meters)))
-            activeoncount -= ESD_active_on_counted
-            arcpy.SelectLayerByLocation_management(meters,"WITHIN",ISDs_layer)
-            arcpy.SelectLayerByAttribute_management(meters,"SUBSET_SELECTION",customer_info_table+'.serv_stat = \'INACTIVE\'')
-            arcpy.SelectLayerByAttribute_management(meters,"SUBSET_SELECTION",customer_info_table+'.meter_on = 1')
-            inactiveoncount = int(str(arcpy.GetCount_management(meters)))
-            inactiveoncount -= ESD_inactive_on_counted
-            arcpy.SelectLayerByLocation_management(meters,"WITHIN",ISDs_layer)
-            arcpy.SelectLayerByAttribute_management(meters,"SUBSET_SELECTION",customer_info_table+'.serv_stat = \'INACTIVE\'')
-            arcpy.SelectLayerByAttribute_management(meters,"SUBSET_SELECTION",customer_info_table+'.meter_on = 0')
-            offcount = int(str(arcpy.GetCount_management(meters)))
-            offcount -= ESD_off_counted
-            writer.writerow(["",ISD.NAME2,"",activeoncount,inactiveoncount,offcount,count])
-
-            total += count
-            activeontotal += activeoncount
-            inactiveontotal += inactiveoncount
-            offtotal += offcount
-                                    
+    writer.writerows(rows)
+
     writer.writerow([]) 
     writer.writerow(["","","TOTAL",activeontotal,inactiveontotal,offtotal,total])
     writer.writerow([]) 
@@ -288,41 +249,27 @@ try:
 
     print
 
-    arcpy.Delete_management(customer_info_table)
-    print_module_end()
-except Exception as e:
-    print_formatted_error(e)
-
 
 ### PIPELINE LENGTH MODULE
 # Counts pipeline length, split up by RRC area. The OPTIONS dictionary defined in the
 # settings sections above determines which company IDs will be counted (not
 # implemented, currently only calculates for HNG as this is the most common case).
-try:
+def pipeline_length(writer):
     modulename = "PIPELINE_LENGTH"
-    print_module_start()
-    if not MODULE_ON[modulename]: raise SkipException(modulename)
 
     ### Module variables 
-    # First define the suffix for MakeFeatureLayer, list of working layers (polygons only), and field name
+    # The lines layer (written to below) and its snapshot, and field name
     print "Setting module variables..."
-    layersuffix = "_layer"
     lines = "Gas_Lines"
-    RRC = "RRC_Areas"
-    intersection = "intersection"
     calculated_field = "length_ft"
-
-    # Next do MakeFeatureLayer on each layer, naming the new layer using the suffix
-    print "Performing MakeFeatureLayer..."
-    arcpy.MakeFeatureLayer_management(lines,lines+layersuffix)
-    lines += layersuffix
-    arcpy.MakeFeatureLayer_management(RRC,RRC+layersuffix)
-    RRC += layersuffix
+    HNG = """ "company" = 'HNG' """
 
     print "Module setup complete"
     print
 
-    areas = [{'Name': row.Name, 'OBJECTID': row.OBJECTID} for row in arcpy.SearchCursor(RRC)]
+    pipes_table = snapshot["Gas_Lines"]
+    areas = snapshot["RRC_Areas"]
+    feet_per_unit = hnglib.gdb.feet_per_unit(SPATIAL_FRAME)
     for tablesetup in OPTIONS[modulename]["TABLE_SETUP_QUERIES"]:
         writer.writerow([tablesetup[0]])
 
@@ -337,39 +284,24 @@ try:
         header.append("Area Subtotal")
         writer.writerow(header)
 
-        # Creating intersection layer based on table setup query
-        print "Creating intersection layer based on table setup query..."
-        intersection = intersection.strip(layersuffix)
-        arcpy.SelectLayerByAttribute_management(lines,"NEW_SELECTION",tablesetup[1])
-        arcpy.SelectLayerByAttribute_management(RRC,"CLEAR_SELECTION")
-        arcpy.Intersect_analysis([lines,RRC],intersection,"","","LINE")
-        arcpy.CalculateField_management(intersection,calculated_field,"float(!SHAPE.length@FEET!)","PYTHON")
-
-        arcpy.MakeFeatureLayer_management(intersection,intersection+layersuffix)
-        intersection += layersuffix
-        print arcpy.GetCount_management(intersection)
-
+        # Clipping the lines selected by the table setup query against the RRC areas,
+        # bucketing the clipped lengths by area and size category
+        print "Clipping lines to RRC areas..."
+        pipes = pipes_table.lines(["pipe_size"],tablesetup[1])
+        print "%i lines selected" % (len(pipes))
+        matrix = hnglib.pipeline.length_matrix(pipes,areas,sizes,feet_per_unit)
 
         # Making the table
         print "Calculating table cells..."
         totallength = 0.0
         sizesubtotal = {}
 
-        for area in areas:
+        for area, lengths in zip(areas,matrix):
             arealength = 0.0
             row = [str(area['Name'])]
-            arcpy.SelectLayerByAttribute_management(RRC,"NEW_SELECTION",'"OBJECTID" = ' + str(area['OBJECTID']))
-            
-            for sizelabel in sizeorder:
-                length = 0.0
-                for size in sizes[sizelabel]:
-                    arcpy.SelectLayerByLocation_management(intersection,"WITHIN",RRC)
-                    arcpy.SelectLayerByAttribute_management(intersection,"SUBSET_SELECTION",format_query('pipe_size',size))
-
-                    for feature in arcpy.da.SearchCursor(intersection,['length_ft']):
-                        if isinstance(feature[0],float):
-                            length += feature[0]
 
+            for sizelabel in sizeorder:
+                length = lengths.get(sizelabel,0.0)
                 lengthmi = round(length/5280,3)
                 row.append(lengthmi)
                 if sizelabel in sizesubtotal:
@@ -393,18 +325,16 @@ try:
         row.append(totallength)
         writer.writerow(row)
         writer.writerow([])
-
-        print "Cleaning up table '%s'..." % (tablesetup[0])
-        arcpy.Delete_management(intersection)
         print
 
-    # Check Total calculation for verification
-    arcpy.SelectLayerByAttribute_management(lines,"NEW_SELECTION",""" "company" = 'HNG' """)
-    arcpy.CalculateField_management(lines,calculated_field,"float(!SHAPE.length@FEET!)","PYTHON")
-    checktotal = 0.0
-    for line in arcpy.SearchCursor(lines):
-        checktotal += line.length_ft
-    checktotal = round(checktotal/5280,3)
+    # Check Total calculation for verification. Refreshes length_ft on the HNG lines,
+    # measuring the snapshot's lines and only writing back values which are out of date
+    HNG_rows = pipes_table.select(HNG)
+    lengths, updated = hnglib.gdb.write_lengths(lines,pipes_table.oids[HNG_rows].tolist(),
+                                                pipes_table.column(calculated_field)[HNG_rows].tolist(),
+                                                (pipes_table.lengths()[HNG_rows]*feet_per_unit).tolist(),calculated_field)
+    print "Updated %s on %i of %i HNG lines" % (calculated_field,updated,len(lengths))
+    checktotal = round(sum(lengths.values())/5280,3)
 
     row = [""]
     for label in sizeorder:
@@ -414,164 +344,297 @@ try:
     writer.writerow(row)
     print "Check total has %.3f mi of pipe" % (checktotal)
 
+    # Overlapping HNG lines, i.e. the length counted more than once in the totals
+    # above (a stretch shared by N lines adds N-1 times its length)
+    tolerance = OPTIONS[modulename]["OVERLAP_TOLERANCE"]
+    if tolerance is not None:
+        print "Checking for overlapping HNG lines..."
+        HNG_lines = pipes_table.lines(["OID@"],HNG)
+        overlaps, excess = hnglib.duplicates.find_overlaps([(line[1],line[0]) for line in HNG_lines],tolerance["DISTANCE_FT"]/feet_per_unit,tolerance["ANGLE_DEG"])
+        overlaptotal = round(excess*feet_per_unit/5280,3)
+        row[-2:] = ["Overlapping Length",overlaptotal]
+        writer.writerow(row)
+        print "%i pairs of HNG lines overlap, %.3f mi of pipe counted more than once" % (len(overlaps),overlaptotal)
+
     writer.writerow([]) 
     writer.writerow([]) 
 
-    print_module_end()
-except Exception as e:
-    print_formatted_error(e)
-
 
 ### VERIFY METERS MODULE
 # Verifies that meter info in CUSI and ESRI match.
-try:
+def verify_meters(writer):
     modulename = "VERIFY_METERS"
-    print_module_start()
-    if not MODULE_ON[modulename]: raise SkipException(modulename)
 
     ### Module variables 
     print "Setting module variables..."
     ESRI_meters = "meter_ref"
-    CUSI_meters = "S:\Hughes_ArcGIS\current_customer_info.xls"
-    CUSI_reader = xlrd.open_workbook(CUSI_meters)
-    CUSI_sheet = CUSI_reader.sheet_by_index(0)
     print
 
-    # Getting lists of meters in the ESRI and CUSI databases
-    print "Getting ESRI service IDs..."
-    ESRI_cursor = arcpy.SearchCursor(ESRI_meters)
-    ESRI_list = []
-    for feature in ESRI_cursor:
-        ESRI_list.append(int(feature.serv_id))
-    ESRI_set = set(ESRI_list)
+    # Reconciling both sides of the snapshot by service ID
+    print "Getting ESRI and CUSI service IDs..."
+    ESRI_rows = snapshot[ESRI_meters].rows(["serv_id","latitude","longitude"])
+    diff = hnglib.meters.reconcile(ESRI_rows,snapshot["CUSI"])
+
     writer.writerow(["Meter Report"])
-    send("ESRI has %i features (%i unique), last service ID is %i" % (len(ESRI_list),len(ESRI_set),ESRI_list[-1]))
+    writer.send("ESRI has %i features (%i unique), last service ID is %i" % (diff.ESRI_count,diff.ESRI_unique,diff.ESRI_last))
+    if diff.ESRI_blank > 0:
+        writer.send("%i ESRI features have no service ID" % (diff.ESRI_blank))
     print
-
-    print "Getting CUSI service IDs..."
-    CUSI_list = map(int,CUSI_sheet.col_values(2)[1:])
-    CUSI_set = set(CUSI_list)
-    send("CUSI has %i features (%i unique), last service ID is %i" % (len(CUSI_list), len(CUSI_set),CUSI_list[-1]))
+    writer.send("CUSI has %i features (%i unique), last service ID is %i" % (diff.CUSI_count,diff.CUSI_unique,diff.CUSI_last))
     print
 
-    union = list(ESRI_set|CUSI_set)
-    not_in_ESRI = list(CUSI_set-ESRI_set)
-    send("Together they have %i unique features total, and %i meters are missing from ESRI" % (len(union),len(not_in_ESRI)))
+    writer.send("Together they have %i unique features total, and %i meters are missing from ESRI" % (diff.union_count,len(diff.not_in_ESRI)))
 
-    ESRI_doubles_list = ESRI_list[:]
-    for entry in list(ESRI_set):
-        ESRI_doubles_list.remove(entry)
-    if len(ESRI_doubles_list) > 0:
-        send(str(len(set(ESRI_doubles_list))) + " service IDs occur more than once in ESRI.")
+    if len(diff.doubles) > 0:
+        writer.send(str(len(diff.doubles)) + " service IDs occur more than once in ESRI.")
+        for serv_id in sorted(diff.doubles):
+            writer.send("Service ID %i occurs %i times" % (serv_id,diff.doubles[serv_id]),True)
 
-        # Create new search cursor to go through ESRI data, deleting old if nec.
-        if ESRI_cursor: del ESRI_cursor
-        ESRI_cursor = arcpy.SearchCursor(ESRI_meters)
         # This will print an array of lat/long/serv_id of all muliple data points
-        ESRI_doubles_data = []
-        for feature in ESRI_cursor:
-            if int(feature.serv_id) in ESRI_doubles_list:
-                ESRI_doubles_data.append([feature.serv_id,feature.latitude,feature.longitude])
-        send("All ESRI features which have the same service ID as another feature:")
+        writer.send("All ESRI features which have the same service ID as another feature:")
         print
-        for feature in ESRI_doubles_data:
+        for feature in diff.doubles_data:
             writer.writerow(["",feature])
             print feature
         print
     else:
-        send("Every service ID in ESRI is unique (no doubles)")
+        writer.send("Every service ID in ESRI is unique (no doubles)")
         print
 
+    # Meters in ESRI which CUSI has no customer record for
+    if len(diff.not_in_CUSI) > 0:
+        writer.send("%i service IDs in ESRI are missing from CUSI:" % (len(diff.not_in_CUSI)))
+        for servid in diff.not_in_CUSI:
+            writer.writerow(["",servid])
+        print diff.not_in_CUSI
+    else:
+        writer.send("Every service ID in ESRI is in CUSI")
+    print
+
     print "Service IDs missing from ESRI:"
-    print not_in_ESRI
+    print diff.not_in_ESRI
     print
     # now to see if we have lat/long data for the missing meters
-    missing_meters = []
-    dead_meters = []
-    for i in range(CUSI_sheet.nrows)[1:]:
-        if int(CUSI_sheet.row_values(i)[2]) in not_in_ESRI:
-            missing_meters.append(CUSI_sheet.row_values(i)[:3])
-    for feature in missing_meters:
-        if str(feature[0]) != '':
-            print "Service ID %i should be located at lat/long %s/%s" % (int(feature[2]),str(feature[0]),str(feature[1]))
-        else:
-            dead_meters.append(feature)
+    missing_meters = diff.missing_meters
+    dead_meters = diff.dead_meters
+    for feature in diff.located_meters:
+        print "Service ID %i should be located at lat/long %s/%s" % (feature[2],str(feature[0]),str(feature[1]))
     print
-    send("Still %i meters without any lat/long data." % (len(dead_meters)))
+    writer.send("Still %i meters without any lat/long data." % (len(dead_meters)))
     print "Service IDs: ",
     for feature in dead_meters:
-        servid = str(int(feature[2]))
+        servid = str(feature[2])
         writer.writerow(["",servid])
         print servid + ",",
     print
     print
 
-    add_cursor = arcpy.InsertCursor(ESRI_meters)
-    # Now to create those missing meters
-    print "Creating missing meters in ESRI..."
-    added_meters = 0
+    # Now to create those missing meters, all in one edit operation
+    dry_run = OPTIONS[modulename]["DRY_RUN"]
+    print "Creating missing meters in ESRI%s..." % (" (dry run)" if dry_run else "")
+    added = hnglib.gdb.insert_meters(ESRI_meters,missing_meters,dry_run)
+    added_set = set(added)
     for feature in missing_meters:
-        if str(feature[0]) != '':
-            new_feature = add_cursor.newRow()
-            new_feature.Shape = arcpy.Point(feature[1],feature[0])
-            new_feature.serv_id = feature[2]
-            add_cursor.insertRow(new_feature)
-            send("Added " + str(feature[2]))
-            added_meters += 1
+        if feature[2] in added_set:
+            writer.send("%s %s" % ("Would add" if dry_run else "Added",feature[2]))
         else:
-            send(str(feature[2]) + " has no lat/long info and could not be added to ESRI")
-    send("Added %i new meters" % (added_meters))
-    send("")
-
-    print_module_end()
-except Exception as e:
-    print_formatted_error(e)
+            writer.send(str(feature[2]) + " has no lat/long info and could not be added to ESRI")
+    writer.send("%s %i new meters" % ("Would add" if dry_run else "Added",len(added)))
+    writer.send("")
 
 
 ### COMPANY ID MODULE
 # Uses the OPTIONS["COMPANY_ID"]["INCLUDE_COMPANY"] list to find and list line
 # features which do not have the specified company IDs and lists them
-try:
+def company_id(writer):
     modulename = "COMPANY_ID"
-    print_module_start()
-    if not MODULE_ON[modulename]: raise SkipException(modulename)
 
     ### Module variables 
-    lines = "Gas_Lines"
-    suffix = "_layer"
     allowed = OPTIONS["COMPANY_ID"]["INCLUDE_COMPANY"]
 
-    ### Preparing lines layer
-    print "Preparing lines..."
-    arcpy.MakeFeatureLayer_management(lines,lines+suffix)
-    lines += suffix
-
     ### Checking company ID
-    first = True
-    for company in allowed:
-        if first:
-            arcpy.SelectLayerByAttribute_management(lines,"NEW_SELECTION","company = \'%s\'" % (company))
-            first = False
-        else:
-            arcpy.SelectLayerByAttribute_management(lines,"ADD_TO_SELECTION","company = \'%s\'" % (company))
-    arcpy.SelectLayerByAttribute_management(lines,"SWITCH_SELECTION")
-    total_bad = int(arcpy.GetCount_management(lines).getOutput(0))
+    # Lines with no company are not in the allowed list either
+    bad = [oid for oid, company in snapshot["Gas_Lines"].rows(["OID@","company"]) if company not in allowed]
+    total_bad = len(bad)
     
     if total_bad > 0:
-        send("%i gas line features without valid company IDs" % (total_bad))
-        send("OBJECTIDs:")
-        for line in arcpy.SearchCursor(lines):
-            send(line.getValue("OBJECTID"),True)
+        writer.send("%i gas line features without valid company IDs" % (total_bad))
+        writer.send("OBJECTIDs:")
+        for oid in bad:
+            writer.send(oid,True)
     else:
-        send("All gas lines have a valid company ID")
+        writer.send("All gas lines have a valid company ID")
+
+    writer.send("")
+
+### DATA SNAPSHOT
+# Every dataset a module reads, loaded once per run into a read-only in-memory
+# snapshot (see hnglib/snapshot.py) as [kind, source, fields]. Any other field
+# the pipeline tables' setup queries use is added to the lines when the snapshot
+# is built.
+DATASETS = {
+    "meter_ref": ["points", "meter_ref", ["serv_id", "latitude", "longitude"]],
+    "Gas_Lines": ["lines", "Gas_Lines", ["company", "pipe_material", "pipe_size", "length_ft"]],
+    "RRC_Areas": ["polygons", "RRC_Areas", ["Name"]],
+    "ESDs": ["polygons", "Districts\\ESDs", ["COUNTY", "NUMBER"]],
+    "ISDs": ["polygons", "Districts\\ISDs", ["NAME2"]],
+    "CUSI": ["customers", "S:\\Hughes_ArcGIS\\current_customer_info.xls", None]
+}
+# Every layer is read in this layer's spatial reference, so meters, districts,
+# areas and lines line up whatever each one is stored in (the cursors project
+# them, as SelectLayerByLocation and Intersect did). It has to be projected, since
+# line lengths are measured in its units.
+SPATIAL_FRAME = "Gas_Lines"
+
+# The snapshot the modules read from. The main process builds it before any
+# module runs and hands it to each worker process as the worker starts.
+snapshot = None
+
+def set_snapshot(data):
+    global snapshot
+    snapshot = data
+
+# Sets up a module worker process: the snapshot, and profiling if it's on
+def start_worker(data, profile):
+    set_snapshot(data)
+    if profile:
+        hnglib.profiling.enable()
+
+### MODULE SCHEDULER
+# Every module in report order, with the layers (and the CUSI customer sheet) it
+# reads and writes. A module waits for the modules before it which write
+# something it uses, or use something it writes; the rest run side by side.
+MODULES = [
+    ["TAXING_DISTRICTS", taxing_districts, ["meter_ref", "ESDs", "ISDs", "CUSI"], []],
+    ["PIPELINE_LENGTH", pipeline_length, ["Gas_Lines", "RRC_Areas"], ["Gas_Lines"]],
+    ["VERIFY_METERS", verify_meters, ["meter_ref", "CUSI"], ["meter_ref"]],
+    ["COMPANY_ID", company_id, ["Gas_Lines"], []]
+]
+
+# Runs one module with its own error capture, returning its report rows and its
+# profile entries (empty unless profiling is on)
+def run_module(modulename):
+    writer = ModuleWriter()
+    with hnglib.profiling.section(modulename):
+        try:
+            print_module_start(modulename)
+            if not MODULE_ON[modulename]: raise SkipException(modulename)
+            [module[1] for module in MODULES if module[0] == modulename][0](writer)
+            print_module_end(modulename)
+        except Exception as e:
+            print_formatted_error(e,modulename,writer)
+    profile = hnglib.profiling.take(modulename) if hnglib.profiling.enabled() else []
+    return writer.rows, profile
+
+# Groups the modules into stages which run one after another; the modules in a
+# stage run at the same time
+def module_stages(modules):
+    stage_of = []
+    for i, (name, function, reads, writes) in enumerate(modules):
+        stage = 0
+        for j in range(i):
+            other_reads, other_writes = modules[j][2], modules[j][3]
+            if set(writes) & set(other_reads + other_writes) or set(reads) & set(other_writes):
+                stage = max(stage, stage_of[j] + 1)
+        stage_of.append(stage)
+    stages = [[] for stage in range(max(stage_of) + 1)] if modules else []
+    for module, stage in zip(modules, stage_of):
+        stages[stage].append(module[0])
+    return stages
+
+# Modules of a stage which may run in a worker process: enabled ones which write
+# nothing (writes stay in the process holding the snapshot, see run_modules) and
+# have no WORKERS option above 1 (they start worker processes of their own, which
+# a pool worker can't)
+def pooled_modules(stage):
+    return [module[0] for module in MODULES if module[0] in stage and MODULE_ON[module[0]] and
+            not module[3] and OPTIONS.get(module[0], {}).get("WORKERS", 1) <= 1]
+
+# Runs every module and returns {module name: (report rows, profile entries)}. When
+# a stage has more than one module the ones which only read go out to a worker
+# pool started for that stage, whose workers get only the datasets those modules
+# read; the rest run in this process meanwhile. Once a stage is done, whatever its
+# modules wrote is dropped from the snapshot, so later modules read it afresh.
+def run_modules(workers):
+    results = {}
+    for stage in module_stages(MODULES):
+        pooled = pooled_modules(stage) if workers > 1 and len(stage) > 1 else []
+        pool = None
+        if pooled:
+            reads = set([name for module in MODULES if module[0] in pooled for name in module[2]])
+            pool = multiprocessing.Pool(min(workers, len(pooled)),start_worker,(snapshot.subset(reads),hnglib.profiling.enabled()))
+        try:
+            pending = []
+            for modulename in pooled:
+                pending.append((modulename, pool.apply_async(run_module, (modulename,))))
+            for modulename in stage:
+                if modulename not in pooled:
+                    results[modulename] = run_module(modulename)
+            for modulename, result in pending:
+                results[modulename] = result.get()
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+        snapshot.invalidate([name for module in MODULES if module[0] in stage and MODULE_ON[module[0]]
+                             for name in module[3]])
+    return results
+
+
+### REPORT
+# Reads every dataset the enabled modules use, once. A dataset which fails to load
+# here is tried again by the modules using it, so the error lands in their section
+# of the report.
+def load_snapshot():
+    modulename = "SNAPSHOT"
+    print_module_start(modulename)
+    for tablesetup in OPTIONS["PIPELINE_LENGTH"]["TABLE_SETUP_QUERIES"]:
+        for field in hnglib.snapshot.where_fields(tablesetup[1]):
+            if field not in DATASETS["Gas_Lines"][2]:
+                DATASETS["Gas_Lines"][2].append(field)
+    set_snapshot(hnglib.snapshot.Snapshot(DATASETS,OPTIONS["CACHE_FOLDER"],SPATIAL_FRAME))
+    names = set([name for module in MODULES if MODULE_ON[module[0]] for name in module[2]])
+    with hnglib.profiling.section(modulename):
+        for name in sorted(names):
+            try:
+                print "Reading %s..." % (name)
+                snapshot.load([name])
+            except Exception as e:
+                print_formatted_error(e,modulename)
+    print_module_end(modulename)
+
+# Writes every module's rows to the report spreadsheet in module order
+def write_report(results, filepath):
+    with hnglib.profiling.section("REPORT"):
+        f = open(filepath,'wb')
+        try:
+            writer = csv.writer(f,dialect='excel')
+            for module in MODULES:
+                rows, profile = results[module[0]]
+                hnglib.profiling.merge(profile)
+                with hnglib.profiling.timed("csv.writerows",len(rows)):
+                    writer.writerows(rows)
+        finally:
+            f.close()
 
-    send("")
-    print_module_end()
-except Exception as e:
-    print_formatted_error(e)
 
 ### END OF SCRIPT
-print "--- ALL MODULES COMPLETED ---"
-# Wait for user input to allow for review of console messages (able to see results of
-# script without having to open the report)
-raw_input('(Press enter to save report and finish up)')
+# Only the process started from the command line runs the modules and writes the
+# report (module worker processes import this script for the module functions)
+if __name__ == "__main__":
+    if OPTIONS["PROFILE"]:
+        hnglib.profiling.enable()
+
+    load_snapshot()
+    results = run_modules(OPTIONS["MODULE_WORKERS"])
+    write_report(results,OPTIONS["OUTPUT_FILEPATH"])
+
+    if hnglib.profiling.enabled():
+        hnglib.profiling.print_summary(OPTIONS["PROFILE_TOP"])
+        profile_files = hnglib.profiling.write_profile(os.path.splitext(OPTIONS["OUTPUT_FILEPATH"])[0] + "_profile")
+        print "Profile written to %s" % (", ".join(profile_files))
+
+    print "--- ALL MODULES COMPLETED ---"
+    # Wait for user input to allow for review of console messages (able to see results of
+    # script without having to open the report)
+    raw_input('(Press enter to save report and finish up)')
@@ -6,6 +6,8 @@
 print "Importing libraries..."
 import arcpy
 from arcpy import env
+import hnglib.duplicates
+import hnglib.gdb
 
 # Environment settings
 print "Setting environment..."
@@ -19,6 +21,11 @@ print "Setting local variables..."
 layersuffix = "_layer"
 lines = "Gas_Lines"
 calculated_field = "length_ft"
+# Tolerances for the overlapping segment check: lines running within
+# overlap_distance feet of each other and within overlap_angle degrees of
+# parallel are counted as overlapping
+overlap_distance = 0.5
+overlap_angle = 2.0
 
 # Next do MakeFeatureLayer on each layer, naming the new layer using the suffix
 arcpy.MakeFeatureLayer_management(lines,lines+layersuffix)
@@ -28,31 +35,45 @@ print "Setup complete."
 print
 
 try:
-	# Grabbing only HNG lines
-	arcpy.SelectLayerByAttribute_management(lines,"NEW_SELECTION",""" "company" = 'HNG' """)
+	# Hashing every line once (ARE_IDENTICAL_TO compared each HNG line against the
+	# whole layer, so every company's lines take part in the grouping)
+	resolution = arcpy.Describe(lines).spatialReference.XYResolution
+	all_lines = hnglib.gdb.read_polylines(lines,["OID@","length_ft","company"])
+	dupe_counts = hnglib.duplicates.duplicate_counts([(line[1],line[0]) for line in all_lines],resolution)
 
-	# Looping through line features
-	features = arcpy.SearchCursor(lines)
+	# Looping through HNG line features
 	extralength = 0.0
 	totallength = 0.0
-	for feature in features:
-		# Get line at cursor and select geometrically identical features
-		arcpy.SelectLayerByAttribute_management(lines,"NEW_SELECTION",'"OBJECTID" = ' + str(feature.OBJECTID))
-		arcpy.SelectLayerByLocation_management(lines,"ARE_IDENTICAL_TO",lines)
-		dupes = int(str(arcpy.GetCount_management(lines)))
+	for parts, OBJECTID, length, company in all_lines:
+		if company != 'HNG':
+			continue
+		dupes = dupe_counts[OBJECTID]
 		if dupes > 1:
-			length = str(feature.length_ft)
-			if length == "None":
+			if length is None:
 				length = 0.0
 			else:
 				length = float(length)
-			print "Feature %i is identical to %i other feature and has length %.2f" % (feature.OBJECTID,(dupes-1),length)
+			print "Feature %i is identical to %i other feature and has length %.2f" % (OBJECTID,(dupes-1),length)
 			extralength += length*(float(dupes-1)/float(dupes))
 			totallength += length
 	print
 	print "Total length of all features with duplicates: %f ft" % (totallength)
 	print "Total extra length due to duplicates: %f ft (%f mi)" % (extralength,extralength/5280)
 	print "Duplication factor: %f" % (totallength/(totallength-extralength))
+	print
+
+	# Partly overlapping or slightly offset HNG lines, which ARE_IDENTICAL_TO misses
+	print "Checking for overlapping HNG lines..."
+	feet_per_unit = hnglib.gdb.feet_per_unit(lines)
+	HNG_lines = [(line[1],line[0]) for line in all_lines if line[3] == 'HNG']
+	overlaps, excess = hnglib.duplicates.find_overlaps(HNG_lines,overlap_distance/feet_per_unit,overlap_angle)
+	for pair in sorted(overlaps):
+		print "Features %i and %i overlap for %.2f ft" % (pair[0],pair[1],overlaps[pair]*feet_per_unit)
+	print
+	# Where several lines share a stretch, all but one copy of it is extra length
+	overlaplength = excess*feet_per_unit
+	print "%i pairs of overlapping features" % (len(overlaps))
+	print "Total extra length due to overlaps: %f ft (%f mi)" % (overlaplength,overlaplength/5280)
 
 	print "Cleaning up..."
 
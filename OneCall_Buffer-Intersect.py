@@ -7,10 +7,9 @@ print "Importing libraries..."
 import arcpy
 from arcpy import env
 import datetime
-import glob, os
-import zipfile
-import shutil
-import time
+import os
+import hnglib.gdb
+import hnglib.onecall
 
 # Environment settings
 print "Setting environment..."
@@ -27,6 +26,13 @@ try:
 	desk = "OneCallWorkingDataset"
 	destination = "S:\Hughes_ArcGIS\Python_Output\OneCall\\" + formattedDate + "\\"
 	os.mkdir(destination)
+	# Number of worker processes exporting and zipping counties at once (1 runs them one after another, raise it to spread the counties over several processes)
+	workers = 1
+	# Set to True to also export every county the old way (Select_analysis to a shapefile folder) and check the zipped shapefiles match it
+	validate = False
+	# Set to True to keep a content key per county in state_file and only redo the counties whose lines (or county boundary) changed since the last delivery; the previous zips of the rest are copied over under today's date and marked as not new in manifest.csv
+	incremental = False
+	state_file = "S:\\Hughes_ArcGIS\\Python_Output\\cache\\OneCall.state"
 
 	# Create a working area
 	print "Creating temporary workspace..."
@@ -36,97 +42,82 @@ try:
 
 	# Working variables
 	print "Setting working variables..."
-	AP_Lines = desk + "\AP_Lines"
-	HNG_Lines = desk + "\HNG_Lines"
-	AP_Lines_Buffer = desk + "\AP_Lines_Buffer"
-	HNG_Lines_Buffer = desk + "\HNG_Lines_Buffer"
-	AP_Buffer_Width = "150 feet"
-	HNG_Buffer_Width = "100 feet"
-	AP_Lines_Intersect = desk + "\AP_Lines_Intersect"
-	HNG_Lines_Intersect = desk + "\HNG_Lines_Intersect"
-	AP_Lines_Multipart = desk + "\AP_Lines_Multipart"
-	HNG_Lines_Multipart = desk + "\HNG_Lines_Multipart"
+	# Each company: prefix, buffer width in feet, and whether to split buffers into single part features
+	companies = [["AP", 150, False], ["HNG", 100, True]]
+	feet_per_unit = hnglib.gdb.feet_per_unit(Gas_Lines)
 
 	print "Set up complete."
 	print
 
-	# Split Gas Lines by company
-	print "Splitting Gas_Lines layer by company..."
-	arcpy.Select_analysis(Gas_Lines,AP_Lines,'"company" = \'AP\'')
-	print "-Created " + AP_Lines + ", number of features:"
-	print arcpy.GetCount_management(AP_Lines)
-	arcpy.Select_analysis(Gas_Lines,HNG_Lines,'"company" = \'HNG\'')
-	print "-Created " + HNG_Lines + ", number of features:"
-	print arcpy.GetCount_management(HNG_Lines)
+	# Work out which counties changed since the last delivery
+	print "Reading " + Counties + "..."
+	# The counties are read in the lines' spatial reference so the two line up
+	county_areas = hnglib.gdb.read_polygons(Counties,["Name"],hnglib.gdb.spatial_reference(Gas_Lines))
+	state = hnglib.onecall.load_state(state_file) if incremental else None
+	new_state = {"version": hnglib.onecall.STATE_VERSION, "counties": {}}
+	manifest = []
+	tasks = []
+	plans = []
+	for prefix, width, single_part in companies:
+		print "Reading " + prefix + " lines..."
+		company_lines = hnglib.gdb.read_polylines(Gas_Lines,["OID@"],'"company" = \'' + prefix + '\'')
+		keys = hnglib.onecall.county_keys(company_lines,county_areas,width / feet_per_unit)
+		changed, unchanged = hnglib.onecall.changed_counties(state,prefix,keys)
+		print "-%i counties changed, %i unchanged" % (len(changed),len(unchanged))
+		manifest += hnglib.onecall.reuse_zips(unchanged,prefix,formattedDate,destination)
+		plans.append([prefix, width, single_part, keys, changed, unchanged])
+	print
 
-	# Apply appropriate buffers to each company layer
-	print "Buffering " + AP_Lines + " by " + AP_Buffer_Width + "..."
-	arcpy.Buffer_analysis(AP_Lines,AP_Lines_Buffer,AP_Buffer_Width,"FULL","ROUND","ALL")
-	print "Buffering " + HNG_Lines + " by " + HNG_Buffer_Width + "..."
-	arcpy.Buffer_analysis(HNG_Lines,HNG_Lines_Buffer,HNG_Buffer_Width,"FULL","ROUND","ALL")
+	# Buffer only the lines reaching the changed counties, and intersect the buffers with just those counties
+	for prefix, width, single_part, keys, changed, unchanged in plans:
+		if len(changed) == 0:
+			continue
+		Lines = prefix + "_Lines_layer"
+		Changed_Counties = prefix + "_Counties_layer"
+		Lines_Buffer = desk + "\\" + prefix + "_Lines_Buffer"
+		Lines_Intersect = desk + "\\" + prefix + "_Lines_Intersect"
+		Buffer_Width = "%i feet" % (width)
 
-	# Intersect each buffered company layer with the counties layer
-	print "Intersecting " + AP_Lines_Buffer + " with " + Counties + "..."
-	arcpy.Intersect_analysis([AP_Lines_Buffer,Counties],AP_Lines_Intersect)
-	print "Intersecting " + HNG_Lines_Buffer + " with " + Counties + "..."
-	arcpy.Intersect_analysis([HNG_Lines_Buffer,Counties],HNG_Lines_Intersect)
+		arcpy.MakeFeatureLayer_management(Counties,Changed_Counties,'"Name" IN (' + ",".join(["'" + county.replace("'","''") + "'" for county in changed]) + ')')
+		arcpy.MakeFeatureLayer_management(Gas_Lines,Lines,'"company" = \'' + prefix + '\'')
+		arcpy.SelectLayerByLocation_management(Lines,"WITHIN_A_DISTANCE",Changed_Counties,Buffer_Width)
+		print "Selected " + prefix + " lines reaching changed counties, number of features:"
+		print arcpy.GetCount_management(Lines)
 
-	print
+		# Apply appropriate buffer to the company's lines
+		print "Buffering " + prefix + " lines by " + Buffer_Width + "..."
+		arcpy.Buffer_analysis(Lines,Lines_Buffer,Buffer_Width,"FULL","ROUND","ALL")
 
-	# Select each feature out of the intersected layers to create the final batch of layers
-	working_folders = []
+		# Intersect the buffer with the changed counties
+		print "Intersecting " + Lines_Buffer + " with changed counties..."
+		arcpy.Intersect_analysis([Lines_Buffer,Changed_Counties],Lines_Intersect)
+		tasks += hnglib.onecall.county_tasks(os.path.join(gdb,Lines_Intersect),prefix,formattedDate,destination,single_part)
+		print
 
-	print "Pulling out each feature in " + AP_Lines_Intersect + "..."
-	AP_features = arcpy.SearchCursor(AP_Lines_Intersect)
-	for AP_feature in AP_features:
-		shapefilename = "AP_Buffer_"+AP_feature.Name+"_"+formattedDate
-		newdestination = destination + shapefilename + "\\"
-		os.mkdir(newdestination)
-		filepath = newdestination+shapefilename+".shp"
-		arcpy.Select_analysis(AP_Lines_Intersect,filepath,'"Name" = \''+AP_feature.Name+'\'')
-		# Created folder for layer
-		
-		zipped = zipfile.ZipFile(destination + shapefilename + ".zip","w")
-		for name in glob.glob(newdestination+"\*"):
-			zipped.write(name, os.path.basename(name), zipfile.ZIP_DEFLATED)
-		zipped.close()
-		print "-Wrote to zip file " + shapefilename + ".zip"
-		# Wrote folder to zip
-		
-		working_folders.append(destination + shapefilename)
-		# Listing folder for deletion
-		
-	print
-	print "Pulling out each feature in " + HNG_Lines_Intersect + "..."
-	HNG_features = arcpy.SearchCursor(HNG_Lines_Intersect)
-	for HNG_feature in HNG_features:
-		shapefilename = "HNG_Buffer_"+HNG_feature.Name+"_"+formattedDate
-		newdestination = destination + shapefilename + "\\"
-		os.mkdir(newdestination)
-		filepath = newdestination+shapefilename+".shp"
-		HNG_Lines_Multipart_Feature = HNG_Lines_Multipart+'_'+HNG_feature.Name
-		arcpy.Select_analysis(HNG_Lines_Intersect,HNG_Lines_Multipart_Feature,'"Name" = \''+HNG_feature.Name+'\'')
-		arcpy.MultipartToSinglepart_management(HNG_Lines_Multipart_Feature,filepath)
-		# Created folder for layer, pulled out single feature and separated disconnected pieces into features
-		
-		zipped = zipfile.ZipFile(destination + shapefilename + ".zip","w")
-		for name in glob.glob(newdestination+"\*"):
-			zipped.write(name, os.path.basename(name), zipfile.ZIP_DEFLATED)
-		zipped.close()
-		print "-Wrote to zip file " + shapefilename + ".zip"
-		
-		working_folders.append(destination + shapefilename)
-		# Listing folder for deletion
+	# Every county is written as a shapefile straight into its zip by its own task, spread over the worker processes, and listed in manifest.csv
+	if validate:
+		print "Checking %i counties against Select_analysis shapefiles..." % (len(tasks))
+		for name, differences in hnglib.onecall.validate_counties(tasks,workers):
+			if len(differences) > 0:
+				print "-" + name + " does not match:"
+				for difference in differences:
+					print "    " + difference
+		print
+	print "Exporting and zipping %i counties..." % (len(tasks))
+	rows = hnglib.onecall.export_counties(tasks,workers)
+	for row in rows:
+		print "-Wrote to zip file " + row[3]
+	manifest += rows
+	hnglib.onecall.write_manifest(manifest,destination + "manifest.csv")
+	print "%i new zips to send to OneCall, %i unchanged (see manifest.csv)" % (len(rows),len(manifest) - len(rows))
 
-	# Wait for everything to settle
-	print
-	print "ZZzzz..."
-	time.sleep(1)
+	for prefix, width, single_part, keys, changed, unchanged in plans:
+		new_state["counties"][prefix] = hnglib.onecall.county_state(prefix,manifest,keys,changed,unchanged,destination)
+	hnglib.onecall.save_state(new_state,state_file)
 
 	# Clean up
+	print
 	print "Cleaning up..."
-	for folder in working_folders:
-		shutil.rmtree(folder)
 	arcpy.Delete_management(desk)
 
 	print "Done!"
@@ -7,6 +7,8 @@ print "Importing libraries..."
 import arcpy
 from arcpy import env
 import csv
+import hnglib.gdb
+import hnglib.kernels
 
 # Environment settings
 print "Setting environment..."
@@ -16,54 +18,53 @@ env.workspace = gdb
 # Local variables
 print "Setting local variables..."
 
-# First define the suffix for MakeFeatureLayer, list of working layers (polygons only), and field name
-layersuffix = "_layer"
+# First define the meter layer, list of working layers (polygons only) with the fields ReturnDesignator needs, and field name
 meters = "meter_ref"
 layers = ["RRC_Areas", "Route_Areas", "ESDs", "ISDs"]
+designator_fields = {
+	"RRC_Areas": ["Name"],
+	"Route_Areas": ["Number"],
+	"ESDs": ["NUMBER", "COUNTY"],
+	"ISDs": ["NAME"]
+}
 field = "Meters_Inside"
 filepath = "S:\\Hughes_ArcGIS\\Python_Output\\"
 
-# ReturnDesignator allows the calculation loop to report counts inside individual features in the terminal. The layer names need to include the suffix because this will be called at the end of the loop. Match these cases with the 'layers' array above
+# ReturnDesignator allows the calculation loop to report counts inside individual features in the terminal. Match these cases with the 'layers' array above, and list the fields used in 'designator_fields'
 
 def ReturnDesignator(feature,layer):
-	if layer == 'RRC_Areas' + layersuffix:
-		return str(feature.Name)
-	elif layer == 'Route_Areas' + layersuffix:
-		return "route number " + str(feature.Number)
-	elif layer == 'ESDs' + layersuffix:
-		return "ESD #" + str(feature.NUMBER) + " in " + str(feature.COUNTY) + " county"
-	elif layer == 'ISDs' + layersuffix:
-		return str(feature.NAME)
+	if layer == 'RRC_Areas':
+		return str(feature["Name"])
+	elif layer == 'Route_Areas':
+		return "route number " + str(feature["Number"])
+	elif layer == 'ESDs':
+		return "ESD #" + str(feature["NUMBER"]) + " in " + str(feature["COUNTY"]) + " county"
+	elif layer == 'ISDs':
+		return str(feature["NAME"])
 	else:
 		print "Update ReturnDesignator function!"	
 
-# Next do MakeFeatureLayer on each layer, naming the new layer using the suffix
-for layer in layers:
-	arcpy.MakeFeatureLayer_management(layer,layer+layersuffix)
-arcpy.MakeFeatureLayer_management(meters,meters+layersuffix)
-meters += layersuffix
+# Read every meter once; all four layers are counted from these coordinates. The
+# meters and every layer are read in the first layer's spatial reference, so they
+# line up whatever each one is stored in.
+print "Reading meters..."
+frame = hnglib.gdb.spatial_reference(layers[0])
+meter_xs, meter_ys = hnglib.kernels.coordinate_arrays(hnglib.gdb.read_points(meters,[],frame))
 
 # Count meters for validation purposes
-metercount = int(str(arcpy.GetCount_management(meters)))
+metercount = len(meter_xs)
 
 print "Setup complete."
 print
 
-# Now the loop to count meters inside each feature in each layer, and calculate "Meters_Inside"
+# Now the loop to count meters inside each feature in each layer, and update "Meters_Inside". Each meter is located in each layer in memory, and only the features whose count changed are written back.
 for layer in layers:
 	writer = csv.writer(open(filepath+layer+".csv",'wb'),dialect='excel')
 	writer.writerow(["Area","Count"])
 	total = 0
-	rows = []
 	print "Counting meters in \"" + layer + "\"..."
-	layer += layersuffix
-	features = arcpy.SearchCursor(layer)
-	for feature in features:
-		arcpy.SelectLayerByAttribute_management(layer,"NEW_SELECTION",'"OBJECTID" = ' + str(feature.OBJECTID))
-		arcpy.SelectLayerByLocation_management(meters,"WITHIN",layer)
-		count = arcpy.GetCount_management(meters)
-		count = int(str(count))
-		arcpy.CalculateField_management(layer,field,count,"PYTHON","")
+	features, counts = hnglib.gdb.refresh_counts(layer,meter_xs,meter_ys,designator_fields[layer],field,frame)
+	for feature, count in zip(features,counts):
 		print str(count) + " meters in " + ReturnDesignator(feature,layer)
 		writer.writerow([ReturnDesignator(feature,layer),count])
 		total += count
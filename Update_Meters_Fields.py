@@ -5,61 +5,37 @@
 print "Importing libraries..."
 import arcpy
 from arcpy import env
+import hnglib.gdb
+import hnglib.meters
 env.workspace = "S:\Hughes_ArcGIS\HNG new.gdb"
 
 print "Setting up..."
 RRC = "RRC_Areas"
 Routes = "Route_Areas"
 meters = "meter_ref"
-suffix = "_layer"
 
-arcpy.MakeFeatureLayer_management(RRC,RRC+suffix)
-arcpy.MakeFeatureLayer_management(Routes,Routes+suffix)
-arcpy.MakeFeatureLayer_management(meters,meters+suffix)
-RRC += suffix
-Routes += suffix
-meters += suffix
-
-# Update RRC_Area field
-print
-print "Updating RRC_Area field..."
-areas = arcpy.SearchCursor(RRC)
-for area in areas:
-	arcpy.SelectLayerByAttribute_management(RRC,"NEW_SELECTION",'"OBJECTID" = ' + str(area.OBJECTID))
-	arcpy.SelectLayerByLocation_management(meters,"WITHIN",RRC)
-	areacode = str(area.usercode)
-	print "Editing meters within " + areacode + "..."
-	rows = arcpy.UpdateCursor(meters)
-	for row in rows:
-		row.RRC_Area = areacode
-		rows.updateRow(row)
-	del row
-	del rows
-	
-# Update Route_no field
-print
-print "Updating route_no field..."
-areas = arcpy.SearchCursor(Routes)
-for area in areas:
-	arcpy.SelectLayerByAttribute_management(Routes,"NEW_SELECTION",'"OBJECTID" = ' + str(area.OBJECTID))
-	arcpy.SelectLayerByLocation_management(meters,"WITHIN",Routes)
-	areacode = int(str(area.Number))
-	print "Editing meters within route number " + str(areacode) + "..."
-	rows = arcpy.UpdateCursor(meters)
-	for row in rows:
-		row.route_no = areacode
-		rows.updateRow(row)
-	del row
-	del rows
-
-# Update lat/long fields
+# Update RRC_Area, route_no, latitude and longitude fields. Every meter is located
+# in the RRC areas and routes in memory, its point compared against the stored
+# lat/long, and only the meters where something changed are written back. The
+# routes and meters are located in the RRC areas' spatial reference, and the
+# meters are read again in degrees (their layer's geographic coordinate system)
+# for the lat/long.
 print
-print "Updating latitude and longitude fields..."
-arcpy.SelectLayerByAttribute_management(meters)
-arcpy.CalculateField_management(meters,"latitude","float(!Shape.firstPoint.Y!)","PYTHON_9.3")
-print "Latitudes finished"
-arcpy.CalculateField_management(meters,"longitude","float(!Shape.firstPoint.X!)","PYTHON_9.3")
-print "Longitudes finished"
+print "Reading RRC areas and routes..."
+area_sr = hnglib.gdb.spatial_reference(RRC)
+RRC_areas = hnglib.gdb.read_polygons(RRC,["usercode"],area_sr)
+route_areas = hnglib.gdb.read_polygons(Routes,["Number"],area_sr)
+print "Reading meters..."
+meter_data = hnglib.gdb.read_points(meters,["RRC_Area","route_no","latitude","longitude","OID@"],hnglib.gdb.spatial_reference(meters).GCS)
+meter_xs, meter_ys = hnglib.gdb.point_arrays(meters,[meter[-1] for meter in meter_data],area_sr)
+print "Locating meters..."
+changes, unassigned = hnglib.meters.assign_areas(meter_data,meter_xs,meter_ys,RRC_areas,route_areas)
+print "Updating RRC_Area, route_no, latitude and longitude fields..."
+hnglib.gdb.update_rows(meters,["RRC_Area","route_no","latitude","longitude"],changes)
+print "%i meters changed, %i unchanged" % (len(changes),len(meter_data) - len(changes))
+if len(unassigned) > 0:
+	print "%i meters are outside every RRC area or route (left as they were), OBJECTIDs:" % (len(unassigned))
+	print ", ".join([str(oid) for oid in unassigned])
 
 print
 print "Done!"
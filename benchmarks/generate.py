@@ -0,0 +1,235 @@
+# Name: generate.py
+# Description: Seeded generator of a synthetic HNG geodatabase for the benchmarks.
+# For a given number of meters it lays out the same layers the scripts read, with
+# the same fields: meter_ref points with serv_ids (plus a few doubles, blanks and
+# unlocated meters), ISD/ESD/RRC/route polygon tilings with jittered shared edges,
+# a Gas_Lines street grid network with sizes, materials and companies (plus
+# duplicated and slightly offset lines), and the matching customer info sheet.
+# The same seed always gives the same data.
+
+import math
+import random
+import xlwt
+
+# State plane feet around the Rio Grande Valley
+ORIGIN = (1200000.0, 16500000.0)
+# Roughly this much ground (in square feet) per meter, so density stays the same
+# at every scale
+AREA_PER_METER = 40000.0
+COUNTIES = ["Hidalgo", "Cameron", "Starr", "Willacy"]
+SIZES = [0.75, 1.0, 1.25, 1.5, 2, 2, 2, 3, 4, 6, None]
+MATERIALS = ["Black", "Yellow", "Orange", "Steel", "Steel", None]
+COMPANIES = ["HNG"] * 17 + ["AP"] * 2 + [None]
+# The xls format holds at most this many rows per sheet (header included)
+XLS_ROWS = 65536
+
+# A synthetic geodatabase: {name: (shape type, fields, [(shape, {field: value})])}
+# plus the customer sheet rows, as (latitude, longitude, serv_id, serv_stat,
+# meter_on) tuples
+class Dataset(object):
+    def __init__(self, meters, seed):
+        self.meters = meters
+        self.seed = seed
+        self.feature_classes = {}
+        self.customers = []
+
+# Latitude/longitude of a point, close enough for the reports (which only compare
+# them)
+def lat_long(x, y):
+    return round(26.0 + (y - ORIGIN[1]) / 364000.0, 6), round(-98.5 + (x - ORIGIN[0]) / 331000.0, 6)
+
+# Tiles the width x height box at the origin into cols x rows four sided cells
+# whose shared edges are broken into segments vertices with jittered interior
+# vertices, so neighbouring polygons meet exactly along irregular borders.
+# Returns one polygon (a list of parts, see hnglib.backend.Geometry) per cell,
+# row by row.
+def tiling(rng, width, height, cols, rows, segments=8, jitter=0.08):
+    cell_w, cell_h = width / cols, height / rows
+    corners = {}
+    for i in range(cols + 1):
+        for j in range(rows + 1):
+            x, y = ORIGIN[0] + i * cell_w, ORIGIN[1] + j * cell_h
+            if 0 < i < cols:
+                x += rng.uniform(-jitter, jitter) * cell_w
+            if 0 < j < rows:
+                y += rng.uniform(-jitter, jitter) * cell_h
+            corners[(i, j)] = (x, y)
+
+    edges = {}
+    # Vertices of the edge from corner a to corner b (a included, b left out),
+    # reversed when the neighbouring cell walks it the other way
+    def edge(a, b):
+        key = (min(a, b), max(a, b))
+        if key not in edges:
+            (x0, y0), (x1, y1) = corners[key[0]], corners[key[1]]
+            border = (key[0][0] == key[1][0] in (0, cols)) or (key[0][1] == key[1][1] in (0, rows))
+            length = math.hypot(x1 - x0, y1 - y0)
+            points = [(x0, y0)]
+            for k in range(1, segments):
+                t = float(k) / segments
+                offset = 0.0 if border else rng.uniform(-jitter, jitter) * length / segments
+                points.append((x0 + t * (x1 - x0) - offset * (y1 - y0) / length,
+                               y0 + t * (y1 - y0) + offset * (x1 - x0) / length))
+            points.append((x1, y1))
+            edges[key] = points
+        points = edges[key]
+        return points[:-1] if a == key[0] else points[::-1][:-1]
+
+    polygons = []
+    for j in range(rows):
+        for i in range(cols):
+            ring = (edge((i, j), (i + 1, j)) + edge((i + 1, j), (i + 1, j + 1)) +
+                    edge((i + 1, j + 1), (i, j + 1)) + edge((i, j + 1), (i, j)))
+            polygons.append([[ring]])
+    return polygons
+
+# Meter points, clustered around a few towns with the rest spread out. About 1 in
+# 200 has no location, 1 in 500 repeats another meter's serv_id and 1 in 1000 has
+# no serv_id. Returns (x, y, serv_id) tuples, x/y None when unlocated.
+def meter_points(rng, count, width, height):
+    towns = [(rng.uniform(0.1, 0.9) * width, rng.uniform(0.1, 0.9) * height, rng.uniform(0.03, 0.1) * width)
+             for i in range(max(1, count // 2000))]
+    meters = []
+    serv_id = 100000
+    for i in range(count):
+        if rng.random() < 0.7:
+            cx, cy, spread = rng.choice(towns)
+            x, y = rng.gauss(cx, spread), rng.gauss(cy, spread)
+        else:
+            x, y = rng.uniform(0, width), rng.uniform(0, height)
+        x, y = ORIGIN[0] + min(max(x, 1.0), width - 1.0), ORIGIN[1] + min(max(y, 1.0), height - 1.0)
+        serv_id += rng.choice([1, 1, 1, 2, 3])
+        roll = rng.random()
+        if roll < 0.005:
+            x = y = None
+        if 0.005 <= roll < 0.007 and meters:
+            meter_id = rng.choice(meters)[2]
+        elif 0.007 <= roll < 0.008:
+            meter_id = None
+        else:
+            meter_id = serv_id
+        meters.append((x, y, meter_id))
+    return meters
+
+# A street grid of gas lines across the service area: every stretch of street
+# between two crossings is one line, with a bend or two along the way. About 1 in
+# 100 lines is duplicated exactly (sometimes digitized backwards) and 1 in 100 is
+# drawn again a fraction of a foot off. Returns lists of vertex lists.
+def street_lines(rng, count, width, height):
+    streets = max(2, int(math.sqrt(count / 2.0)) + 1)
+    dx, dy = width / streets, height / streets
+    lines = []
+    for k in range(streets):
+        for s in range(streets - 1):
+            for horizontal in (True, False):
+                if horizontal:
+                    start = (ORIGIN[0] + s * dx, ORIGIN[1] + (k + 0.5) * dy)
+                    end = (start[0] + dx, start[1])
+                else:
+                    start = (ORIGIN[0] + (k + 0.5) * dx, ORIGIN[1] + s * dy)
+                    end = (start[0], start[1] + dy)
+                bends = [(start[0] + t * (end[0] - start[0]) + rng.uniform(-2, 2),
+                          start[1] + t * (end[1] - start[1]) + rng.uniform(-2, 2))
+                         for t in sorted([rng.random() for b in range(rng.randint(0, 2))])]
+                lines.append([[start] + bends + [end]])
+    for line in list(lines):
+        roll = rng.random()
+        if roll < 0.01:
+            lines.append([part[::-1] for part in line] if rng.random() < 0.5 else line)
+        elif roll < 0.02:
+            offset = rng.uniform(0.05, 0.3)
+            lines.append([[(x + offset, y + offset) for x, y in part] for part in line])
+    return lines
+
+def line_length(parts):
+    return sum([math.hypot(x1 - x0, y1 - y0) for part in parts for (x0, y0), (x1, y1) in zip(part[:-1], part[1:])])
+
+# Builds the synthetic geodatabase for the given number of meters
+def generate(meters, seed=1):
+    rng = random.Random(seed)
+    dataset = Dataset(meters, seed)
+    side = math.sqrt(max(meters, 1) * AREA_PER_METER)
+    width, height = side * 1.25, side * 0.8
+
+    def polygon_layer(name, cols, rows, attributes):
+        fields = sorted(attributes(0, 0, 0).keys()) + ["Meters_Inside"]
+        rows_out = []
+        for n, parts in enumerate(tiling(rng, width, height, cols, rows)):
+            values = attributes(n, n % cols, n // cols)
+            values["Meters_Inside"] = 0
+            rows_out.append((parts, values))
+        dataset.feature_classes[name] = ("Polygon", fields, rows_out)
+
+    polygon_layer("RRC_Areas", 3, 2, lambda n, i, j: {"Name": "Area %s" % ("ABCDEF"[n]), "usercode": "%02i" % (n + 1)})
+    polygon_layer("Route_Areas", 8, 5, lambda n, i, j: {"Number": n + 1})
+    polygon_layer("Districts\\ISDs", 4, 3, lambda n, i, j: {"NAME": "ISD %i" % (n + 1), "NAME2": "ISD %i" % (n + 1)})
+    # The ESDs leave the east end of the area uncovered, so some meters are in an
+    # ISD without an ESD
+    ESD_cols, ESD_rows = 6, 5
+    polygon_layer("Districts\\ESDs", ESD_cols, ESD_rows,
+                  lambda n, i, j: {"COUNTY": COUNTIES[i * len(COUNTIES) // ESD_cols], "NUMBER": str(n + 1)})
+    ESDs = dataset.feature_classes["Districts\\ESDs"][2]
+    dataset.feature_classes["Districts\\ESDs"] = ("Polygon", dataset.feature_classes["Districts\\ESDs"][1],
+                                                  [row for n, row in enumerate(ESDs) if n % ESD_cols < ESD_cols - 1])
+
+    meter_rows = []
+    for x, y, serv_id in meter_points(rng, meters, width, height):
+        latitude, longitude = lat_long(x, y) if x is not None else (None, None)
+        meter_rows.append((None if x is None else (x, y),
+                           {"serv_id": serv_id, "latitude": latitude, "longitude": longitude, "RRC_Area": None, "route_no": None}))
+    dataset.feature_classes["meter_ref"] = ("Point", ["serv_id", "latitude", "longitude", "RRC_Area", "route_no"], meter_rows)
+
+    line_rows = []
+    for parts in street_lines(rng, max(50, meters // 8), width, height):
+        length = line_length(parts)
+        roll = rng.random()
+        stored = length if roll < 0.6 else (None if roll < 0.8 else round(length * rng.uniform(0.5, 1.5), 2))
+        line_rows.append((parts, {"company": rng.choice(COMPANIES), "pipe_size": rng.choice(SIZES),
+                                  "pipe_material": rng.choice(MATERIALS), "length_ft": stored}))
+    dataset.feature_classes["Gas_Lines"] = ("Polyline", ["company", "pipe_size", "pipe_material", "length_ft"], line_rows)
+
+    # Customers: nearly every meter with a serv_id, plus new customers ESRI has
+    # no meter for yet (some with no lat/long)
+    served = set()
+    last = 100000
+    for shape, values in meter_rows:
+        serv_id = values["serv_id"]
+        if serv_id is None or serv_id in served:
+            continue
+        served.add(serv_id)
+        last = max(last, serv_id)
+        if rng.random() < 0.98:
+            dataset.customers.append(customer(rng, values["latitude"], values["longitude"], serv_id))
+    for i in range(meters // 50):
+        last += 1
+        if rng.random() < 0.8:
+            latitude, longitude = lat_long(ORIGIN[0] + rng.uniform(0, width), ORIGIN[1] + rng.uniform(0, height))
+        else:
+            latitude = longitude = None
+        dataset.customers.append(customer(rng, latitude, longitude, last))
+    return dataset
+
+def customer(rng, latitude, longitude, serv_id):
+    return (latitude, longitude, serv_id, "ACTIVE" if rng.random() < 0.85 else "INACTIVE", 1 if rng.random() < 0.9 else 0)
+
+# Writes the customer rows as current_customer_info.xls (the servloc sheet, with
+# the same header the real export has)
+def write_customer_sheet(customers, path):
+    if len(customers) >= XLS_ROWS:
+        raise ValueError("%i customers don't fit in one xls sheet (at most %i)" % (len(customers), XLS_ROWS - 1))
+    book = xlwt.Workbook()
+    sheet = book.add_sheet("servloc")
+    for col, name in enumerate(["latitude", "longitude", "serv_id", "serv_stat", "meter_on"]):
+        sheet.write(0, col, name)
+    for row, values in enumerate(customers):
+        for col, value in enumerate(values):
+            if value is not None:
+                sheet.write(row + 1, col, value)
+    book.save(path)
+
+# Loads a dataset into a MemoryBackend (the arcpy stand-in's BACKEND), replacing
+# whatever it held
+def load(dataset, backend):
+    backend.clear()
+    for name, (shape_type, fields, rows) in dataset.feature_classes.items():
+        backend.add_table(name, shape_type, fields, rows)
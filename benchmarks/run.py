@@ -0,0 +1,290 @@
+# Name: run.py
+# Description: Scaling benchmarks for the reports, runnable on any machine with
+# numpy, xlrd and xlwt (no ArcGIS). Each case runs the scripts' own code: the
+# Data_Integrity_Report run and its module functions with its own settings, or
+# the shared hnglib functions the other scripts are built from. The data is a
+# synthetic geodatabase (generate.py) held in an hnglib.backend.MemoryBackend,
+# which the arcpy stand-in in benchmarks/standin also answers from, at several
+# numbers of meters. Every case and scale runs in a fresh process, so its peak
+# memory is its own. The wall time, throughput and memory of each run are
+# printed and written to <output>.json/.csv (benchmarks/results/benchmark_results
+# by default, which git ignores); pass the JSON from an earlier run with --compare
+# to flag cases which got slower.
+#
+#   python benchmarks/run.py --scales 1000,5000,20000 --output before
+#   python benchmarks/run.py --scales 1000,5000,20000 --compare before.json
+
+import argparse
+import csv
+import gc
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+import traceback
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARKS, "standin"))
+sys.path.insert(1, os.path.dirname(BENCHMARKS))
+
+import arcpy
+import generate
+import hnglib.backend
+import hnglib.customers
+import hnglib.duplicates
+import hnglib.gdb
+import hnglib.kernels
+import hnglib.taxing
+
+COLUMNS = ["report", "meters", "lines", "items", "seconds", "items_per_second", "peak_memory_mb", "report_memory_mb"]
+# Areas whose lines the selections case picks out, as OneCall does for the
+# counties that changed
+CHANGED_AREAS = """ "Name" IN ('Area A', 'Area D') """
+
+# Data_Integrity_Report, imported for its module functions and settings, pointed
+# at the synthetic customer sheet and a scratch folder for its cache and output.
+# Imported in the worker running the case (importing it runs its SETUP section).
+def integrity_report(folder, customer_info_xls):
+    import Data_Integrity_Report as report
+    report.DATASETS["CUSI"][1] = customer_info_xls
+    report.OPTIONS["CACHE_FOLDER"] = os.path.join(folder, "cache")
+    report.OPTIONS["OUTPUT_FILEPATH"] = os.path.join(folder, "Data_Integrity_Report.csv")
+    return report
+
+# Each case takes the scratch folder and the customer sheet path and returns the
+# number of items it handled (meters or lines), which its throughput is measured
+# in. Cases with a prepare function have it run first, outside the timing.
+
+# The whole Data_Integrity_Report run, as its __main__ does it
+def full_report(folder, customer_info_xls):
+    report = integrity_report(folder, customer_info_xls)
+    report.load_snapshot()
+    report.write_report(report.run_modules(report.OPTIONS["MODULE_WORKERS"]), report.OPTIONS["OUTPUT_FILEPATH"])
+    return arcpy.BACKEND.get_count("meter_ref")
+
+# One Data_Integrity_Report module on its own: the snapshot of just what it reads,
+# then the module
+def report_module(modulename, layer):
+    def case(folder, customer_info_xls):
+        report = integrity_report(folder, customer_info_xls)
+        for name in report.MODULE_ON:
+            report.MODULE_ON[name] = name == modulename
+        report.load_snapshot()
+        rows, profile = report.run_module(modulename)
+        if rows and str(rows[0][0]).startswith("ERROR"):
+            raise RuntimeError("\n".join([str(row[0]) for row in rows[:2]]))
+        return arcpy.BACKEND.get_count(layer)
+    return case
+
+# Create_Taxing_Areas_Spreadsheet's incremental path: the state from a previous
+# run is brought up to date (the previous run is the prepare step)
+def taxing_incremental(folder, customer_info_xls):
+    status = hnglib.customers.load_status(customer_info_xls)
+    frame = hnglib.gdb.spatial_reference("Districts\\ISDs")
+    meters, unjoined = hnglib.customers.join_status(hnglib.gdb.read_points("meter_ref", ["serv_id", "OID@"], frame), status)
+    cache_folder = os.path.join(folder, "cache")
+    ESDs = hnglib.gdb.load_polygon_index("Districts\\ESDs", ["COUNTY", "NUMBER"], cache_folder, frame)
+    ISDs = hnglib.gdb.load_polygon_index("Districts\\ISDs", ["NAME2"], cache_folder, frame)
+    hnglib.taxing.incremental_rows(os.path.join(cache_folder, "Taxing_Areas.state"), ISDs, ESDs, meters)
+    return len(meters)
+
+# Find_Duplicates: identical lines, then overlapping HNG lines (it checks with
+# the same tolerances as the report's overlap check)
+def duplicates(folder, customer_info_xls):
+    report = integrity_report(folder, customer_info_xls)
+    tolerance = report.OPTIONS["PIPELINE_LENGTH"]["OVERLAP_TOLERANCE"]
+    resolution = hnglib.backend.active().describe("Gas_Lines").spatialReference.XYResolution
+    feet_per_unit = hnglib.gdb.feet_per_unit("Gas_Lines")
+    all_lines = hnglib.gdb.read_polylines("Gas_Lines", ["OID@", "length_ft", "company"])
+    hnglib.duplicates.duplicate_counts([(line[1], line[0]) for line in all_lines], resolution)
+    HNG_lines = [(line[1], line[0]) for line in all_lines if line[3] == 'HNG']
+    hnglib.duplicates.find_overlaps(HNG_lines, tolerance["DISTANCE_FT"] / feet_per_unit, tolerance["ANGLE_DEG"])
+    return len(all_lines)
+
+# RRC_Route_Areas: meters counted into every area layer, Meters_Inside refreshed
+def rrc_counts(folder, customer_info_xls):
+    frame = hnglib.gdb.spatial_reference("RRC_Areas")
+    xs, ys = hnglib.kernels.coordinate_arrays(hnglib.gdb.read_points("meter_ref", [], frame))
+    for layer in ["RRC_Areas", "Route_Areas", "Districts\\ESDs", "Districts\\ISDs"]:
+        hnglib.gdb.refresh_counts(layer, xs, ys, [], "Meters_Inside", frame)
+    return len(xs)
+
+# The backend's own layer operations (no script reaches them through hnglib yet):
+# the OneCall selection step, HNG lines within the buffer width of the changed
+# areas, counted
+def selections(folder, customer_info_xls):
+    backend = hnglib.backend.active()
+    backend.make_feature_layer("RRC_Areas", "Changed_Areas", CHANGED_AREAS)
+    backend.make_feature_layer("Gas_Lines", "HNG_Lines", """ "company" = 'HNG' """)
+    backend.select_layer_by_location("HNG_Lines", "WITHIN_A_DISTANCE", "Changed_Areas", "100 Feet")
+    backend.get_count("HNG_Lines")
+    backend.select_layer_by_attribute("HNG_Lines", "SUBSET_SELECTION", "pipe_material = 'Steel'")
+    backend.get_count("HNG_Lines")
+    return backend.get_count("Gas_Lines")
+
+# [name, case, prepare]
+REPORTS = [
+    ["report", full_report, None],
+    ["taxing", report_module("TAXING_DISTRICTS", "meter_ref"), None],
+    ["taxing_incremental", taxing_incremental, taxing_incremental],
+    ["pipeline", report_module("PIPELINE_LENGTH", "Gas_Lines"), None],
+    ["verify", report_module("VERIFY_METERS", "meter_ref"), None],
+    ["company_id", report_module("COMPANY_ID", "Gas_Lines"), None],
+    ["duplicates", duplicates, None],
+    ["rrc_counts", rrc_counts, None],
+    ["selections", selections, None]
+]
+
+# Resident memory of this process in MB: "VmRSS" now or "VmHWM" at its peak
+def memory(field):
+    f = open("/proc/self/status")
+    try:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1]) / 1024.0
+    finally:
+        f.close()
+
+# Peak resident memory of this process so far (since the last reset_peak_memory),
+# in MB
+def peak_memory():
+    if os.path.exists("/proc/self/status"):
+        return memory("VmHWM")
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+# Starts the peak over from the memory in use now, so generating the data doesn't
+# count towards the report's peak (Linux only; elsewhere the peak runs on)
+def reset_peak_memory():
+    try:
+        f = open("/proc/self/clear_refs", "w")
+        try:
+            f.write("5")
+        finally:
+            f.close()
+    except (IOError, OSError):
+        pass
+
+# Runs one case at one scale and returns its result row. The scripts' console
+# output goes to os.devnull so it doesn't bury the results.
+def run_case(task):
+    name, meters, seed = task
+    dataset = generate.generate(meters, seed)
+    generate.load(dataset, hnglib.backend.use(arcpy.BACKEND))
+    folder = tempfile.mkdtemp(prefix="hng_benchmark_")
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, "w")
+    try:
+        customer_info_xls = os.path.join(folder, "current_customer_info.xls")
+        generate.write_customer_sheet(dataset.customers, customer_info_xls)
+        case, prepare = [report[1:] for report in REPORTS if report[0] == name][0]
+        if prepare is not None:
+            prepare(folder, customer_info_xls)
+        gc.collect()
+        reset_peak_memory()
+        baseline = memory("VmRSS") if os.path.exists("/proc/self/status") else peak_memory()
+        start = time.time()
+        items = case(folder, customer_info_xls)
+        seconds = time.time() - start
+        peak = peak_memory()
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+        shutil.rmtree(folder, True)
+    lines = len(dataset.feature_classes["Gas_Lines"][2])
+    return [name, meters, lines, items, round(seconds, 4), round(items / max(seconds, 1e-9), 1),
+            round(peak, 1), round(peak - baseline, 1)]
+
+# Process side of run: runs the case and puts its row (or the error) on the queue
+def case_process(task, queue):
+    try:
+        queue.put(run_case(task))
+    except Exception:
+        queue.put(traceback.format_exc())
+
+# Runs every report at every scale, smallest first, each in a fresh process of its
+# own (not a pool worker, so Data_Integrity_Report can start its own pool)
+def run(reports, scales, seed):
+    results = []
+    for meters in scales:
+        for name in reports:
+            queue = multiprocessing.Queue()
+            process = multiprocessing.Process(target=case_process, args=((name, meters, seed), queue))
+            process.start()
+            row = queue.get()
+            process.join()
+            if not isinstance(row, list):
+                raise RuntimeError("%s at %i meters failed:\n%s" % (name, meters, row))
+            print "%-18s %8i meters %7i lines %9.3fs %12.1f items/s %8.1f MB peak %8.1f MB in report" % tuple(row[:3] + row[4:])
+            results.append(row)
+    return results
+
+# Reports (at a scale both runs have) whose wall time grew by more than threshold
+# (0.2 being 20%) since a previous run's JSON
+def regressions(results, previous, threshold):
+    before = dict(((row["report"], row["meters"]), row["seconds"]) for row in previous)
+    slower = []
+    for row in results:
+        key = (row[0], row[1])
+        if key in before and before[key] > 0 and row[4] > before[key] * (1 + threshold):
+            slower.append(row[:2] + [before[key], row[4]])
+    return slower
+
+def write_results(results, base):
+    folder = os.path.dirname(base)
+    if folder and not os.path.isdir(folder):
+        os.makedirs(folder)
+    f = open(base + ".json", "wb")
+    try:
+        json.dump([dict(zip(COLUMNS, row)) for row in results], f, indent=1)
+    finally:
+        f.close()
+    f = open(base + ".csv", "wb")
+    try:
+        writer = csv.writer(f, dialect="excel")
+        writer.writerow(COLUMNS)
+        writer.writerows(results)
+    finally:
+        f.close()
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Benchmark the report engines on synthetic data")
+    parser.add_argument("--scales", default="1000,5000,20000", help="comma separated numbers of meters (default 1000,5000,20000)")
+    parser.add_argument("--reports", default=",".join([report[0] for report in REPORTS]),
+                        help="comma separated reports to run (default all: %(default)s)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", default=os.path.join(BENCHMARKS, "results", "benchmark_results"),
+                        help="results file name without extension (default %(default)s)")
+    parser.add_argument("--compare", help="JSON results of an earlier run to check for regressions")
+    parser.add_argument("--threshold", type=float, default=0.2, help="slowdown flagged by --compare (default 0.2 = 20%%)")
+    args = parser.parse_args(argv)
+
+    reports = args.reports.split(",")
+    unknown = [name for name in reports if name not in [report[0] for report in REPORTS]]
+    if unknown:
+        parser.error("unknown report(s) %s" % (", ".join(unknown)))
+    scales = sorted([int(scale) for scale in args.scales.split(",")])
+
+    results = run(reports, scales, args.seed)
+    write_results(results, args.output)
+    print "Results written to %s.json and %s.csv" % (args.output, args.output)
+
+    if args.compare:
+        f = open(args.compare, "rb")
+        try:
+            previous = json.load(f)
+        finally:
+            f.close()
+        slower = regressions(results, previous, args.threshold)
+        for name, meters, before, after in slower:
+            print "REGRESSION: %s at %i meters took %.3fs, was %.3fs" % (name, meters, after, before)
+        if slower:
+            return 1
+        print "No regressions over %i%%" % (args.threshold * 100)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,46 @@
+# Name: arcpy (benchmark stand-in)
+# Description: Just enough of arcpy for the hnglib engines to run against
+# synthetic data on a machine without ArcGIS. Feature classes live in BACKEND, an
+# hnglib.backend.MemoryBackend, and every tool here (plus the arcpy.da cursors in
+# da.py) hands its call on to it: MakeFeatureLayer, SelectLayerByAttribute,
+# SelectLayerByLocation, GetCount, Describe, Exists and Delete cover what the
+# benchmarked code calls. Only benchmarks/run.py puts this on sys.path.
+
+from hnglib.backend import MemoryBackend, Geometry, Point, SpatialReference
+
+class env(object):
+    workspace = "synthetic.gdb"
+    overwriteOutput = True
+
+BACKEND = MemoryBackend(env.workspace)
+
+class Result(object):
+    def __init__(self, value):
+        self.value = value
+    def getOutput(self, index):
+        return str(self.value)
+
+def Describe(value):
+    return BACKEND.describe(value)
+
+def Exists(name):
+    return BACKEND.exists(name)
+
+def Delete_management(name):
+    BACKEND.delete(name)
+
+def MakeFeatureLayer_management(in_features, out_layer, where_clause=None):
+    return Result(BACKEND.make_feature_layer(in_features, out_layer, where_clause))
+
+def SelectLayerByAttribute_management(in_layer_or_view, selection_type="NEW_SELECTION", where_clause=None):
+    return Result(BACKEND.select_layer_by_attribute(in_layer_or_view, selection_type, where_clause))
+
+def SelectLayerByLocation_management(in_layer, overlap_type="INTERSECT", select_features=None,
+                                     search_distance=None, selection_type="NEW_SELECTION"):
+    return Result(BACKEND.select_layer_by_location(in_layer, overlap_type, select_features,
+                                                   search_distance, selection_type))
+
+def GetCount_management(in_rows):
+    return Result(BACKEND.get_count(in_rows))
+
+from arcpy import da
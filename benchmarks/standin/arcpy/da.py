@@ -0,0 +1,18 @@
+# Name: arcpy.da (benchmark stand-in)
+# Description: The data access cursors and edit sessions, handed on to the
+# stand-in's MemoryBackend (see hnglib.backend for how fields, where clauses and
+# selections are handled).
+
+import arcpy
+
+def SearchCursor(in_table, field_names, where_clause=None, spatial_reference=None, *args, **kwargs):
+    return arcpy.BACKEND.search_cursor(in_table, field_names, where_clause, spatial_reference)
+
+def UpdateCursor(in_table, field_names, where_clause=None, *args, **kwargs):
+    return arcpy.BACKEND.update_cursor(in_table, field_names, where_clause)
+
+def InsertCursor(in_table, field_names):
+    return arcpy.BACKEND.insert_cursor(in_table, field_names)
+
+def Editor(workspace):
+    return arcpy.BACKEND.editor(workspace)
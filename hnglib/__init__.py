@@ -0,0 +1,4 @@
+# Name: hnglib
+# Description: Shared helpers used by the HNG ArcPy scripts. The scripts in the
+# repository root import from this package, so it must sit in the same folder as
+# the scripts on the HNG server.
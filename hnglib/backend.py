@@ -0,0 +1,793 @@
+# Name: backend.py
+# Description: The geodatabase operations the scripts rely on (MakeFeatureLayer,
+# SelectLayerByAttribute, SelectLayerByLocation, GetCount, the da Search/Update/
+# InsertCursors, plus Describe and edit sessions) behind one interface, with two
+# implementations:
+#   ArcpyBackend - passes every call straight to arcpy
+#   MemoryBackend - keeps each feature class in memory as columns, layer
+#                   selections as OID bitsets, answers attribute selections with
+#                   compiled where clauses and location selections through a grid
+#                   spatial index
+# hnglib.gdb reads and writes through active(), which is arcpy unless use() picks
+# another backend, so the same code runs against the geodatabase or offline
+# against data extracted into a MemoryBackend (tests, benchmarks, what-if runs).
+#
+# Both backends have the same methods, each answering the way the arcpy tool or
+# class of the same name does:
+#   make_feature_layer(in_features, out_layer, where_clause=None)
+#   select_layer_by_attribute(in_layer, selection_type, where_clause=None)
+#   select_layer_by_location(in_layer, overlap_type, select_features,
+#                            search_distance=None, selection_type)
+#   get_count(in_rows) - an int rather than a Result
+#   search_cursor(in_table, field_names, where_clause=None, spatial_reference=None)
+#   update_cursor(in_table, field_names, where_clause=None)
+#   insert_cursor(in_table, field_names)
+#   describe(value), editor(workspace)
+#
+# The MemoryBackend covers a subset of arcpy:
+#   - where clauses: =, <>, <, >, <=, >=, AND, OR, NOT, IN, IS [NOT] NULL (no LIKE,
+#     no functions)
+#   - selection types: all of SELECTION_TYPES
+#   - overlap types: INTERSECT and WITHIN_A_DISTANCE for any shapes, and WITHIN/
+#     COMPLETELY_WITHIN against polygon select features (a vertex lying exactly on
+#     the boundary counts as inside or out by the crossing number rule, so the two
+#     are not told apart); anything else raises NotImplementedError
+#   - shapes: Point, Polyline and Polygon, written through SHAPE@ or SHAPE@XY
+#   - spatial references: nothing is projected, so a search cursor asking for any
+#     spatial reference but the table's own raises ValueError
+
+import re
+import numpy as np
+from hnglib import kernels
+from hnglib.spatial_index import SpatialIndex
+
+SELECTION_TYPES = ("NEW_SELECTION", "ADD_TO_SELECTION", "REMOVE_FROM_SELECTION",
+                   "SUBSET_SELECTION", "SWITCH_SELECTION", "CLEAR_SELECTION")
+# Meters in one of each linear unit a search distance may be given in
+UNITS = {"FEET": 0.3048, "FOOT": 0.3048, "USSURVEYFEET": 1200.0 / 3937, "METERS": 1.0, "METER": 1.0,
+         "KILOMETERS": 1000.0, "MILES": 1609.344, "YARDS": 0.9144}
+
+### WHERE CLAUSES
+
+# Tokens of the SQL where clauses used in the reports: strings, numbers, field
+# names (optionally "quoted"), comparison operators, parentheses and commas
+TOKEN = re.compile(r"""\s*(?:(?P<string>'(?:[^']|'')*')|(?P<number>-?\d+\.?\d*|-?\.\d+)|"(?P<quoted>[^"]+)"|(?P<word>[A-Za-z_][A-Za-z0-9_]*)|(?P<op><>|!=|<=|>=|=|<|>|\(|\)|,))""")
+OPERATORS = {"=": "==", "<>": "!=", "!=": "!=", "<=": "<=", ">=": ">=", "<": "<", ">": ">", ",": ","}
+
+# Translates a SQL where clause (the subset used in the reports: =, <>, <, >, <=,
+# >=, AND, OR, NOT, IN (...), IS [NOT] NULL) into a Python expression over a row
+# tuple. Returns (expression, field names in row order). NULLs compare as None, so
+# "x = 1" is False for a NULL x as in SQL, but NOT around a NULL comparison is
+# True where SQL would leave the row out.
+def translate_where(where_clause):
+    tokens = []
+    position = 0
+    where_clause = where_clause.strip()
+    while position < len(where_clause):
+        match = TOKEN.match(where_clause, position)
+        if match is None or match.end() == position:
+            raise ValueError("Can't read where clause at \"%s\"" % (where_clause[position:]))
+        tokens.append((match.lastgroup, match.group(match.lastgroup)))
+        position = match.end()
+
+    fields = []
+    expression = []
+    in_depth = []
+    depth = 0
+    i = 0
+    while i < len(tokens):
+        kind, text = tokens[i]
+        upper = text.upper() if kind == "word" else None
+        if kind == "string":
+            expression.append(repr(text[1:-1].replace("''", "'")))
+        elif kind == "number":
+            expression.append(text)
+        elif upper in ("AND", "OR", "NOT"):
+            expression.append(upper.lower())
+        elif upper == "IN":
+            expression.append("in")
+            in_depth.append(depth + 1)
+        elif upper == "IS":
+            if i + 2 < len(tokens) and tokens[i + 1][1].upper() == "NOT" and tokens[i + 2][1].upper() == "NULL":
+                expression.append("is not None")
+                i += 2
+            elif i + 1 < len(tokens) and tokens[i + 1][1].upper() == "NULL":
+                expression.append("is None")
+                i += 1
+            else:
+                raise ValueError("IS must be followed by NULL or NOT NULL in \"%s\"" % (where_clause))
+        elif upper == "NULL":
+            expression.append("None")
+        elif upper == "LIKE":
+            raise ValueError("LIKE is not supported in \"%s\"" % (where_clause))
+        elif kind in ("word", "quoted"):
+            if text not in fields:
+                fields.append(text)
+            expression.append("row[%i]" % (fields.index(text)))
+        elif text == "(":
+            depth += 1
+            expression.append("[" if in_depth and in_depth[-1] == depth else "(")
+        elif text == ")":
+            if in_depth and in_depth[-1] == depth:
+                expression.append("]")
+                in_depth.pop()
+            else:
+                expression.append(")")
+            depth -= 1
+        else:
+            expression.append(OPERATORS[text])
+        i += 1
+    return " ".join(expression), fields
+
+# Field names a where clause refers to
+def where_fields(where_clause):
+    if not where_clause:
+        return []
+    return translate_where(where_clause)[1]
+
+# Compiles a where clause into a function of a row tuple (values of the returned
+# field names, in order). Returns (function, field names).
+def compile_where(where_clause):
+    expression, fields = translate_where(where_clause)
+    return eval("lambda row: " + expression, {}), fields
+
+### ARCPY BACKEND
+
+class ArcpyBackend(object):
+    # arcpy is only imported once this backend is made, so hnglib works offline
+    # with a MemoryBackend. Every call looks arcpy's function up again, so the
+    # profiling wrappers (see profiling.py) still see it.
+    def __init__(self):
+        import arcpy
+        self.arcpy = arcpy
+
+    def make_feature_layer(self, in_features, out_layer, where_clause=None):
+        self.arcpy.MakeFeatureLayer_management(in_features, out_layer, where_clause)
+        return out_layer
+
+    def select_layer_by_attribute(self, in_layer, selection_type="NEW_SELECTION", where_clause=None):
+        self.arcpy.SelectLayerByAttribute_management(in_layer, selection_type, where_clause)
+        return in_layer
+
+    def select_layer_by_location(self, in_layer, overlap_type="INTERSECT", select_features=None,
+                                 search_distance=None, selection_type="NEW_SELECTION"):
+        self.arcpy.SelectLayerByLocation_management(in_layer, overlap_type, select_features,
+                                                    search_distance, selection_type)
+        return in_layer
+
+    def get_count(self, in_rows):
+        return int(self.arcpy.GetCount_management(in_rows).getOutput(0))
+
+    def search_cursor(self, in_table, field_names, where_clause=None, spatial_reference=None):
+        return self.arcpy.da.SearchCursor(in_table, field_names, where_clause, spatial_reference)
+
+    def update_cursor(self, in_table, field_names, where_clause=None):
+        return self.arcpy.da.UpdateCursor(in_table, field_names, where_clause)
+
+    def insert_cursor(self, in_table, field_names):
+        return self.arcpy.da.InsertCursor(in_table, field_names)
+
+    def describe(self, value):
+        return self.arcpy.Describe(value)
+
+    def editor(self, workspace):
+        return self.arcpy.da.Editor(workspace)
+
+_active = []
+
+# The backend hnglib reads and writes through (arcpy unless use() said otherwise)
+def active():
+    if not _active:
+        _active.append(ArcpyBackend())
+    return _active[0]
+
+def use(backend):
+    del _active[:]
+    _active.append(backend)
+    return backend
+
+### IN-MEMORY SHAPES
+
+class Point(object):
+    __slots__ = ("X", "Y")
+    def __init__(self, X=None, Y=None):
+        self.X = X
+        self.Y = Y
+
+class SpatialReference(object):
+    def __init__(self, name="NAD_1983_StatePlane_Texas_South_FIPS_4205_Feet", metersPerUnit=0.3048006096012192,
+                 XYResolution=0.0003280833333333, type="Projected", factoryCode=0):
+        self.name = name
+        self.type = type
+        self.metersPerUnit = metersPerUnit
+        self.XYResolution = XYResolution
+        self.factoryCode = factoryCode
+    def exportToString(self):
+        return "%s['%s']" % ("GEOGCS" if self.type == "Geographic" else "PROJCS", self.name)
+    # The geographic coordinate system under this one (itself when geographic)
+    @property
+    def GCS(self):
+        if self.type == "Geographic":
+            return self
+        return SpatialReference("GCS_North_American_1983", 111319.49079327357, 8.983152841195215e-09, "Geographic", 4269)
+
+# Whether two spatial references (arcpy's or this module's) are the same
+# coordinate system: by factory code (WKID) when both have one, otherwise by
+# their full definition
+def same_spatial_reference(a, b):
+    if a.factoryCode and b.factoryCode:
+        return a.factoryCode == b.factoryCode
+    return a.exportToString() == b.exportToString()
+
+# A shape held by a MemoryBackend, handed out for the SHAPE@ token the way arcpy
+# does: iterating gives one list of Points per part, with None between a polygon
+# part's rings.
+#   shape_type - "Point", "Polyline" or "Polygon"
+#   parts - (x, y) for a point, a list of vertex lists for a line, a list of parts
+#           (each a list of rings, exterior first) for a polygon
+class Geometry(object):
+    def __init__(self, shape_type, parts):
+        self.type = shape_type.lower()
+        self.parts = parts
+
+    def __iter__(self):
+        if self.type == "point":
+            yield [Point(*self.parts)]
+            return
+        for part in self.parts:
+            if self.type == "polyline":
+                yield [Point(x, y) for x, y in part]
+            else:
+                points = []
+                for i, ring in enumerate(part):
+                    if i > 0:
+                        points.append(None)
+                    points.extend([Point(x, y) for x, y in ring])
+                yield points
+
+    @property
+    def length(self):
+        return sum([segment_length(segment) for segment in shape_segments(self.type, self.parts)])
+
+    @property
+    def area(self):
+        if self.type != "polygon":
+            return 0.0
+        area = 0.0
+        for part in self.parts:
+            for i, ring in enumerate(part):
+                ring_area = abs(sum([x0 * y1 - x1 * y0 for (x0, y0), (x1, y1) in zip(ring, ring[1:] + ring[:1])])) / 2.0
+                area += -ring_area if i > 0 else ring_area
+        return area
+
+def segment_length(segment):
+    x0, y0, x1, y1 = segment
+    return ((x1 - x0) ** 2 + (y1 - y0) ** 2) ** 0.5
+
+# Plain parts of whatever was written to a SHAPE@ field: a Geometry from this
+# module, an arcpy geometry (or anything iterable like one) or raw parts
+def shape_parts(shape_type, value):
+    if value is None:
+        return None
+    if isinstance(value, Geometry):
+        return value.parts
+    if shape_type == "Point":
+        if isinstance(value, (tuple, list)) and len(value) == 2 and not hasattr(value[0], "__iter__"):
+            return tuple(value)
+        point = value.firstPoint if hasattr(value, "firstPoint") else list(value)[0][0]
+        return (point.X, point.Y)
+    parts = []
+    for part in value:
+        points = list(part)
+        if points and isinstance(points[0], tuple):
+            parts.append(points)
+            continue
+        if shape_type == "Polyline":
+            parts.append([(pnt.X, pnt.Y) for pnt in points if pnt is not None])
+        else:
+            rings, ring = [], []
+            for pnt in points + [None]:
+                if pnt is None:
+                    if ring:
+                        rings.append(ring)
+                    ring = []
+                else:
+                    ring.append((pnt.X, pnt.Y))
+            parts.append(rings)
+    return parts
+
+# Segments (x0, y0, x1, y1) of a shape's outline: a point is one zero length
+# segment, rings are closed
+def shape_segments(shape_type, parts):
+    if parts is None:
+        return []
+    if shape_type.lower() == "point":
+        return [(parts[0], parts[1], parts[0], parts[1])]
+    if shape_type.lower() == "polyline":
+        lines = parts
+    else:
+        lines = [ring + ring[:1] for part in parts for ring in part]
+    return [(x0, y0, x1, y1) for line in lines for (x0, y0), (x1, y1) in zip(line[:-1], line[1:])]
+
+def shape_extent(shape_type, parts):
+    segments = shape_segments(shape_type, parts)
+    if not segments:
+        return (0.0, 0.0, -1.0, -1.0)
+    xs = [s[0] for s in segments] + [s[2] for s in segments]
+    ys = [s[1] for s in segments] + [s[3] for s in segments]
+    return (min(xs), min(ys), max(xs), max(ys))
+
+# Closest approach between two sets of segments (n x 4 and m x 4 arrays): 0 when
+# any pair crosses, otherwise the least distance from an end of one segment to the
+# other segment. Done chunk_cells pairs at a time.
+def segments_distance(a, b, chunk_cells=1000000):
+    best = np.inf
+    rows = max(1, chunk_cells // max(len(b), 1))
+    for start in range(0, len(a), rows):
+        s = a[start:start + rows][:, None, :]
+        t = b[None, :, :]
+        if np.any(segments_cross(s, t)):
+            return 0.0
+        best = min(best, np.min(point_segment_distance(s[..., 0], s[..., 1], t)),
+                   np.min(point_segment_distance(s[..., 2], s[..., 3], t)),
+                   np.min(point_segment_distance(t[..., 0], t[..., 1], s)),
+                   np.min(point_segment_distance(t[..., 2], t[..., 3], s)))
+    return best
+
+def point_segment_distance(px, py, segments):
+    x0, y0, x1, y1 = segments[..., 0], segments[..., 1], segments[..., 2], segments[..., 3]
+    dx, dy = x1 - x0, y1 - y0
+    length2 = dx * dx + dy * dy
+    with np.errstate(invalid="ignore", divide="ignore"):
+        t = np.where(length2 > 0, ((px - x0) * dx + (py - y0) * dy) / length2, 0.0)
+    t = np.clip(t, 0.0, 1.0)
+    return np.hypot(px - (x0 + t * dx), py - (y0 + t * dy))
+
+def segments_cross(s, t):
+    def side(ax, ay, bx, by, px, py):
+        return np.sign((bx - ax) * (py - ay) - (by - ay) * (px - ax))
+    d1 = side(t[..., 0], t[..., 1], t[..., 2], t[..., 3], s[..., 0], s[..., 1])
+    d2 = side(t[..., 0], t[..., 1], t[..., 2], t[..., 3], s[..., 2], s[..., 3])
+    d3 = side(s[..., 0], s[..., 1], s[..., 2], s[..., 3], t[..., 0], t[..., 1])
+    d4 = side(s[..., 0], s[..., 1], s[..., 2], s[..., 3], t[..., 2], t[..., 3])
+    return (d1 * d2 < 0) & (d3 * d4 < 0)
+
+# Whether any vertex of a shape lies inside a polygon's rings
+def vertices_inside(shape_type, parts, rings):
+    segments = shape_segments(shape_type, parts)
+    if not segments or not rings:
+        return False
+    xs = np.array([s[0] for s in segments], dtype=np.float64)
+    ys = np.array([s[1] for s in segments], dtype=np.float64)
+    return bool(np.any(kernels.points_in_rings(xs, ys, rings)))
+
+# Whether a shape lies inside a polygon's rings: every vertex inside and no
+# segment crossing the polygon's outline
+def shape_within(shape_type, parts, rings):
+    segments = shape_segments(shape_type, parts)
+    if not segments or not rings:
+        return False
+    xs = np.array([s[0] for s in segments] + [s[2] for s in segments], dtype=np.float64)
+    ys = np.array([s[1] for s in segments] + [s[3] for s in segments], dtype=np.float64)
+    if not np.all(kernels.points_in_rings(xs, ys, rings)):
+        return False
+    if shape_type.lower() == "point":
+        return True
+    a = np.array(segments, dtype=np.float64)
+    b = np.array(shape_segments("Polygon", [rings]), dtype=np.float64)
+    return not np.any(segments_cross(a[:, None, :], b[None, :, :]))
+
+# Distance between two shapes (0 when they touch, cross or one is inside the other)
+def shape_distance(shape_type, parts, other_type, other_parts):
+    if shape_type == "Polygon" and vertices_inside(other_type, other_parts, [r for p in parts for r in p]):
+        return 0.0
+    if other_type == "Polygon" and vertices_inside(shape_type, parts, [r for p in other_parts for r in p]):
+        return 0.0
+    a = np.array(shape_segments(shape_type, parts), dtype=np.float64).reshape(-1, 4)
+    b = np.array(shape_segments(other_type, other_parts), dtype=np.float64).reshape(-1, 4)
+    if not len(a) or not len(b):
+        return np.inf
+    return segments_distance(a, b)
+
+### IN-MEMORY BACKEND
+
+# One feature class: parallel columns of OBJECTIDs, shapes and attribute values,
+# with a live bitset marking the rows not deleted. version goes up on every write
+# so cached arrays, bitsets and the spatial index know to rebuild.
+class MemoryTable(object):
+    def __init__(self, shape_type, fields, spatial_reference=None):
+        self.shape_type = shape_type
+        self.fields = list(fields)
+        self.spatial_reference = spatial_reference or SpatialReference()
+        self.oids = []
+        self.shapes = []
+        self.columns = dict((field, []) for field in self.fields)
+        self.live = []
+        self.next_oid = 1
+        self.version = 0
+        self.cache = {}
+
+    def __len__(self):
+        return len(self.oids)
+
+    # Adds a row, numbered next_oid unless it brings its own OBJECTID
+    def insert(self, shape, attributes, oid=None):
+        if oid is None:
+            oid = self.next_oid
+        self.next_oid = max(self.next_oid, oid + 1)
+        self.oids.append(oid)
+        self.shapes.append(shape)
+        for field in self.fields:
+            self.columns[field].append(attributes.get(field))
+        self.live.append(True)
+        self.version += 1
+        return oid
+
+    # The table's own spelling of a field name (geodatabase field names ignore
+    # case)
+    def field_name(self, field):
+        for name in self.fields:
+            if name.upper() == field.upper():
+                return name
+        raise RuntimeError("Cannot find field '%s'" % (field))
+
+    # A value computed from the rows, kept until the next write
+    def cached(self, key, build):
+        if key not in self.cache or self.cache[key][0] != self.version:
+            self.cache[key] = (self.version, build())
+        return self.cache[key][1]
+
+    def live_bits(self):
+        return self.cached("live", lambda: np.array(self.live, dtype=bool))
+
+    # One column (or cursor token) as a list, for every row
+    def column(self, field):
+        token = field.upper()
+        if token in ("OID@", "OBJECTID"):
+            return self.oids
+        if token == "SHAPE@XY":
+            return self.shapes
+        if token in ("SHAPE@X", "SHAPE@Y"):
+            i = int(token == "SHAPE@Y")
+            return [None if shape is None else shape[i] for shape in self.shapes]
+        if token == "SHAPE@":
+            return [None if shape is None else Geometry(self.shape_type, shape) for shape in self.shapes]
+        if token == "SHAPE@LENGTH":
+            return [None if shape is None else Geometry(self.shape_type, shape).length for shape in self.shapes]
+        if token == "SHAPE@AREA":
+            return [None if shape is None else Geometry(self.shape_type, shape).area for shape in self.shapes]
+        return self.columns[self.field_name(field)]
+
+    def value(self, field, row):
+        token = field.upper()
+        if token in ("OID@", "OBJECTID"):
+            return self.oids[row]
+        if token.startswith("SHAPE@"):
+            shape = self.shapes[row]
+            if shape is None:
+                return None
+            if token == "SHAPE@XY":
+                return shape
+            if token in ("SHAPE@X", "SHAPE@Y"):
+                return shape[int(token == "SHAPE@Y")]
+            geometry = Geometry(self.shape_type, shape)
+            if token == "SHAPE@LENGTH":
+                return geometry.length
+            if token == "SHAPE@AREA":
+                return geometry.area
+            return geometry
+        return self.columns[self.field_name(field)][row]
+
+    def set_value(self, field, row, value):
+        token = field.upper()
+        if token in ("OID@", "OBJECTID"):
+            return
+        if token in ("SHAPE@XY", "SHAPE@"):
+            self.shapes[row] = shape_parts(self.shape_type, value)
+        elif token.startswith("SHAPE@"):
+            raise NotImplementedError("%s can't be written, use SHAPE@ or SHAPE@XY" % (field))
+        else:
+            self.columns[self.field_name(field)][row] = value
+        self.version += 1
+
+    def delete(self, row):
+        self.live[row] = False
+        self.version += 1
+
+    # Bitset of the rows matching a where clause, the clause compiled once and its
+    # result kept until the table changes
+    def where_bits(self, where_clause):
+        if not where_clause or not where_clause.strip():
+            return self.live_bits()
+        def build():
+            predicate, fields = self.cached(("compiled", where_clause), lambda: compile_where(where_clause))
+            columns = [self.column(field) for field in fields]
+            matches = np.fromiter((predicate(row) for row in zip(*columns)), dtype=bool, count=len(self)) if fields \
+                else np.repeat(bool(predicate(())), len(self))
+            return matches & self.live_bits()
+        return self.cached(("where", where_clause), build)
+
+    # Grid index over the extents of every row's shape
+    def spatial_index(self):
+        return self.cached("index", lambda: SpatialIndex([Extent(shape_extent(self.shape_type, shape)) for shape in self.shapes]))
+
+class Extent(object):
+    __slots__ = ("extent",)
+    def __init__(self, extent):
+        self.extent = extent
+
+# A feature layer: a table, the where clause it was made with and the OID bitset
+# of its selected rows (None when nothing is selected, i.e. everything counts)
+class MemoryLayer(object):
+    def __init__(self, table, where_clause=None):
+        self.table = table
+        self.where_clause = where_clause
+        self.selection = None
+
+    # Rows in the layer (before any selection)
+    def rows(self):
+        return self.table.where_bits(self.where_clause)
+
+    def selected(self):
+        rows = self.rows()
+        if self.selection is None:
+            return rows
+        selection = self.selection
+        if len(selection) < len(rows):
+            selection = np.concatenate([selection, np.zeros(len(rows) - len(selection), dtype=bool)])
+        return selection & rows
+
+    def select(self, selection_type, matches):
+        rows = self.rows()
+        current = self.selected() if self.selection is not None else np.zeros(len(rows), dtype=bool)
+        if selection_type == "NEW_SELECTION":
+            bits = matches
+        elif selection_type == "ADD_TO_SELECTION":
+            bits = current | matches
+        elif selection_type == "REMOVE_FROM_SELECTION":
+            bits = current & ~matches
+        elif selection_type == "SUBSET_SELECTION":
+            bits = current & matches
+        elif selection_type == "SWITCH_SELECTION":
+            bits = rows & ~current
+        elif selection_type == "CLEAR_SELECTION":
+            self.selection = None
+            return
+        else:
+            raise ValueError("Unknown selection type %s (expected one of %s)" % (selection_type, ", ".join(SELECTION_TYPES)))
+        self.selection = bits & rows
+
+class MemoryCursor(object):
+    def __init__(self, table, fields, rows):
+        self.table = table
+        self.fields = tuple(fields)
+        self.rows = rows
+        self.current = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+class MemorySearchCursor(MemoryCursor):
+    def __iter__(self):
+        value = self.table.value
+        for row in self.rows:
+            self.current = row
+            yield tuple([value(field, row) for field in self.fields])
+
+class MemoryUpdateCursor(MemoryCursor):
+    def __iter__(self):
+        value = self.table.value
+        for row in self.rows:
+            if not self.table.live[row]:
+                continue
+            self.current = row
+            yield [value(field, row) for field in self.fields]
+
+    def updateRow(self, values):
+        for field, value in zip(self.fields, values):
+            self.table.set_value(field, self.current, value)
+
+    def deleteRow(self):
+        self.table.delete(self.current)
+
+class MemoryInsertCursor(MemoryCursor):
+    def insertRow(self, values):
+        values = dict(zip([field.upper() for field in self.fields], values))
+        shape = None
+        for token in ("SHAPE@", "SHAPE@XY"):
+            if token in values:
+                shape = shape_parts(self.table.shape_type, values.pop(token))
+        values.pop("OID@", None)
+        return self.table.insert(shape, dict((self.table.field_name(field), value) for field, value in values.items()))
+
+class Description(object):
+    def __init__(self, **properties):
+        self.__dict__.update(properties)
+
+# Edit sessions over a MemoryBackend: an aborted operation puts every table back
+# the way it was when the operation started
+class MemoryEditor(object):
+    def __init__(self, backend, workspace):
+        self.backend = backend
+        self.workspace = workspace
+        self.saved = None
+
+    def startEditing(self, with_undo=True, multiuser_mode=True):
+        pass
+
+    def startOperation(self):
+        self.saved = dict((name, (list(t.oids), list(t.shapes), dict((f, list(c)) for f, c in t.columns.items()),
+                                  list(t.live), t.next_oid)) for name, t in self.backend.tables.items())
+
+    def stopOperation(self):
+        self.saved = None
+
+    def abortOperation(self):
+        for name, (oids, shapes, columns, live, next_oid) in (self.saved or {}).items():
+            table = self.backend.tables[name]
+            table.oids, table.shapes, table.columns, table.live, table.next_oid = oids, shapes, columns, live, next_oid
+            table.version += 1
+        self.saved = None
+
+    def stopEditing(self, save_changes):
+        if not save_changes:
+            self.abortOperation()
+
+class MemoryBackend(object):
+    def __init__(self, workspace="memory.gdb"):
+        self.workspace = workspace
+        self.tables = {}
+        self.layers = {}
+
+    # Creates (or replaces) a feature class from (shape, {field: value}) rows, shapes
+    # given as plain parts (see Geometry). The rows are numbered from 1 unless oids
+    # gives each one's OBJECTID.
+    def add_table(self, name, shape_type, fields, rows=(), spatial_reference=None, oids=None):
+        table = MemoryTable(shape_type, fields, spatial_reference)
+        for i, (shape, attributes) in enumerate(rows):
+            table.insert(shape, attributes, None if oids is None else oids[i])
+        self.tables[name] = table
+        self.layers.pop(name, None)
+        return table
+
+    # Copies a layer (its selected rows, the given fields) out of another backend,
+    # e.g. the geodatabase through an ArcpyBackend, for offline or what-if runs. The
+    # rows keep their OBJECTIDs, so anything keyed by OID (update_rows, the
+    # COMPANY_ID lists, cache signatures) matches the source.
+    def extract(self, source, in_table, fields, name=None):
+        desc = source.describe(in_table)
+        oids, rows = [], []
+        for row in source.search_cursor(in_table, ["OID@", "SHAPE@"] + list(fields)):
+            oids.append(row[0])
+            rows.append((shape_parts(desc.shapeType, row[1]), dict(zip(fields, row[2:]))))
+        return self.add_table(name or in_table, desc.shapeType, fields, rows, desc.spatialReference, oids)
+
+    def clear(self):
+        self.tables.clear()
+        self.layers.clear()
+
+    def exists(self, name):
+        return name in self.tables or name in self.layers
+
+    def delete(self, name):
+        self.tables.pop(name, None)
+        self.layers.pop(name, None)
+
+    # The layer for a layer name, feature class name or full path (a feature class
+    # counts as a layer with nothing selected)
+    def layer(self, name):
+        if name in self.layers:
+            return self.layers[name]
+        if name not in self.tables and name.startswith(self.workspace):
+            name = name[len(self.workspace):].lstrip("\\/")
+        if name not in self.tables:
+            raise RuntimeError("ERROR 000732: Dataset %s does not exist or is not supported" % (name))
+        return MemoryLayer(self.tables[name])
+
+    def make_feature_layer(self, in_features, out_layer, where_clause=None):
+        source = self.layer(in_features)
+        clauses = [clause for clause in (source.where_clause, where_clause) if clause]
+        self.layers[out_layer] = MemoryLayer(source.table, " AND ".join(["(%s)" % (c) for c in clauses]) or None)
+        return out_layer
+
+    def select_layer_by_attribute(self, in_layer, selection_type="NEW_SELECTION", where_clause=None):
+        layer = self.layers[in_layer]
+        layer.select(selection_type, layer.table.where_bits(where_clause))
+        return in_layer
+
+    # Selects the features of in_layer which INTERSECT, are WITHIN_A_DISTANCE of, or
+    # are WITHIN/COMPLETELY_WITHIN (polygon select features only) the selected
+    # features of select_features. Candidates come from in_layer's spatial index and are then
+    # tested exactly.
+    def select_layer_by_location(self, in_layer, overlap_type="INTERSECT", select_features=None,
+                                 search_distance=None, selection_type="NEW_SELECTION"):
+        layer = self.layers[in_layer]
+        table = layer.table
+        overlap_type = overlap_type.upper()
+        if overlap_type not in ("INTERSECT", "WITHIN_A_DISTANCE", "WITHIN", "COMPLETELY_WITHIN"):
+            raise NotImplementedError("%s is not a supported overlap type" % (overlap_type))
+        distance = 0.0
+        if overlap_type == "WITHIN_A_DISTANCE":
+            distance = self.linear_distance(search_distance, table.spatial_reference)
+
+        others = self.layer(select_features)
+        if overlap_type in ("WITHIN", "COMPLETELY_WITHIN") and others.table.shape_type != "Polygon":
+            raise NotImplementedError("%s is only supported against polygon select features" % (overlap_type))
+        candidates = layer.rows()
+        index = table.spatial_index()
+        matches = np.zeros(len(table), dtype=bool)
+        for other in np.flatnonzero(others.selected()).tolist():
+            other_shape = others.table.shapes[other]
+            if other_shape is None:
+                continue
+            xmin, ymin, xmax, ymax = shape_extent(others.table.shape_type, other_shape)
+            rings = [r for p in other_shape for r in p] if others.table.shape_type == "Polygon" else None
+            for row in index.candidates_in_extent((xmin - distance, ymin - distance, xmax + distance, ymax + distance)):
+                if matches[row] or not candidates[row] or table.shapes[row] is None:
+                    continue
+                if overlap_type in ("WITHIN", "COMPLETELY_WITHIN"):
+                    matches[row] = shape_within(table.shape_type, table.shapes[row], rings)
+                else:
+                    matches[row] = shape_distance(table.shape_type, table.shapes[row],
+                                                  others.table.shape_type, other_shape) <= distance
+        layer.select(selection_type, matches)
+        return in_layer
+
+    # A search distance ("300 Feet", or a bare number in the layer's units) in the
+    # layer's units
+    def linear_distance(self, search_distance, spatial_reference):
+        if search_distance is None or search_distance == "":
+            return 0.0
+        words = str(search_distance).split()
+        value = float(words[0])
+        if len(words) < 2 or words[1].upper() in ("UNKNOWN", "DECIMALDEGREES"):
+            return value
+        unit = words[1].upper()
+        if unit not in UNITS:
+            raise ValueError("Unknown distance unit %s" % (words[1]))
+        return value * UNITS[unit] / spatial_reference.metersPerUnit
+
+    def get_count(self, in_rows):
+        return int(np.count_nonzero(self.layer(in_rows).selected()))
+
+    def matching_rows(self, in_table, where_clause):
+        layer = self.layer(in_table)
+        bits = layer.selected()
+        if where_clause:
+            bits = bits & layer.table.where_bits(where_clause)
+        return layer.table, np.flatnonzero(bits).tolist()
+
+    # Rows can only be read in the table's own spatial reference: projecting them
+    # the way arcpy does is not supported, and raises rather than hand out
+    # coordinates in the wrong system
+    def search_cursor(self, in_table, field_names, where_clause=None, spatial_reference=None):
+        table, rows = self.matching_rows(in_table, where_clause)
+        if spatial_reference is not None and not same_spatial_reference(spatial_reference, table.spatial_reference):
+            raise ValueError("%s is in %s and can't be read in %s (the in-memory backend doesn't project)"
+                             % (in_table, table.spatial_reference.name, spatial_reference.name))
+        return MemorySearchCursor(table, field_names, rows)
+
+    def update_cursor(self, in_table, field_names, where_clause=None):
+        table, rows = self.matching_rows(in_table, where_clause)
+        return MemoryUpdateCursor(table, field_names, rows)
+
+    def insert_cursor(self, in_table, field_names):
+        return MemoryInsertCursor(self.layer(in_table).table, field_names, [])
+
+    def describe(self, value):
+        if value in self.tables or value in self.layers:
+            table = self.layer(value).table
+            folder = value.replace("/", "\\").rpartition("\\")[0]
+            return Description(name=value, dataType="FeatureClass" if value in self.tables else "FeatureLayer",
+                               shapeType=table.shape_type, spatialReference=table.spatial_reference,
+                               OIDFieldName="OBJECTID", shapeFieldName="Shape", lengthFieldName="", areaFieldName="",
+                               path=self.workspace + ("\\" + folder if folder else ""))
+        if value == self.workspace:
+            return Description(name=value, dataType="Workspace", path="")
+        return Description(name=value, dataType="FeatureDataset", path=self.workspace)
+
+    def editor(self, workspace):
+        return MemoryEditor(self, workspace)
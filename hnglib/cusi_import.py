@@ -0,0 +1,80 @@
+# Name: cusi_import.py
+# Description: Writes the meter locations out as the 31 column CSV the CUSI
+# billing system imports. Only the five fields CUSI uses are read, through one
+# da.SearchCursor (which fetches rows in batches), and rows go out through a large
+# write buffer, so the export streams at a flat memory use however big meter_ref
+# gets.
+
+import csv
+import gzip
+import os
+from hnglib import backend
+
+# Fields read from the meter layer, in the order they are passed around here
+FIELDS = ["latitude", "longitude", "serv_id", "route_no", "RRC_Area"]
+HEADER = ("latitude", "longitude", "serv_id", "route_no", "user5")
+
+# Width of a CUSI import row and where each field goes in it (route_no is zero
+# padded to 2 characters, RRC_Area goes in user5, the rest are left blank)
+COLUMNS = 31
+LATITUDE, LONGITUDE, SERV_ID, ROUTE, RRC = 0, 1, 2, 11, 30
+
+# Turns (latitude, longitude, serv_id, route_no, RRC_Area) tuples into padded
+# import rows. The row template is allocated once and filled in for each row
+# (csv.writer copies the values out as it writes).
+def padded_rows(meters):
+    row = [""] * COLUMNS
+    for latitude, longitude, serv_id, route, RRC_Area in meters:
+        row[LATITUDE] = latitude
+        row[LONGITUDE] = longitude
+        row[SERV_ID] = serv_id
+        row[ROUTE] = str(route).zfill(2)
+        row[RRC] = RRC_Area
+        yield row
+
+# Name of chunk number (counting from 1) of the export, e.g. CUSI_Import_002.csv
+def chunk_path(filepath, number):
+    base, extension = os.path.splitext(filepath)
+    return "%s_%03i%s" % (base, number, extension)
+
+# Opens one output file, gzipped (with .gz added to the name) when compress is
+# set, and writes the header row to it. Returns (file, csv writer, path).
+def start_file(filepath, compress=False, buffer_size=1048576):
+    if compress:
+        filepath += ".gz"
+        f = gzip.GzipFile(filepath, 'wb')
+    else:
+        f = open(filepath, 'wb', buffer_size)
+    writer = csv.writer(f, dialect='excel')
+    writer.writerows(padded_rows([HEADER]))
+    return f, writer, filepath
+
+# Exports every meter in layer to filepath, streaming rows from the cursor
+# straight into a buffer_size write buffer.
+#   rows_per_file - split the export into numbered files of at most this many
+#                   meters, each with its own header row (None or 0 for one file)
+#   compress - gzip the output file(s)
+# Returns (number of meters written, list of files written)
+def export_meters(layer, filepath, rows_per_file=None, compress=False, buffer_size=1048576):
+    rows_per_file = rows_per_file or None
+    files = []
+    count = 0
+    f = None
+    try:
+        for row in padded_rows(backend.active().search_cursor(layer, FIELDS)):
+            if f is None or (rows_per_file is not None and count % rows_per_file == 0):
+                if f is not None:
+                    f.close()
+                path = filepath if rows_per_file is None else chunk_path(filepath, len(files) + 1)
+                f, writer, path = start_file(path, compress, buffer_size)
+                files.append(path)
+            writer.writerow(row)
+            count += 1
+        if f is None:
+            path = filepath if rows_per_file is None else chunk_path(filepath, 1)
+            f, writer, path = start_file(path, compress, buffer_size)
+            files.append(path)
+    finally:
+        if f is not None:
+            f.close()
+    return count, files
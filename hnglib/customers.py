@@ -0,0 +1,117 @@
+# Name: customers.py
+# Description: Reads the CUSI customer info spreadsheet (current_customer_info.xls)
+# straight into memory and joins it to meters by service ID, replacing the
+# ExcelToTable + AddJoin round trip through a temporary geodatabase table.
+
+import os
+import xlrd
+
+CUSTOMER_SHEET = "servloc"
+
+# Columns read from the customer sheet, in the order read_customers yields them
+CUSTOMER_COLUMNS = ("latitude", "longitude", "serv_id", "serv_stat", "meter_on")
+# Indexes into a customer tuple
+LATITUDE, LONGITUDE, SERV_ID, SERV_STAT, METER_ON = range(5)
+# Where a column is when its header isn't found (the lat/long columns have always
+# been the first two and serv_id the third)
+DEFAULT_POSITIONS = {"latitude": 0, "longitude": 1, "serv_id": 2}
+
+# Parsed sheets, keyed by (path, sheet, modification time), so every module in a
+# run shares one parse and an edited workbook is read again
+_parsed = {}
+
+# Converts a float-encoded cell to an int, or None for a blank cell
+def whole_number(value, name, row):
+    if value == '' or value is None:
+        return None
+    try:
+        number = float(value)
+    except ValueError:
+        raise ValueError("Row %i: %s \"%s\" is not a number" % (row + 1, name, value))
+    if number != int(number):
+        raise ValueError("Row %i: %s %s is not a whole number" % (row + 1, name, value))
+    return int(number)
+
+# Converts a lat/long cell to a float, or None for a blank cell
+def coordinate(value):
+    if value == '' or value is None:
+        return None
+    return float(value)
+
+# Finds the column index of each name in the header row
+def column_indexes(header, columns, xls, sheet):
+    header = [str(name).strip() for name in header]
+    indexes = []
+    for name in columns:
+        if name in header:
+            indexes.append(header.index(name))
+        elif name in DEFAULT_POSITIONS:
+            indexes.append(DEFAULT_POSITIONS[name])
+        else:
+            raise ValueError("Column \"%s\" not found in sheet %s of %s" % (name, sheet, xls))
+    return indexes
+
+# Streams the customer sheet one row at a time, reading only the CUSTOMER_COLUMNS
+# cells, as (latitude, longitude, serv_id, serv_stat, meter_on) tuples.
+# Lat/long are floats, serv_id and meter_on ints and blank cells None. Rows with
+# no serv_id are skipped. The sheet is opened on demand (only the sheet itself is
+# loaded from the workbook) and falls back to the first sheet if there is none
+# called sheet.
+def iter_customers(xls, sheet=CUSTOMER_SHEET):
+    book = xlrd.open_workbook(xls, on_demand=True)
+    try:
+        if sheet in book.sheet_names():
+            sh = book.sheet_by_name(sheet)
+        else:
+            sh = book.sheet_by_index(0)
+        lat_col, long_col, id_col, stat_col, on_col = column_indexes(sh.row_values(0), CUSTOMER_COLUMNS, xls, sheet)
+        cell = sh.cell_value
+        for i in range(1, sh.nrows):
+            serv_id = whole_number(cell(i, id_col), "serv_id", i)
+            if serv_id is None:
+                continue
+            serv_stat = cell(i, stat_col)
+            yield (coordinate(cell(i, lat_col)), coordinate(cell(i, long_col)), serv_id,
+                   None if serv_stat == '' else serv_stat, whole_number(cell(i, on_col), "meter_on", i))
+    finally:
+        book.release_resources()
+
+# Same rows as iter_customers, but parsed only once per run: later calls for the
+# same unchanged workbook get the list from the first call
+def read_customers(xls, sheet=CUSTOMER_SHEET):
+    key = (os.path.abspath(xls), sheet, os.path.getmtime(xls))
+    if key not in _parsed:
+        _parsed[key] = list(iter_customers(xls, sheet))
+    return _parsed[key]
+
+# Loads the customer sheet into a dict of serv_id -> (serv_stat, meter_on). If a
+# serv_id appears more than once the first row wins, the same as AddJoin.
+def load_status(xls, sheet=CUSTOMER_SHEET):
+    return customer_status(read_customers(xls, sheet))
+
+# Same dict as load_status, built from customer tuples already read
+def customer_status(customers):
+    status = {}
+    for customer in customers:
+        status.setdefault(customer[SERV_ID], (customer[SERV_STAT], customer[METER_ON]))
+    return status
+
+# Joins meters to the customer status dict in one pass.
+#   meters - (x, y, serv_id, ...) tuples
+# Returns (joined, unjoined) where joined is a list of
+# (x, y, serv_stat, meter_on, serv_id, ...) tuples ready for taxing.build_rows
+# (serv_stat and meter_on are None for meters with no customer record) and
+# unjoined is the list of serv_ids that had no match.
+def join_status(meters, status):
+    joined = []
+    unjoined = []
+    for meter in meters:
+        serv_id = meter[2]
+        match = None
+        if serv_id is not None:
+            match = status.get(int(serv_id))
+        if match is None:
+            unjoined.append(serv_id)
+            match = (None, None)
+        joined.append(meter[:2] + match + meter[2:])
+    return joined, unjoined
@@ -0,0 +1,163 @@
+# Name: duplicates.py
+# Description: Finds identical (spatially coincident) line features by hashing a
+# canonical form of each geometry, so every group of duplicates comes out of one
+# pass over the layer instead of an ARE_IDENTICAL_TO selection per feature.
+
+import hashlib
+import math
+
+# Canonical form of a line: every vertex snapped to the geodatabase XY resolution,
+# repeated vertices dropped, each part written in whichever direction sorts first
+# and the parts sorted. Two lines digitized in opposite directions, or with their
+# parts in a different order, give the same key.
+def canonical_key(parts, resolution):
+    canonical = []
+    for part in parts:
+        snapped = []
+        for x, y in part:
+            vertex = (int(round(x / resolution)), int(round(y / resolution)))
+            if not snapped or snapped[-1] != vertex:
+                snapped.append(vertex)
+        if not snapped:
+            continue
+        snapped = tuple(snapped)
+        canonical.append(min(snapped, snapped[::-1]))
+    canonical.sort()
+    return hashlib.md5(repr(canonical)).digest()
+
+# Groups lines by canonical key.
+#   lines - (OBJECTID, parts) tuples
+# Returns {OBJECTID: number of lines (itself included) sharing its geometry}
+def duplicate_counts(lines, resolution):
+    keys = {}
+    groups = {}
+    for oid, parts in lines:
+        key = canonical_key(parts, resolution)
+        keys[oid] = key
+        groups[key] = groups.get(key, 0) + 1
+    return dict((oid, groups[key]) for oid, key in keys.items())
+
+# Stretch of segment s which segment t runs along: t must be within angle of s
+# (cos_angle being the cosine of that angle) and both of its ends within distance
+# of the line through s. Returns (start, end) of t projected onto s, clipped to s,
+# as distances from the start of s, or None when they don't overlap.
+def segment_interval(s, t, distance, cos_angle):
+    ax, ay, bx, by = s
+    cx, cy, dx, dy = t
+    ux, uy = bx - ax, by - ay
+    vx, vy = dx - cx, dy - cy
+    slength = (ux * ux + uy * uy) ** 0.5
+    tlength = (vx * vx + vy * vy) ** 0.5
+    if abs(ux * vx + uy * vy) < cos_angle * slength * tlength:
+        return None
+    nx, ny = -uy / slength, ux / slength
+    if abs((cx - ax) * nx + (cy - ay) * ny) > distance or abs((dx - ax) * nx + (dy - ay) * ny) > distance:
+        return None
+    p = ((cx - ax) * ux + (cy - ay) * uy) / slength
+    q = ((dx - ax) * ux + (dy - ay) * uy) / slength
+    start, end = max(0.0, min(p, q)), min(slength, max(p, q))
+    return (start, end) if end > start else None
+
+# Carries an interval of segment s (distances from its start) over to segment t:
+# both ends are projected onto t and clipped to it. Returns (start, end) as
+# distances from the start of t, or None when nothing of t is left.
+def project_interval(s, interval, t):
+    ax, ay, bx, by = s
+    cx, cy, dx, dy = t
+    slength = math.hypot(bx - ax, by - ay)
+    tlength = math.hypot(dx - cx, dy - cy)
+    ends = []
+    for distance_along in interval:
+        x = ax + (bx - ax) * distance_along / slength
+        y = ay + (by - ay) * distance_along / slength
+        ends.append(((x - cx) * (dx - cx) + (y - cy) * (dy - cy)) / tlength)
+    start, end = max(0.0, min(ends)), min(tlength, max(ends))
+    return (start, end) if end > start else None
+
+# Total length of the union of (start, end) intervals
+def union_length(intervals):
+    total = 0.0
+    reach = None
+    for start, end in sorted(intervals):
+        if reach is None or start > reach:
+            total += end - start
+            reach = end
+        elif end > reach:
+            total += end - reach
+            reach = end
+    return total
+
+# Finds lines which partly overlap each other within a distance and angle
+# tolerance, catching pipe digitized twice or offset by a few inches that
+# canonical_key misses. Every segment is put into each cell of a spatial hash
+# grid its (tolerance-widened) extent touches, and only segments of different
+# lines sharing a cell are compared, so the work stays roughly linear.
+#   lines - (OBJECTID, parts) tuples
+#   distance - tolerance in coordinate units
+#   angle - tolerance in degrees
+# Returns (pairs, excess):
+#   pairs - {(OBJECTID, OBJECTID): overlapping length in coordinate units}, the
+#           lower OBJECTID first
+#   excess - length in coordinate units counted more than once when every line
+#            is added up: each segment's stretches covered by lines with a lower
+#            OBJECTID, merged so N copies of a stretch of length L give (N-1)*L
+#            rather than a pair's worth per pair
+def find_overlaps(lines, distance, angle, cellsize=None):
+    segments = []
+    for oid, parts in lines:
+        for part in parts:
+            for (ax, ay), (bx, by) in zip(part[:-1], part[1:]):
+                if (ax, ay) != (bx, by):
+                    segments.append((oid, (ax, ay, bx, by)))
+    if not segments:
+        return {}, 0.0
+    if cellsize is None:
+        average = sum([math.hypot(s[2] - s[0], s[3] - s[1]) for oid, s in segments]) / len(segments)
+        cellsize = max(average, distance * 4, 1e-9)
+
+    cells = {}
+    for i, (oid, (ax, ay, bx, by)) in enumerate(segments):
+        col0 = int(math.floor((min(ax, bx) - distance) / cellsize))
+        col1 = int(math.floor((max(ax, bx) + distance) / cellsize))
+        row0 = int(math.floor((min(ay, by) - distance) / cellsize))
+        row1 = int(math.floor((max(ay, by) + distance) / cellsize))
+        for col in range(col0, col1 + 1):
+            for row in range(row0, row1 + 1):
+                cells.setdefault((col, row), []).append(i)
+
+    cos_angle = math.cos(math.radians(angle))
+    compared = set()
+    overlaps = {}
+    # {segment index: [(start, end) covered by segments of lower OBJECTIDs]}
+    covered = {}
+    for members in cells.values():
+        if len(members) < 2:
+            continue
+        for n, i in enumerate(members):
+            oid_i, s = segments[i]
+            for j in members[n + 1:]:
+                oid_j, t = segments[j]
+                if oid_i == oid_j or (i, j) in compared:
+                    continue
+                compared.add((i, j))
+                # Measure along the longer segment so a short piece lying on a long
+                # one counts in full (a long segment at a slight angle drifts out
+                # of the distance tolerance of a short one's line)
+                if (s[2] - s[0]) ** 2 + (s[3] - s[1]) ** 2 >= (t[2] - t[0]) ** 2 + (t[3] - t[1]) ** 2:
+                    longer = s
+                    interval = segment_interval(s, t, distance, cos_angle)
+                else:
+                    longer = t
+                    interval = segment_interval(t, s, distance, cos_angle)
+                if interval:
+                    pair = (min(oid_i, oid_j), max(oid_i, oid_j))
+                    overlaps[pair] = overlaps.get(pair, 0.0) + interval[1] - interval[0]
+                    # The excess is merged along the later segment's own axis, the
+                    # one every interval covering it is carried over to
+                    later, later_segment = (i, s) if oid_i > oid_j else (j, t)
+                    if longer is not later_segment:
+                        interval = project_interval(longer, interval, later_segment)
+                    if interval:
+                        covered.setdefault(later, []).append(interval)
+    excess = sum([union_length(intervals) for intervals in covered.values()])
+    return overlaps, excess
@@ -0,0 +1,192 @@
+# Name: gdb.py
+# Description: Geodatabase readers which pull a whole feature class (or layer) into
+# memory with a single da cursor, so the rest of a script can work on plain
+# Python data instead of selecting and counting through geoprocessing tools.
+# Cursors, Describe and edit sessions go through backend.active(), which is arcpy
+# unless a script picked the in-memory backend.
+#
+# The readers hand out raw coordinates, so layers which are compared with each
+# other (meters against districts, lines against areas) have to be read in one
+# spatial reference: pass spatial_reference (usually spatial_reference(layer) of
+# one of them) and the cursor projects the rest on the fly, as the geoprocessing
+# tools did.
+
+import cPickle
+import os
+from hnglib import backend
+from hnglib import geometry
+from hnglib import kernels
+from hnglib.spatial_index import SpatialIndex
+
+# Bump this whenever the pickled layout of a cached index changes so old cache
+# files are rebuilt instead of loaded
+CACHE_VERSION = 1
+
+# Spatial reference a layer is stored in
+def spatial_reference(layer):
+    return backend.active().describe(layer).spatialReference
+
+# Reads every polygon in a layer, in cursor order, keeping the requested attribute
+# fields on each one. Coordinates are in spatial_reference (the layer's own when
+# None), as for the other readers.
+def read_polygons(layer, fields=(), spatial_reference=None):
+    fields = list(fields)
+    polygons = []
+    for row in backend.active().search_cursor(layer, ["OID@", "SHAPE@"] + fields, None, spatial_reference):
+        attributes = dict(zip(fields, row[2:]))
+        polygons.append(geometry.Polygon(row[0], geometry.polygon_rings(row[1]), attributes))
+    return polygons
+
+# Reads every point in a layer as a (x, y, field1, field2, ...) tuple
+def read_points(layer, fields=(), spatial_reference=None):
+    points = []
+    for row in backend.active().search_cursor(layer, ["SHAPE@XY"] + list(fields), None, spatial_reference):
+        x, y = row[0] if row[0] is not None else (None, None)
+        points.append((x, y) + tuple(row[1:]))
+    return points
+
+# Coordinate arrays (see kernels.coordinate_arrays) of the points in a layer read
+# in spatial_reference, lined up with oids (NaN for an OBJECTID not read), for
+# points already read in another spatial reference
+def point_arrays(layer, oids, spatial_reference=None):
+    points = dict((row[2], row[:2]) for row in read_points(layer, ["OID@"], spatial_reference))
+    return kernels.coordinate_arrays([points.get(oid, (None, None)) for oid in oids])
+
+# Reads every line in a layer (optionally filtered by a where clause) as a
+# (parts, field1, field2, ...) tuple, parts being a list of vertex lists
+def read_polylines(layer, fields=(), where_clause=None, spatial_reference=None):
+    lines = []
+    for row in backend.active().search_cursor(layer, ["SHAPE@"] + list(fields), where_clause, spatial_reference):
+        lines.append((geometry.polyline_parts(row[0]),) + tuple(row[1:]))
+    return lines
+
+# Factor converting the layer's coordinate units to feet, for planar lengths
+def feet_per_unit(layer):
+    sr = backend.active().describe(layer).spatialReference
+    if sr.type != "Projected":
+        raise ValueError("%s is not in a projected coordinate system, can't measure planar lengths" % (layer))
+    return sr.metersPerUnit / 0.3048
+
+# Writes freshly computed lengths (in feet, one per OBJECTID in oids) into a length
+# field whose current values are stored, touching only the rows that are missing or
+# off by more than tolerance. Returns ({OBJECTID: length in feet}, number of rows
+# written).
+def write_lengths(layer, oids, stored, lengths, field="length_ft", tolerance=0.01):
+    lengths = dict(zip(oids, lengths))
+    dirty = [oid for oid, value in zip(oids, stored)
+             if value is None or abs(value - lengths[oid]) > tolerance]
+    update_rows(layer, [field], dict((oid, (lengths[oid],)) for oid in dirty))
+    return lengths, len(dirty)
+
+# Writes new values into the given fields for just the rows in values
+# ({OBJECTID: tuple of field values}), selecting them 1000 OBJECTIDs at a time so
+# the rest of the table is never touched
+def update_rows(layer, fields, values):
+    dirty = sorted(values)
+    oid_field = backend.active().describe(layer).OIDFieldName
+    for start in range(0, len(dirty), 1000):
+        chunk = dirty[start:start + 1000]
+        query = "%s IN (%s)" % (oid_field, ",".join([str(oid) for oid in chunk]))
+        with backend.active().update_cursor(layer, ["OID@"] + list(fields), query) as rows:
+            for row in rows:
+                rows.updateRow([row[0]] + list(values[row[0]]))
+
+# Counts the points (xs, ys arrays, see kernels.coordinate_arrays) inside each
+# polygon of a layer and writes the counts into a count field (Meters_Inside),
+# touching only the polygons whose stored count is out of date. The polygons are
+# read in spatial_reference, the one the points are in (the layer's own when
+# None). fields are read along with the count field for the caller's own use.
+# Returns (polygons, counts).
+def refresh_counts(layer, xs, ys, fields=(), field="Meters_Inside", spatial_reference=None):
+    polygons = read_polygons(layer, list(fields) + [field], spatial_reference)
+    located = kernels.locate_points(xs, ys, polygons)
+    counts = kernels.polygon_counts(polygons, located).tolist()
+    update_rows(layer, [field], dict((polygon.oid, (count,)) for polygon, count in zip(polygons, counts)
+                                     if polygon[field] != count))
+    return polygons, counts
+
+# Workspace (geodatabase) holding a feature class, for starting an edit session
+def layer_workspace(layer):
+    workspace = backend.active().describe(layer).path
+    if backend.active().describe(workspace).dataType == "FeatureDataset":
+        workspace = os.path.dirname(workspace)
+    return workspace
+
+# Creates a point in the meter layer for each (latitude, longitude, serv_id) row,
+# as returned by meters.reconcile. Every row is built before anything is written,
+# then inserted chunk_size at a time through da.InsertCursors inside one edit
+# operation, so a failure part way rolls the whole insert back. Rows with no
+# lat/long are skipped. With dry_run nothing is written. Returns the serv_ids
+# inserted (or that would have been).
+def insert_meters(layer, meters, dry_run=False, chunk_size=1000):
+    rows = [((longitude, latitude), serv_id) for latitude, longitude, serv_id in meters
+            if latitude is not None and longitude is not None]
+    if dry_run or not rows:
+        return [serv_id for xy, serv_id in rows]
+
+    edit = backend.active().editor(layer_workspace(layer))
+    edit.startEditing(False, False)
+    edit.startOperation()
+    try:
+        for start in range(0, len(rows), chunk_size):
+            with backend.active().insert_cursor(layer, ["SHAPE@XY", "serv_id"]) as cursor:
+                for row in rows[start:start + chunk_size]:
+                    cursor.insertRow(row)
+    except:
+        edit.abortOperation()
+        edit.stopEditing(False)
+        raise
+    edit.stopOperation()
+    edit.stopEditing(True)
+    return [serv_id for xy, serv_id in rows]
+
+# Cheap fingerprint of a layer's contents, read without touching any geometry: its
+# row count, highest OBJECTID and latest editor tracking edit date, with the fields
+# and spatial reference an index over it is read with. None when the layer has no
+# editor tracking, since an edit to an existing row (a moved vertex, a changed
+# attribute) would then leave the rest as it was.
+def layer_signature(layer, fields=(), spatial_reference=None):
+    desc = backend.active().describe(layer)
+    if not getattr(desc, "editorTrackingEnabled", False) or not desc.editedAtFieldName:
+        return None
+    count, last_oid, last_edit = 0, None, None
+    for oid, edited in backend.active().search_cursor(layer, ["OID@", desc.editedAtFieldName]):
+        count += 1
+        last_oid = max(last_oid, oid)
+        last_edit = max(last_edit, edited)
+    frame = (spatial_reference or desc.spatialReference).exportToString()
+    return repr((CACHE_VERSION, list(fields), frame, count, last_oid, last_edit))
+
+# Returns a SpatialIndex over the polygons in a layer, read in spatial_reference
+# (the layer's own when None). When cache_folder is given and the layer has editor
+# tracking, the index is pickled there and the next run reloads it instead of
+# reading the polygons, as long as the layer's signature (see layer_signature)
+# hasn't changed. Layers without editor tracking are always read afresh.
+def load_polygon_index(layer, fields=(), cache_folder=None, spatial_reference=None):
+    signature = None if cache_folder is None else layer_signature(layer, fields, spatial_reference)
+    if signature is None:
+        return SpatialIndex(read_polygons(layer, fields, spatial_reference))
+
+    name = layer.replace("\\", "_").replace("/", "_")
+    cache_file = os.path.join(cache_folder, name + ".idx")
+    if os.path.exists(cache_file):
+        try:
+            f = open(cache_file, 'rb')
+            try:
+                cached_signature, index = cPickle.load(f)
+            finally:
+                f.close()
+            if cached_signature == signature:
+                return index
+        except Exception as e:
+            print "Could not read cached index %s (%s), rebuilding..." % (cache_file, e)
+
+    index = SpatialIndex(read_polygons(layer, fields, spatial_reference))
+    if not os.path.isdir(cache_folder):
+        os.makedirs(cache_folder)
+    f = open(cache_file, 'wb')
+    try:
+        cPickle.dump((signature, index), f, 2)
+    finally:
+        f.close()
+    return index
@@ -0,0 +1,81 @@
+# Name: geometry.py
+# Description: Pure Python geometry used in place of per-feature geoprocessing
+# calls. Polygons are kept as lists of rings (each ring a list of (x, y) tuples)
+# so a point can be tested against them without going back to the geodatabase.
+# Exterior and interior rings are stored together and tested with the even-odd
+# rule, which takes care of multipart polygons and holes.
+
+# A polygon read out of the geodatabase: its OBJECTID, rings, extent, and a dict of
+# whichever attribute fields were requested when it was read
+class Polygon(object):
+    def __init__(self, oid, rings, attributes=None):
+        self.oid = oid
+        self.rings = rings
+        self.extent = rings_extent(rings)
+        self.attributes = attributes or {}
+
+    def __getitem__(self, field):
+        return self.attributes[field]
+
+    def contains(self, x, y):
+        xmin, ymin, xmax, ymax = self.extent
+        if x < xmin or x > xmax or y < ymin or y > ymax:
+            return False
+        return point_in_rings(x, y, self.rings)
+
+# Converts an arcpy Polygon (as returned by the SHAPE@ cursor token) into a list of
+# rings. arcpy separates the interior rings of a part with None.
+def polygon_rings(shape):
+    return [ring for part in polygon_parts(shape) for ring in part]
+
+# Converts an arcpy Polygon (SHAPE@) into a list of parts, each a list of rings
+# with the part's exterior ring first and its interior rings after it
+def polygon_parts(shape):
+    parts = []
+    if shape is None:
+        return parts
+    for part in shape:
+        rings = []
+        ring = []
+        for pnt in part:
+            if pnt is None:
+                if ring:
+                    rings.append(ring)
+                ring = []
+            else:
+                ring.append((pnt.X, pnt.Y))
+        if ring:
+            rings.append(ring)
+        if rings:
+            parts.append(rings)
+    return parts
+
+# Converts an arcpy Polyline (SHAPE@) into a list of parts, each a list of (x, y)
+# vertices
+def polyline_parts(shape):
+    if shape is None:
+        return []
+    return [[(pnt.X, pnt.Y) for pnt in part if pnt is not None] for part in shape]
+
+# Returns (xmin, ymin, xmax, ymax) for a list of rings
+def rings_extent(rings):
+    xs = [x for ring in rings for x, y in ring]
+    ys = [y for ring in rings for x, y in ring]
+    if not xs:
+        return (0.0, 0.0, -1.0, -1.0)
+    return (min(xs), min(ys), max(xs), max(ys))
+
+# Crossing number test of a single point against every ring of a polygon. Uses the
+# same boundary rule as kernels.points_in_rings so both always agree.
+def point_in_rings(x, y, rings):
+    inside = False
+    for ring in rings:
+        j = len(ring) - 1
+        for i in range(len(ring)):
+            (bx, by), (tx, ty) = ring[j], ring[i]
+            if by > ty:
+                (bx, by), (tx, ty) = (tx, ty), (bx, by)
+            if by <= y < ty and x < bx + (y - by) * (float(tx - bx) / (ty - by)):
+                inside = not inside
+            j = i
+    return inside
@@ -0,0 +1,217 @@
+# Name: kernels.py
+# Description: Vectorized NumPy versions of the geometry tests in geometry.py,
+# used when a whole layer of meters has to be tested at once. Coordinates are
+# passed as float arrays; missing coordinates should be NaN, which never tests as
+# inside anything.
+#
+# Boundary rule: an edge only counts as crossed when the point's y lies in the
+# half-open span [lower y, upper y) of the edge and the point is strictly left of
+# it. A point sitting on a border shared by two polygons therefore falls in
+# exactly one of them (the one above/right of the border), so every meter is
+# counted once and "meters missing!" totals come out the same on every run.
+
+import numpy as np
+from hnglib.spatial_index import SpatialIndex
+
+# Converts a sequence of (x, y, ...) tuples into x and y float arrays, with NaN for
+# missing coordinates
+def coordinate_arrays(points):
+    xs = np.array([np.nan if p[0] is None else p[0] for p in points], dtype=np.float64)
+    ys = np.array([np.nan if p[1] is None else p[1] for p in points], dtype=np.float64)
+    return xs, ys
+
+# Crossing number test of every point against a polygon given as a list of rings
+# (multipart polygons and holes handled by the even-odd rule). Returns a boolean
+# array.
+def points_in_rings(xs, ys, rings):
+    inside = np.zeros(len(xs), dtype=bool)
+    for ring in rings:
+        ring = np.asarray(ring, dtype=np.float64)
+        if len(ring) < 3:
+            continue
+        x0, y0 = ring[:, 0], ring[:, 1]
+        x1, y1 = np.roll(x0, -1), np.roll(y0, -1)
+
+        # Orient every edge bottom to top so an edge shared by two polygons gives
+        # bit-for-bit the same intersection in both of them
+        swap = y0 > y1
+        bx = np.where(swap, x1, x0)
+        by = np.where(swap, y1, y0)
+        tx = np.where(swap, x0, x1)
+        ty = np.where(swap, y0, y1)
+        keep = by != ty
+        bx, by, tx, ty = bx[keep], by[keep], tx[keep], ty[keep]
+        slope = (tx - bx) / (ty - by)
+
+        for k in range(len(bx)):
+            crossing = (ys >= by[k]) & (ys < ty[k])
+            crossing &= xs < bx[k] + (ys - by[k]) * slope[k]
+            inside ^= crossing
+    return inside
+
+# Assigns every point to a polygon, returning an integer array of polygon indexes
+# (-1 for points outside every polygon). polygons is a SpatialIndex, or a list of
+# polygons to build one over. The points are grouped by grid cell and each
+# polygon is only tested against the points in the cells it is registered in.
+# Where polygons overlap the first one in list order wins; see the boundary rule
+# above for shared borders.
+def locate_points(xs, ys, polygons):
+    if not isinstance(polygons, SpatialIndex):
+        polygons = SpatialIndex(polygons)
+    located = np.empty(len(xs), dtype=np.int64)
+    located.fill(-1)
+
+    # Points (NaN coordinates never land anywhere) sorted by grid cell, the same
+    # cell SpatialIndex.cell gives
+    points = np.nonzero(np.isfinite(xs) & np.isfinite(ys))[0]
+    if len(points) == 0 or not polygons.cells:
+        return located
+    cols = np.floor((xs[points] - polygons.xmin) / polygons.cellsize).astype(np.int64)
+    rows = np.floor((ys[points] - polygons.ymin) / polygons.cellsize).astype(np.int64)
+    order = np.lexsort((rows, cols))
+    points, cols, rows = points[order], cols[order], rows[order]
+    starts = np.nonzero(np.hstack([[True], (np.diff(cols) != 0) | (np.diff(rows) != 0)]))[0]
+    ends = np.append(starts[1:], len(points))
+
+    # Points to test against each polygon, from every cell it is registered in
+    polygon_points = {}
+    for start, end, col, row in zip(starts.tolist(), ends.tolist(), cols[starts].tolist(), rows[starts].tolist()):
+        for i in polygons.cells.get((col, row), ()):
+            polygon_points.setdefault(i, []).append(points[start:end])
+
+    for i in sorted(polygon_points):
+        polygon = polygons[i]
+        xmin, ymin, xmax, ymax = polygon.extent
+        candidates = np.concatenate(polygon_points[i])
+        cx, cy = xs[candidates], ys[candidates]
+        keep = (located[candidates] == -1) & (cx >= xmin) & (cx <= xmax) & (cy >= ymin) & (cy <= ymax)
+        candidates = candidates[keep]
+        if len(candidates) == 0:
+            continue
+        hits = points_in_rings(xs[candidates], ys[candidates], polygon.rings)
+        located[candidates[hits]] = i
+    return located
+
+# Number of points located in each polygon (in polygon order) from locate_points
+def polygon_counts(polygons, located):
+    return np.bincount(located[located >= 0], minlength=len(polygons))
+
+# Stacks the edges of a list of rings into an (n, 4) array of x0, y0, x1, y1
+def ring_edges(rings):
+    edges = []
+    for ring in rings:
+        ring = np.asarray(ring, dtype=np.float64)
+        if len(ring) >= 2:
+            edges.append(np.column_stack([ring[:, 0], ring[:, 1],
+                                          np.roll(ring[:, 0], -1), np.roll(ring[:, 1], -1)]))
+    if not edges:
+        return np.zeros((0, 4), dtype=np.float64)
+    return np.vstack(edges)
+
+# Same test as points_in_rings, but against an edge array from ring_edges and
+# broadcast over points x edges at once. Meant for small sets of points tested
+# against the few edges near them.
+def points_in_edges(xs, ys, edges):
+    swap = edges[:, 1] > edges[:, 3]
+    bx = np.where(swap, edges[:, 2], edges[:, 0])
+    by = np.where(swap, edges[:, 3], edges[:, 1])
+    tx = np.where(swap, edges[:, 0], edges[:, 2])
+    ty = np.where(swap, edges[:, 1], edges[:, 3])
+    keep = by != ty
+    bx, by, tx, ty = bx[keep], by[keep], tx[keep], ty[keep]
+    slope = (tx - bx) / (ty - by)
+    py = ys[:, None]
+    crossing = (py >= by) & (py < ty) & (xs[:, None] < bx + (py - by) * slope)
+    return crossing.sum(axis=1) % 2 == 1
+
+# Length of each segment (x0, y0) -> (x1, y1) lying inside a polygon, given as an
+# edge array from ring_edges. Every segment is cut where it crosses a polygon
+# edge, and each piece counts when its midpoint tests inside (so a piece running
+# along a shared border follows the boundary rule above). Only the edges near
+# the segments' extent take part, and the work is chunked to keep the
+# segment x edge arrays small.
+def lengths_inside(x0, y0, x1, y1, edges, chunk_cells=1000000):
+    inside = np.zeros(len(x0), dtype=np.float64)
+    if len(x0) == 0 or len(edges) == 0:
+        return inside
+    xmin = min(x0.min(), x1.min())
+    xmax = max(x0.max(), x1.max())
+    ymin = min(y0.min(), y1.min())
+    ymax = max(y0.max(), y1.max())
+    exmin = np.minimum(edges[:, 0], edges[:, 2])
+    exmax = np.maximum(edges[:, 0], edges[:, 2])
+    eymin = np.minimum(edges[:, 1], edges[:, 3])
+    eymax = np.maximum(edges[:, 1], edges[:, 3])
+
+    # Edges the segments could cross, and edges a ray cast in +x from any point on
+    # the segments could cross
+    cut_edges = edges[(exmax >= xmin) & (exmin <= xmax) & (eymax >= ymin) & (eymin <= ymax)]
+    ray_edges = edges[(exmax >= xmin) & (eymax >= ymin) & (eymin <= ymax)]
+    if len(ray_edges) == 0:
+        return inside
+    ex0, ey0 = cut_edges[:, 0], cut_edges[:, 1]
+    ex, ey = cut_edges[:, 2] - ex0, cut_edges[:, 3] - ey0
+
+    step = max(1, chunk_cells // max(len(cut_edges), len(ray_edges)))
+    for start in range(0, len(x0), step):
+        sx0, sy0 = x0[start:start + step], y0[start:start + step]
+        dx, dy = x1[start:start + step] - sx0, y1[start:start + step] - sy0
+        n = len(sx0)
+
+        # Parameter t along each segment where it meets each edge (NaN if it doesn't)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            denom = dx[:, None] * ey[None, :] - dy[:, None] * ex[None, :]
+            qx = ex0[None, :] - sx0[:, None]
+            qy = ey0[None, :] - sy0[:, None]
+            t = (qx * ey[None, :] - qy * ex[None, :]) / denom
+            u = (qx * dy[:, None] - qy * dx[:, None]) / denom
+            hit = (denom != 0) & (t > 0) & (t < 1) & (u >= 0) & (u <= 1)
+        t = np.where(hit, t, np.nan)
+
+        # Sorted cut points for each segment, bracketed by 0 and 1; NaN sorts last
+        # and never makes a piece
+        cuts = np.sort(np.hstack([np.zeros((n, 1)), t, np.ones((n, 1))]), axis=1)
+        lo, hi = cuts[:, :-1], cuts[:, 1:]
+        with np.errstate(invalid='ignore'):
+            piece = hi > lo
+        rows, cols = np.nonzero(piece)
+        lo, hi = lo[rows, cols], hi[rows, cols]
+        mid = (lo + hi) / 2.0
+        inside_piece = np.zeros(len(rows), dtype=bool)
+        for p in range(0, len(rows), step):
+            r, m = rows[p:p + step], mid[p:p + step]
+            inside_piece[p:p + step] = points_in_edges(sx0[r] + m * dx[r], sy0[r] + m * dy[r], ray_edges)
+
+        fraction = np.zeros(n, dtype=np.float64)
+        np.add.at(fraction, rows[inside_piece], (hi - lo)[inside_piece])
+        inside[start:start + step] = fraction * np.hypot(dx, dy)
+    return inside
+
+# Flattens lines (each a list of parts, each part a list of (x, y) vertices) into
+# flat vertex arrays: xs, ys, part_offsets (where each part starts in xs/ys, plus
+# a final entry for the end) and part_feature (which line each part belongs to)
+def flatten_lines(lines):
+    xs, ys, part_offsets, part_feature = [], [], [0], []
+    for feature, parts in enumerate(lines):
+        for part in parts:
+            for x, y in part:
+                xs.append(x)
+                ys.append(y)
+            part_offsets.append(len(xs))
+            part_feature.append(feature)
+    return (np.array(xs, dtype=np.float64), np.array(ys, dtype=np.float64),
+            np.array(part_offsets, dtype=np.int64), np.array(part_feature, dtype=np.int64))
+
+# Planar length of every line from the flat arrays made by flatten_lines, in
+# coordinate units (multiply by gdb.feet_per_unit for feet)
+def polyline_lengths(xs, ys, part_offsets, part_feature, count):
+    if len(xs) < 2:
+        return np.zeros(count, dtype=np.float64)
+    segments = np.hypot(np.diff(xs), np.diff(ys))
+
+    # Segment i joins vertex i to i + 1; drop the ones bridging two parts
+    valid = np.ones(len(segments), dtype=bool)
+    part_ends = part_offsets[1:-1] - 1
+    valid[part_ends[(part_ends >= 0) & (part_ends < len(segments))]] = False
+    vertex_feature = np.repeat(part_feature, np.diff(part_offsets))
+    return np.bincount(vertex_feature[:-1][valid], weights=segments[valid], minlength=count)
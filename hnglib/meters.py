@@ -0,0 +1,119 @@
+# Name: meters.py
+# Description: Reconciles the meters in ESRI (meter_ref) with the customer records
+# in CUSI by service ID. Both sides are read once and compared with counters and
+# sets, so the report no longer does list.remove() and list membership tests per
+# meter. Also works out the RRC area and route each meter sits in for
+# Update_Meters_Fields.py.
+
+from collections import Counter
+from hnglib import kernels
+
+# Result of reconcile. Lists keep the order their rows came in.
+#   ESRI_count/ESRI_unique/ESRI_last - features, unique service IDs, last ID read
+#   ESRI_blank - features with no service ID (left out of everything else)
+#   CUSI_count/CUSI_unique/CUSI_last - the same for the CUSI rows
+#   union_count - unique service IDs across both
+#   doubles - {serv_id: number of ESRI features} for IDs used more than once
+#   doubles_data - [serv_id, latitude, longitude] of every ESRI feature whose ID
+#                  is in doubles, in cursor order
+#   not_in_ESRI - sorted service IDs in CUSI but not ESRI
+#   not_in_CUSI - sorted service IDs in ESRI but not CUSI
+#   missing_meters - CUSI (latitude, longitude, serv_id) for IDs not in ESRI
+#   located_meters - the missing_meters rows which have a latitude
+#   dead_meters - the missing_meters rows with no lat/long
+class Reconciliation(object):
+    pass
+
+# Compares the two sides in one pass over each.
+#   ESRI_rows - (serv_id, latitude, longitude) for each meter_ref feature
+#   CUSI_rows - (latitude, longitude, serv_id, ...) for each customer row, as read
+#               by customers.read_customers (serv_id already an int, blank
+#               lat/long None)
+def reconcile(ESRI_rows, CUSI_rows):
+    result = Reconciliation()
+
+    ESRI_counts = Counter()
+    ESRI_data = []
+    result.ESRI_blank = 0
+    result.ESRI_last = None
+    for serv_id, latitude, longitude in ESRI_rows:
+        if serv_id is None:
+            result.ESRI_blank += 1
+            continue
+        ESRI_data.append((int(serv_id), [serv_id, latitude, longitude]))
+        ESRI_counts[int(serv_id)] += 1
+        result.ESRI_last = int(serv_id)
+    result.ESRI_count = len(ESRI_data)
+    result.ESRI_unique = len(ESRI_counts)
+
+    CUSI_ids = set()
+    result.CUSI_count = 0
+    result.CUSI_last = None
+    result.missing_meters = []
+    for row in CUSI_rows:
+        serv_id = row[2]
+        result.CUSI_count += 1
+        result.CUSI_last = serv_id
+        CUSI_ids.add(serv_id)
+        if serv_id not in ESRI_counts:
+            result.missing_meters.append(row[:3])
+    result.CUSI_unique = len(CUSI_ids)
+
+    result.union_count = len(CUSI_ids | set(ESRI_counts))
+    result.not_in_ESRI = sorted(CUSI_ids.difference(ESRI_counts))
+    result.not_in_CUSI = sorted(set(ESRI_counts).difference(CUSI_ids))
+    result.doubles = dict((serv_id, n) for serv_id, n in ESRI_counts.items() if n > 1)
+    result.doubles_data = [feature for serv_id, feature in ESRI_data if serv_id in result.doubles]
+    result.located_meters = [row for row in result.missing_meters if row[0] is not None]
+    result.dead_meters = [row for row in result.missing_meters if row[0] is None]
+    return result
+
+# Stored latitude/longitude values closer than this to the meter's point are left
+# alone. In degrees, the units of the meters' geographic coordinates (see
+# assign_areas).
+COORDINATE_TOLERANCE = 1e-9
+
+# Works out the RRC_Area (the RRC area's usercode), route_no (the route's Number),
+# latitude and longitude of every meter in one pass over each polygon layer.
+#   meters - (x, y, RRC_Area, route_no, latitude, longitude, OBJECTID) tuples, as
+#            read by gdb.read_points with
+#            ["RRC_Area", "route_no", "latitude", "longitude", "OID@"] in the
+#            meter layer's geographic coordinate system (its spatial reference's
+#            GCS), so x and y are the longitude and latitude in degrees
+#   xs, ys - the meters' coordinate arrays (kernels.coordinate_arrays) in the
+#            spatial reference the polygons were read in (gdb.point_arrays),
+#            which is what they are located with
+#   RRCs - RRC area polygons carrying usercode
+#   routes - route polygons carrying Number, read in the same spatial reference
+# A meter outside every polygon of a layer keeps its stored value for that field,
+# the same as when no selection ever reached it, and a meter with no point keeps
+# its lat/long. Returns (changes, unassigned) where changes is
+# {OBJECTID: (RRC_Area, route_no, latitude, longitude)} for just the meters whose
+# values differ from what is stored, and unassigned is the OBJECTIDs of meters
+# outside every RRC area or route.
+def assign_areas(meters, xs, ys, RRCs, routes, tolerance=COORDINATE_TOLERANCE):
+    RRC_located = kernels.locate_points(xs, ys, RRCs).tolist()
+    route_located = kernels.locate_points(xs, ys, routes).tolist()
+    usercodes = [str(area["usercode"]) for area in RRCs]
+    numbers = [int(str(area["Number"])) for area in routes]
+
+    changes = {}
+    unassigned = []
+    for meter, RRC_index, route_index in zip(meters, RRC_located, route_located):
+        x, y, RRC_Area, route_no, latitude, longitude, oid = meter
+        if RRC_index < 0 or route_index < 0:
+            unassigned.append(oid)
+        new_values = [usercodes[RRC_index] if RRC_index >= 0 else RRC_Area,
+                      numbers[route_index] if route_index >= 0 else route_no,
+                      latitude, longitude]
+        moved = False
+        if x is not None and y is not None:
+            if latitude is None or abs(latitude - y) > tolerance:
+                new_values[2] = y
+                moved = True
+            if longitude is None or abs(longitude - x) > tolerance:
+                new_values[3] = x
+                moved = True
+        if moved or new_values[:2] != [RRC_Area, route_no]:
+            changes[oid] = tuple(new_values)
+    return changes, unassigned
@@ -0,0 +1,312 @@
+# Name: onecall.py
+# Description: Per-county export and zip stage of the OneCall delivery. Each
+# county's buffer is read with a cursor and written as a shapefile straight into
+# its zip in the delivery folder (see shapefile.py), so the counties can be spread
+# over a pool of worker processes with no scratch folders or shared workspace.
+# A content key per county, kept between deliveries, lets a run redo only the
+# counties whose lines changed and reuse the previous zip for the rest.
+
+import cPickle
+import csv
+import glob
+import hashlib
+import os
+import shutil
+import tempfile
+import zipfile
+from cStringIO import StringIO
+import arcpy
+from hnglib import geometry
+from hnglib import parallel
+from hnglib import shapefile
+from hnglib.spatial_index import SpatialIndex
+
+MANIFEST_HEADER = ["Shapefile", "County", "Features", "Zip", "Bytes", "New"]
+
+# Bump this whenever the key or state layout changes so every county is redone
+STATE_VERSION = 1
+
+# Name of the shapefile (and zip) for one county, e.g. HNG_Buffer_Hidalgo_061514
+def shapefile_name(prefix, county, date):
+    return prefix + "_Buffer_" + county + "_" + date
+
+# One export task per county in an intersected buffer layer, in cursor order.
+#   layer - full path of the buffer/county intersect feature class (workers don't
+#           share the calling script's workspace)
+#   prefix - "AP" or "HNG"
+#   single_part - split the buffers so each disconnected piece becomes its own
+#                 feature (see county_features)
+def county_tasks(layer, prefix, date, destination, single_part=False):
+    tasks = []
+    seen = set()
+    for (county,) in arcpy.da.SearchCursor(layer, ["Name"]):
+        if county in seen:
+            continue
+        seen.add(county)
+        tasks.append((layer, county, shapefile_name(prefix, county, date), destination, single_part))
+    return tasks
+
+# dBASE field definitions for a feature class's attribute fields, the way
+# Select_analysis writes them to a shapefile: geometry and OBJECTID are dropped
+# and names cut to 10 characters, so Shape_Length and Shape_Area are kept as plain
+# Shape_Leng and Shape_Area Doubles.
+# Returns ([(name, type, width, decimals), ...], [field name in the layer, ...]).
+def dbf_fields(layer):
+    shape_field = arcpy.Describe(layer).shapeFieldName
+    fields = []
+    names = []
+    for field in arcpy.ListFields(layer):
+        if field.name == shape_field or field.type in ("OID", "Geometry", "Blob", "Raster"):
+            continue
+        if field.type == "String":
+            spec = ("C", min(max(field.length, 1), 254), 0)
+        elif field.type in ("GUID", "GlobalID"):
+            spec = ("C", 38, 0)
+        elif field.type == "SmallInteger":
+            spec = ("N", 6, 0)
+        elif field.type == "Integer":
+            spec = ("N", 10, 0)
+        elif field.type == "Single":
+            spec = ("F", 13, 11)
+        elif field.type == "Double":
+            spec = ("N", 19, 11)
+        elif field.type == "Date":
+            spec = ("D", 8, 0)
+        else:
+            continue
+        fields.append((unique_name(field.name, fields),) + spec)
+        names.append(field.name)
+    return fields, names
+
+# Cuts a field name to the 10 characters dBASE allows, numbering it if that
+# clashes with a field already in the list
+def unique_name(name, fields):
+    taken = set([field[0].upper() for field in fields])
+    short = name[:10]
+    number = 1
+    while short.upper() in taken:
+        suffix = "_%i" % (number)
+        short = name[:10 - len(suffix)] + suffix
+        number += 1
+    return short
+
+# Reads one county out of the layer as (shapes, fields, records), ready for
+# shapefile.write_polygons. With single_part every part of a polygon becomes its
+# own shape, with an ORIG_FID field numbering the county's features from 1 in
+# cursor order. That is how MultipartToSinglepart numbers the Select_analysis copy
+# of the county (see validate_county); it is not the layer's OBJECTID.
+def county_features(layer, county, single_part=False):
+    fields, names = dbf_fields(layer)
+    where_clause = "\"Name\" = '%s'" % (county.replace("'", "''"))
+    shapes = []
+    records = []
+    for number, row in enumerate(arcpy.da.SearchCursor(layer, ["SHAPE@"] + names, where_clause)):
+        parts = geometry.polygon_parts(row[0])
+        if single_part:
+            for part in parts:
+                shapes.append([part])
+                records.append(tuple(row[1:]) + (number + 1,))
+        else:
+            shapes.append(parts)
+            records.append(tuple(row[1:]))
+    if single_part:
+        fields.append(("ORIG_FID", "N", 10, 0))
+    if not fields:
+        fields = [("Id", "N", 6, 0)]
+        records = [(0,) for record in records]
+    return shapes, fields, records
+
+# The layer's coordinate system as the ESRI WKT that goes in a .prj file
+def projection(layer):
+    return arcpy.Describe(layer).spatialReference.exportToString().split(";")[0]
+
+# Writes one county's shapefile into an open ZipFile and returns its feature count
+def write_county(zipped, task):
+    layer, county, name, destination, single_part = task
+    shapes, fields, records = county_features(layer, county, single_part)
+    shapefile.write_polygons(zipped, name, shapes, fields, records, projection(layer))
+    return len(shapes)
+
+# Worker side of export_counties: writes one county's shapefile straight into its
+# zip in the destination folder. Returns a manifest row.
+def export_county(task):
+    layer, county, name, destination, single_part = task
+    zip_path = os.path.join(destination, name + ".zip")
+    zipped = zipfile.ZipFile(zip_path, "w")
+    try:
+        features = write_county(zipped, task)
+    finally:
+        zipped.close()
+    return [name, county, features, os.path.basename(zip_path), os.path.getsize(zip_path), "Yes"]
+
+# Worker side of validate_counties: exports one county the old way (Select_analysis,
+# plus MultipartToSinglepart for single_part, into a scratch shapefile folder) and
+# compares it with what export_county writes. Returns [name, differences].
+def validate_county(task):
+    layer, county, name, destination, single_part = task
+    scratch = tempfile.mkdtemp(prefix=name + "_")
+    try:
+        arcpy_shapefile = os.path.join(scratch, name + ".shp")
+        where_clause = "\"Name\" = '%s'" % (county.replace("'", "''"))
+        if single_part:
+            multipart = "in_memory\\" + name
+            arcpy.Select_analysis(layer, multipart, where_clause)
+            arcpy.MultipartToSinglepart_management(multipart, arcpy_shapefile)
+            arcpy.Delete_management(multipart)
+        else:
+            arcpy.Select_analysis(layer, arcpy_shapefile, where_clause)
+        theirs = {}
+        for path in glob.glob(os.path.join(scratch, name + ".*")):
+            f = open(path, "rb")
+            try:
+                theirs[os.path.splitext(path)[1].lower()] = f.read()
+            finally:
+                f.close()
+    finally:
+        shutil.rmtree(scratch, True)
+
+    buffer = StringIO()
+    zipped = zipfile.ZipFile(buffer, "w")
+    write_county(zipped, task)
+    ours = dict((os.path.splitext(entry)[1].lower(), zipped.read(entry)) for entry in zipped.namelist())
+    zipped.close()
+    return [name, shapefile.compare(ours, theirs)]
+
+# Checks every county in tasks against the old export (see validate_county),
+# returning [name, differences] for each
+def validate_counties(tasks, workers=1):
+    return parallel.map_in_order(validate_county, tasks, workers)
+
+# Runs export_county for every task over up to workers processes, returning the
+# manifest rows in task order
+def export_counties(tasks, workers=1):
+    return parallel.map_in_order(export_county, tasks, workers)
+
+# Writes the manifest rows (sorted by shapefile name) to manifest_path
+def write_manifest(rows, manifest_path):
+    f = open(manifest_path, 'wb')
+    try:
+        writer = csv.writer(f, dialect='excel')
+        writer.writerow(MANIFEST_HEADER)
+        writer.writerows(sorted(rows))
+    finally:
+        f.close()
+
+# Content key of every county's buffer for one company: a digest of the buffer
+# distance, the county's rings and every line that could reach the county (its
+# extent widened by the buffer distance overlaps the county's extent). The
+# clipped buffer of a county can only change when its key does.
+#   lines - (parts, ...) tuples, as read by gdb.read_polylines
+#   counties - the county polygons carrying Name
+#   distance - buffer distance in coordinate units
+# Returns {county Name: key} for the counties some line reaches
+def county_keys(lines, counties, distance):
+    counties = SpatialIndex(counties)
+    reaching = [[] for county in counties]
+    for line in lines:
+        extent = geometry.rings_extent(line[0])
+        if extent[0] > extent[2]:
+            continue
+        extent = (extent[0] - distance, extent[1] - distance, extent[2] + distance, extent[3] + distance)
+        digest = hashlib.md5(repr(line[0])).digest()
+        for c in counties.candidates_in_extent(extent):
+            xmin, ymin, xmax, ymax = counties[c].extent
+            if extent[2] < xmin or extent[0] > xmax or extent[3] < ymin or extent[1] > ymax:
+                continue
+            reaching[c].append(digest)
+    keys = {}
+    for county, digests in zip(counties, reaching):
+        if digests:
+            keys[county["Name"]] = hashlib.md5(repr((STATE_VERSION, distance, county.rings, sorted(digests)))).hexdigest()
+    return keys
+
+def load_state(filepath):
+    if not os.path.exists(filepath):
+        return None
+    f = open(filepath, 'rb')
+    try:
+        state = cPickle.load(f)
+    finally:
+        f.close()
+    if state.get("version") != STATE_VERSION:
+        return None
+    return state
+
+def save_state(state, filepath):
+    folder = os.path.dirname(filepath)
+    if folder and not os.path.isdir(folder):
+        os.makedirs(folder)
+    f = open(filepath, 'wb')
+    try:
+        cPickle.dump(state, f, 2)
+    finally:
+        f.close()
+
+# Splits one company's counties into those to redo and those whose previous zip
+# can be reused. A county is redone when it is new, its key changed, or its
+# previous zip is gone. (A county whose lines come near it but whose buffer
+# misses it has no zip, and stays unchanged with nothing to reuse.)
+#   state - the previous delivery's state (load_state), or None
+#   keys - county_keys for the company
+# Returns (changed county Names, {county Name: previous state entry})
+def changed_counties(state, prefix, keys):
+    previous = {} if state is None else state["counties"].get(prefix, {})
+    changed = []
+    unchanged = {}
+    for county in sorted(keys):
+        entry = previous.get(county)
+        if (entry is None or entry["key"] != keys[county] or
+                (entry["zip"] is not None and not os.path.exists(entry["zip"]))):
+            changed.append(county)
+        else:
+            unchanged[county] = entry
+    return changed, unchanged
+
+# Copies a zipped shapefile to zip_path, renaming the shapefile inside it from
+# old_name to name (e.g. from the previous delivery's date to this one's)
+def rename_zip(old_path, zip_path, old_name, name):
+    old = zipfile.ZipFile(old_path, "r")
+    try:
+        zipped = zipfile.ZipFile(zip_path, "w")
+        try:
+            for entry in old.namelist():
+                if entry.startswith(old_name + "."):
+                    entry_name = name + entry[len(old_name):]
+                else:
+                    entry_name = entry
+                zipped.writestr(entry_name, old.read(entry), zipfile.ZIP_DEFLATED)
+        finally:
+            zipped.close()
+    finally:
+        old.close()
+
+# Copies the previous delivery's zips of the unchanged counties into destination
+# under this delivery's dated names (the shapefiles inside them renamed to match)
+# and returns their manifest rows, flagged as not new
+def reuse_zips(unchanged, prefix, date, destination):
+    rows = []
+    for county in sorted(unchanged):
+        entry = unchanged[county]
+        if entry["zip"] is None:
+            continue
+        name = shapefile_name(prefix, county, date)
+        zip_path = os.path.join(destination, name + ".zip")
+        if os.path.abspath(entry["zip"]) != os.path.abspath(zip_path):
+            rename_zip(entry["zip"], zip_path, entry["row"][0], name)
+        rows.append([name, county, entry["row"][2], name + ".zip", os.path.getsize(zip_path), "No"])
+    return rows
+
+# State entries for this delivery's counties.
+#   rows - every manifest row of this delivery, exported or reused
+#   keys - county_keys for the company
+#   changed, unchanged - from changed_counties
+def county_state(prefix, rows, keys, changed, unchanged, destination):
+    entries = {}
+    for county, entry in unchanged.items():
+        entries[county] = entry
+    for county in changed:
+        entries[county] = {"key": keys[county], "zip": None, "row": None}
+    for row in rows:
+        if row[0].startswith(prefix + "_Buffer_") and row[1] in entries:
+            entries[row[1]] = {"key": keys[row[1]], "zip": os.path.join(destination, row[3]), "row": row}
+    return entries
@@ -0,0 +1,55 @@
+# Name: parallel.py
+# Description: Process pool helpers. The HNG scripts are written as top level
+# code with no __main__ guard, and on Windows every multiprocessing worker
+# normally re-imports the calling script, which would re-run it from the top. The
+# pool here is started with the script's path hidden, so workers only import what
+# the tasks need from hnglib.
+
+import multiprocessing
+import sys
+
+# Starts a multiprocessing.Pool without letting the workers re-import the calling
+# script (all workers are started in the Pool constructor)
+def start_pool(workers):
+    main = sys.modules['__main__']
+    main_file = getattr(main, '__file__', None)
+    argv0 = sys.argv[0] if sys.argv else None
+    try:
+        if main_file is not None:
+            del main.__file__
+        if sys.argv:
+            sys.argv[0] = ''
+        return multiprocessing.Pool(workers)
+    finally:
+        if main_file is not None:
+            main.__file__ = main_file
+        if sys.argv:
+            sys.argv[0] = argv0
+
+# Same as map(func, tasks), but spread over a pool of worker processes when
+# workers is more than 1. func must be a module level function in hnglib so the
+# workers can find it. Results always come back in task order.
+def map_in_order(func, tasks, workers=1):
+    tasks = list(tasks)
+    if workers <= 1 or len(tasks) <= 1:
+        return map(func, tasks)
+    pool = start_pool(min(workers, len(tasks)))
+    try:
+        return pool.map(func, tasks, 1)
+    finally:
+        pool.close()
+        pool.join()
+
+# Splits a list into at most n contiguous slices of nearly equal length, returning
+# (offset, slice) pairs
+def shard(items, n):
+    items = list(items)
+    n = max(1, min(n, len(items)))
+    size, extra = divmod(len(items), n)
+    shards = []
+    start = 0
+    for i in range(n):
+        end = start + size + (1 if i < extra else 0)
+        shards.append((start, items[start:end]))
+        start = end
+    return shards
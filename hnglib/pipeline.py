@@ -0,0 +1,74 @@
+# Name: pipeline.py
+# Description: One pass pipeline length engine. Each gas line is clipped against
+# the RRC areas it overlaps once, and the clipped length goes straight into an
+# (area, size category) matrix, replacing Intersect_analysis followed by a
+# SelectLayerByLocation/SelectLayerByAttribute/SearchCursor round trip for every
+# area, size label and size value.
+
+import numpy as np
+from hnglib import kernels
+from hnglib.spatial_index import SpatialIndex
+
+# Maps every size value listed in SIZE_CATEGORIES to its label ('NULL' becomes
+# None). Sizes not listed anywhere are left out of the report, the same as before
+# when no size query ever selected them.
+def size_labels(size_categories):
+    labels = {}
+    for label in size_categories:
+        for value in size_categories[label]:
+            labels[None if value == 'NULL' else value] = label
+    return labels
+
+# Flattens a line's parts into segment start/end coordinate arrays
+def segment_arrays(parts):
+    x0, y0, x1, y1 = [], [], [], []
+    for part in parts:
+        for (ax, ay), (bx, by) in zip(part[:-1], part[1:]):
+            x0.append(ax)
+            y0.append(ay)
+            x1.append(bx)
+            y1.append(by)
+    return (np.array(x0, dtype=np.float64), np.array(y0, dtype=np.float64),
+            np.array(x1, dtype=np.float64), np.array(y1, dtype=np.float64))
+
+# Sums the clipped length of lines inside each area, by bucket. The lines and
+# areas are clipped by their raw coordinates, so both must have been read in the
+# same spatial reference: the lines' own, the one feet_per_unit is for (see
+# gdb.read_polygons).
+#   lines - (parts, bucket) tuples; lines with a None bucket are skipped
+#   areas - SpatialIndex (or geometry.Polygon list) of the areas
+#   feet_per_unit - factor converting coordinate units to feet
+# Returns a list (one per area, in area order) of {bucket: length in feet}
+def area_lengths(lines, areas, feet_per_unit=1.0):
+    if not isinstance(areas, SpatialIndex):
+        areas = SpatialIndex(areas)
+    edges = [kernels.ring_edges(area.rings) for area in areas]
+    totals = [{} for area in areas]
+
+    for parts, bucket in lines:
+        if bucket is None:
+            continue
+        x0, y0, x1, y1 = segment_arrays(parts)
+        if len(x0) == 0:
+            continue
+        extent = (min(x0.min(), x1.min()), min(y0.min(), y1.min()),
+                  max(x0.max(), x1.max()), max(y0.max(), y1.max()))
+        for a in areas.candidates_in_extent(extent):
+            xmin, ymin, xmax, ymax = areas[a].extent
+            if extent[2] < xmin or extent[0] > xmax or extent[3] < ymin or extent[1] > ymax:
+                continue
+            length = kernels.lengths_inside(x0, y0, x1, y1, edges[a]).sum()
+            if length > 0:
+                totals[a][bucket] = totals[a].get(bucket, 0.0) + length * feet_per_unit
+    return totals
+
+# Builds the (area, size category) length matrix.
+#   lines - (parts, pipe_size) tuples, as read by gdb.read_polylines
+#   areas - SpatialIndex (or geometry.Polygon list) of the RRC areas, read in the
+#           lines' spatial reference
+#   size_categories - the SIZE_CATEGORIES option
+#   feet_per_unit - factor converting coordinate units to feet
+# Returns a list (one per area, in area order) of {size label: length in feet}
+def length_matrix(lines, areas, size_categories, feet_per_unit=1.0):
+    labels = size_labels(size_categories)
+    return area_lengths([(parts, labels.get(size)) for parts, size in lines], areas, feet_per_unit)
@@ -0,0 +1,312 @@
+# Name: profiling.py
+# Description: Profiling mode for the report and the standalone scripts. enable()
+# wraps every arcpy function and the arcpy.da cursors so each call's wall time is
+# recorded, with the rows each cursor reads or writes, against the current section
+# (a report module, or a whole script). Each section also notes the process's
+# peak memory when it ended and how much the section raised that peak. The
+# process peak only ever grows, so a section which stays under an earlier
+# section's peak shows no growth; the growth is a lower bound on what the section
+# itself needed, not its own peak. The profile is written out as JSON and CSV
+# and summarized on the console.
+#
+# A standalone script can be profiled without changing it:
+#   python -m hnglib.profiling Update_Meters_Fields.py
+
+import collections
+import contextlib
+import csv
+import functools
+import json
+import os
+import sys
+import time
+import types
+import arcpy
+
+CURSORS = ("SearchCursor", "UpdateCursor", "InsertCursor")
+COLUMNS = ["section", "call", "calls", "seconds", "rows", "process_peak_mb", "peak_growth_mb"]
+# Section the calls made outside of any section are recorded against
+NO_SECTION = "(none)"
+# Call name of a section's own row: its wall time and everything recorded in it
+TOTAL = "(total)"
+
+_enabled = False
+# {(section, call): [calls, seconds, rows]}
+_stats = {}
+# {section: [seconds, process peak memory at its end, growth of the peak during
+# it]} (memory in bytes)
+_sections = {}
+# Sections being timed, innermost last
+_stack = []
+# How many wrapped calls are running, so arcpy calls made by other arcpy calls are
+# left in their caller's time instead of being counted twice
+_depth = [0]
+
+# Peak memory of the process so far, in bytes (the peak working set on Windows,
+# the peak resident size elsewhere), or None when it can't be read
+def peak_memory():
+    if sys.platform == "win32":
+        import ctypes
+        from ctypes import wintypes
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD),
+                        ("PeakWorkingSetSize", ctypes.c_size_t), ("WorkingSetSize", ctypes.c_size_t),
+                        ("QuotaPeakPagedPoolUsage", ctypes.c_size_t), ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                        ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t), ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                        ("PagefileUsage", ctypes.c_size_t), ("PeakPagefileUsage", ctypes.c_size_t)]
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        if not ctypes.windll.psapi.GetProcessMemoryInfo(ctypes.windll.kernel32.GetCurrentProcess(),
+                                                        ctypes.byref(counters), counters.cb):
+            return None
+        return counters.PeakWorkingSetSize
+    if os.path.exists("/proc/self/status"):
+        f = open("/proc/self/status")
+        try:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+        finally:
+            f.close()
+    try:
+        import resource
+    except ImportError:
+        return None
+    # ru_maxrss is in bytes on macOS, kilobytes elsewhere
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+
+def current_section():
+    return _stack[-1] if _stack else NO_SECTION
+
+# Adds to the totals of one call in the current section
+def record(call, seconds, rows=0, calls=1):
+    section = current_section()
+    stats = _stats.setdefault((section, call), [0, 0.0, 0])
+    stats[0] += calls
+    stats[1] += seconds
+    stats[2] += rows
+    _sections.setdefault(section, [0.0, None, None])
+
+# Times a block of code as one call (e.g. writing the report CSV), optionally
+# counting the rows it handles
+@contextlib.contextmanager
+def timed(call, rows=0):
+    start = time.time()
+    try:
+        yield
+    finally:
+        record(call, time.time() - start, rows)
+
+# Records the calls made inside the block against section (a report module or a
+# script), times the section as a whole and notes the process peak memory at its
+# end and how much the section raised it
+@contextlib.contextmanager
+def section(name):
+    _stack.append(name)
+    totals = _sections.setdefault(name, [0.0, None, None])
+    before = peak_memory()
+    start = time.time()
+    try:
+        yield
+    finally:
+        totals[0] += time.time() - start
+        after = peak_memory()
+        if after is not None:
+            totals[1] = max(totals[1], after)
+            if before is not None:
+                totals[2] = max(totals[2], after - before)
+        _stack.pop()
+
+# Stands in for an arcpy cursor, recording how long it takes to hand out and write
+# rows and how many it does. Everything else goes to the real cursor.
+class Cursor(object):
+    def __init__(self, call, cursor):
+        self._call = call
+        self._cursor = cursor
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __enter__(self):
+        self._cursor.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        return self._cursor.__exit__(*exc_info)
+
+    def __iter__(self):
+        iterator = iter(self._cursor)
+        seconds = 0.0
+        rows = 0
+        try:
+            while True:
+                start = time.time()
+                try:
+                    row = iterator.next()
+                finally:
+                    seconds += time.time() - start
+                rows += 1
+                yield row
+        except StopIteration:
+            return
+        finally:
+            record(self._call, seconds, rows, 0)
+
+    # Times one call on the real cursor which reads or writes a row
+    def _row_call(self, name, *args):
+        start = time.time()
+        try:
+            return getattr(self._cursor, name)(*args)
+        finally:
+            record(self._call, time.time() - start, 1, 0)
+
+    def next(self):
+        return self._row_call("next")
+
+    def updateRow(self, row):
+        return self._row_call("updateRow", row)
+
+    def insertRow(self, row):
+        return self._row_call("insertRow", row)
+
+    def deleteRow(self, *row):
+        return self._row_call("deleteRow", *row)
+
+# Wraps an arcpy function (or cursor class) so every call is timed under call
+def wrap(function, call):
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if _depth[0] > 0:
+            return function(*args, **kwargs)
+        _depth[0] += 1
+        start = time.time()
+        try:
+            result = function(*args, **kwargs)
+        finally:
+            _depth[0] -= 1
+            record(call, time.time() - start)
+        if call.split(".")[-1] in CURSORS:
+            return Cursor(call, result)
+        return result
+    wrapper._profiled = True
+    return wrapper
+
+# Turns profiling on for this process: every public arcpy function and the
+# arcpy.da cursors are replaced by timed versions. Safe to call more than once.
+def enable():
+    global _enabled
+    if _enabled:
+        return
+    for name in dir(arcpy):
+        value = getattr(arcpy, name)
+        if not name.startswith("_") and isinstance(value, types.FunctionType):
+            setattr(arcpy, name, wrap(value, name))
+    for name in CURSORS:
+        if hasattr(arcpy.da, name):
+            setattr(arcpy.da, name, wrap(getattr(arcpy.da, name), "da." + name))
+    _enabled = True
+
+def enabled():
+    return _enabled
+
+def megabytes(size):
+    return None if size is None else round(size / 1048576.0, 1)
+
+# The profile as rows of COLUMNS, each section's calls (slowest first) followed by
+# its total. Memory is only given on the total rows.
+def entries(sections=None):
+    rows = []
+    for name in sorted(_sections):
+        if sections is not None and name not in sections:
+            continue
+        seconds, peak, growth = _sections[name]
+        calls = [[name, call] + stats + [None, None] for (section_name, call), stats in _stats.items() if section_name == name]
+        calls.sort(key=lambda row: -row[3])
+        rows.extend(calls)
+        rows.append([name, TOTAL, sum([row[2] for row in calls]), seconds, sum([row[4] for row in calls]),
+                     megabytes(peak), megabytes(growth)])
+    return rows
+
+# Removes one section from this process's profile and returns its entries, for a
+# worker process to send back with its results
+def take(name):
+    rows = entries([name])
+    _sections.pop(name, None)
+    for key in [key for key in _stats if key[0] == name]:
+        del _stats[key]
+    return rows
+
+# Adds entries (from take, in another process) to this process's profile. A
+# section from a worker process keeps that worker's peak memory.
+def merge(rows):
+    for name, call, calls, seconds, count, peak_mb, growth_mb in rows:
+        totals = _sections.setdefault(name, [0.0, None, None])
+        if call == TOTAL:
+            totals[0] += seconds
+            for i, size_mb in ((1, peak_mb), (2, growth_mb)):
+                if size_mb is not None:
+                    totals[i] = max(totals[i], int(size_mb * 1048576))
+            continue
+        stats = _stats.setdefault((name, call), [0, 0.0, 0])
+        stats[0] += calls
+        stats[1] += seconds
+        stats[2] += count
+
+# Writes the profile to base + ".json" and base + ".csv", returning both paths
+def write_profile(base):
+    rows = entries()
+    json_path, csv_path = base + ".json", base + ".csv"
+    f = open(json_path, 'wb')
+    try:
+        json.dump([collections.OrderedDict(zip(COLUMNS, row)) for row in rows], f, indent=1)
+    finally:
+        f.close()
+    f = open(csv_path, 'wb')
+    try:
+        writer = csv.writer(f, dialect='excel')
+        writer.writerow(COLUMNS)
+        writer.writerows(rows)
+    finally:
+        f.close()
+    return json_path, csv_path
+
+# Prints the top slowest calls over every section, then each section's total
+def print_summary(top=10):
+    rows = entries()
+    calls = sorted([row for row in rows if row[1] != TOTAL], key=lambda row: -row[3])
+    print "--- PROFILE: TOP %i CALLS ---" % (top)
+    for name, call, count, seconds, touched, peak_mb, growth_mb in calls[:top]:
+        print "%9.2fs %8i calls %10i rows  %s (%s)" % (seconds, count, touched, call, name)
+    print "--- PROFILE: SECTIONS (process peak memory at the end, and how much the section raised it) ---"
+    for name, call, count, seconds, touched, peak_mb, growth_mb in [row for row in rows if row[1] == TOTAL]:
+        print "%9.2fs %8i calls %10i rows %9s MB process peak %9s MB added  %s" % (
+            seconds, count, touched, "?" if peak_mb is None else peak_mb, "?" if growth_mb is None else growth_mb, name)
+    print
+
+# Runs a standalone script with profiling on, as one section named after it, and
+# writes its profile next to the script (or to the base given with -o)
+def main(argv):
+    import argparse
+    import runpy
+    parser = argparse.ArgumentParser(prog="python -m hnglib.profiling", description="Profile the arcpy calls made by a script")
+    parser.add_argument("-o", "--output", help="profile file name without extension (default: <script>_profile)")
+    parser.add_argument("-n", "--top", type=int, default=10, help="number of calls in the console summary")
+    parser.add_argument("script")
+    args = parser.parse_args(argv)
+
+    # This file runs as __main__ here, so the script's own imports of
+    # hnglib.profiling must see the same profile
+    from hnglib import profiling
+    profiling.enable()
+    sys.argv = [args.script]
+    sys.path.insert(0, os.path.dirname(os.path.abspath(args.script)))
+    try:
+        with profiling.section(os.path.basename(args.script)):
+            runpy.run_path(args.script, run_name="__main__")
+    finally:
+        base = args.output or os.path.splitext(args.script)[0] + "_profile"
+        profiling.print_summary(args.top)
+        print "Profile written to %s" % (", ".join(profiling.write_profile(base)))
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,230 @@
+# Name: shapefile.py
+# Description: Minimal ESRI shapefile writer and reader for polygon layers. The
+# .shp/.shx/.dbf/.prj files are built as strings and written straight into zip
+# entries, so a OneCall deliverable never touches a shapefile folder on disk. The
+# reader is only there to check these files against the ones arcpy writes.
+
+import datetime
+import struct
+import zipfile
+
+NULL_SHAPE = 0
+POLYGON = 5
+
+# Twice the signed area of a ring (positive when counter-clockwise)
+def ring_area(ring):
+    area = 0.0
+    for (x0, y0), (x1, y1) in zip(ring[:-1], ring[1:]):
+        area += x0 * y1 - x1 * y0
+    return area
+
+# Closes a ring and turns it clockwise for an exterior ring or counter-clockwise
+# for a hole, the orientation the shapefile spec requires
+def oriented_ring(ring, exterior):
+    ring = list(ring)
+    if ring[0] != ring[-1]:
+        ring.append(ring[0])
+    if (ring_area(ring) < 0) != exterior:
+        ring.reverse()
+    return ring
+
+# Flattens a polygon, given as a list of parts (exterior ring first, then its
+# holes), into the shapefile's ring list
+def shape_rings(parts):
+    rings = []
+    for part in parts:
+        for i, ring in enumerate(part):
+            if len(ring) >= 3:
+                rings.append(oriented_ring(ring, i == 0))
+    return rings
+
+# Header shared by .shp and .shx (length is the file length in bytes)
+def file_header(length, shape_type, extent):
+    return (struct.pack(">7i", 9994, 0, 0, 0, 0, 0, length // 2) +
+            struct.pack("<2i", 1000, shape_type) +
+            struct.pack("<8d", extent[0], extent[1], extent[2], extent[3], 0.0, 0.0, 0.0, 0.0))
+
+# Builds the .shp and .shx contents for a list of polygons (each a list of parts,
+# see shape_rings). Returns (shp, shx) strings.
+def polygon_files(shapes):
+    records = []
+    extent = None
+    for parts in shapes:
+        rings = shape_rings(parts)
+        if not rings:
+            records.append(struct.pack("<i", NULL_SHAPE))
+            continue
+        xs = [x for ring in rings for x, y in ring]
+        ys = [y for ring in rings for x, y in ring]
+        box = (min(xs), min(ys), max(xs), max(ys))
+        if extent is None:
+            extent = box
+        else:
+            extent = (min(extent[0], box[0]), min(extent[1], box[1]),
+                      max(extent[2], box[2]), max(extent[3], box[3]))
+        starts = []
+        points = []
+        for ring in rings:
+            starts.append(len(points))
+            points.extend(ring)
+        content = [struct.pack("<i4d2i", POLYGON, box[0], box[1], box[2], box[3], len(rings), len(points)),
+                   struct.pack("<%ii" % len(starts), *starts)]
+        content.extend([struct.pack("<2d", x, y) for x, y in points])
+        records.append("".join(content))
+    if extent is None:
+        extent = (0.0, 0.0, 0.0, 0.0)
+
+    shp = []
+    shx = []
+    offset = 100
+    for number, content in enumerate(records):
+        shp.append(struct.pack(">2i", number + 1, len(content) // 2) + content)
+        shx.append(struct.pack(">2i", offset // 2, len(content) // 2))
+        offset += 8 + len(content)
+    shp_header = file_header(offset, POLYGON, extent)
+    shx_header = file_header(100 + 8 * len(records), POLYGON, extent)
+    return shp_header + "".join(shp), shx_header + "".join(shx)
+
+# Formats one value for a dBASE field, padded to the field width. A number too
+# wide for its field's decimals keeps fewer of them, as ArcGIS writes it; only one
+# whose integer part doesn't fit is refused.
+def dbf_value(value, field_type, width, decimals, encoding):
+    if value is None:
+        return " " * width
+    if field_type == "C":
+        if isinstance(value, unicode):
+            value = value.encode(encoding, "replace")
+        return str(value)[:width].ljust(width)
+    if field_type == "D":
+        return value.strftime("%Y%m%d")
+    if decimals > 0:
+        text = "%*.*f" % (width, decimals, value)
+        while len(text) > width and decimals > 0:
+            decimals -= 1
+            text = "%*.*f" % (width, decimals, value)
+    else:
+        text = "%*d" % (width, value)
+    if len(text) > width:
+        raise ValueError("%r does not fit a %i character dBASE field" % (value, width))
+    return text
+
+# Builds the .dbf contents.
+#   fields - (name, type, width, decimals) tuples, type being C, N, F or D and the
+#            name at most 10 characters
+#   records - one tuple of values per shape, None for a null value
+def dbf_file(fields, records, encoding="latin-1"):
+    today = datetime.date.today()
+    record_length = 1 + sum([width for name, field_type, width, decimals in fields])
+    header = [struct.pack("<4BIHH20x", 3, today.year - 1900, today.month, today.day, len(records),
+                          32 + 32 * len(fields) + 1, record_length)]
+    for name, field_type, width, decimals in fields:
+        header.append(struct.pack("<11sc4xBB14x", str(name), field_type, width, decimals))
+    header.append("\r")
+    body = []
+    for record in records:
+        body.append(" ")
+        for (name, field_type, width, decimals), value in zip(fields, record):
+            body.append(dbf_value(value, field_type, width, decimals, encoding))
+    return "".join(header) + "".join(body) + "\x1a"
+
+# Writes a polygon shapefile called name (.shp, .shx, .dbf and .prj) into an open
+# ZipFile, one deflated entry per file.
+#   shapes - list of polygons, each a list of parts (exterior ring then holes)
+#   fields, records - see dbf_file
+#   prj - the coordinate system as ESRI WKT
+def write_polygons(zipped, name, shapes, fields, records, prj, encoding="latin-1"):
+    shp, shx = polygon_files(shapes)
+    zipped.writestr(name + ".shp", shp, zipfile.ZIP_DEFLATED)
+    zipped.writestr(name + ".shx", shx, zipfile.ZIP_DEFLATED)
+    zipped.writestr(name + ".dbf", dbf_file(fields, records, encoding), zipfile.ZIP_DEFLATED)
+    zipped.writestr(name + ".prj", prj, zipfile.ZIP_DEFLATED)
+
+# Reads the polygons out of .shp contents as (shape type, [rings, ...]) with one
+# list of rings per record
+def read_shp(shp):
+    shape_type = struct.unpack("<i", shp[32:36])[0]
+    shapes = []
+    offset = 100
+    while offset < len(shp):
+        length = struct.unpack(">i", shp[offset + 4:offset + 8])[0] * 2
+        content = shp[offset + 8:offset + 8 + length]
+        offset += 8 + length
+        if struct.unpack("<i", content[:4])[0] == NULL_SHAPE:
+            shapes.append([])
+            continue
+        num_parts, num_points = struct.unpack("<2i", content[36:44])
+        starts = list(struct.unpack("<%ii" % num_parts, content[44:44 + 4 * num_parts])) + [num_points]
+        coordinates = struct.unpack("<%id" % (2 * num_points), content[44 + 4 * num_parts:44 + 4 * num_parts + 16 * num_points])
+        points = zip(coordinates[0::2], coordinates[1::2])
+        shapes.append([list(points[starts[i]:starts[i + 1]]) for i in range(num_parts)])
+    return shape_type, shapes
+
+# Reads .dbf contents as ([(name, type, width, decimals), ...], [record, ...]) with
+# every value left as its stripped text
+def read_dbf(dbf):
+    count, header_length, record_length = struct.unpack("<IHH", dbf[4:12])
+    fields = []
+    offset = 32
+    while dbf[offset] != "\r":
+        name, field_type, width, decimals = struct.unpack("<11sc4xBB14x", dbf[offset:offset + 32])
+        fields.append((name.split("\0")[0], field_type, width, decimals))
+        offset += 32
+    records = []
+    for i in range(count):
+        start = header_length + i * record_length + 1
+        record = []
+        for name, field_type, width, decimals in fields:
+            record.append(dbf[start:start + width].strip())
+            start += width
+        records.append(record)
+    return fields, records
+
+# Compares two shapefiles given as {extension: contents} dicts (e.g. read from a
+# zip and from the folder arcpy wrote). Coordinates must agree within tolerance,
+# numeric attributes as numbers and text exactly; field widths may differ. Returns
+# a list of differences (empty when they match).
+def compare(ours, theirs, tolerance=1e-6):
+    differences = []
+    for extension in (".shp", ".shx", ".dbf", ".prj"):
+        if extension not in ours or extension not in theirs:
+            differences.append("%s missing" % (extension))
+    if differences:
+        return differences
+
+    our_type, our_shapes = read_shp(ours[".shp"])
+    their_type, their_shapes = read_shp(theirs[".shp"])
+    if our_type != their_type:
+        differences.append("Shape type %i, expected %i" % (our_type, their_type))
+    if len(our_shapes) != len(their_shapes):
+        differences.append("%i shapes, expected %i" % (len(our_shapes), len(their_shapes)))
+    for i, (our_rings, their_rings) in enumerate(zip(our_shapes, their_shapes)):
+        if [len(ring) for ring in our_rings] != [len(ring) for ring in their_rings]:
+            differences.append("Shape %i: ring sizes %s, expected %s" % (i, [len(ring) for ring in our_rings], [len(ring) for ring in their_rings]))
+            continue
+        for our_ring, their_ring in zip(our_rings, their_rings):
+            if any([abs(ox - tx) > tolerance or abs(oy - ty) > tolerance
+                    for (ox, oy), (tx, ty) in zip(our_ring, their_ring)]):
+                differences.append("Shape %i: vertices differ" % (i))
+                break
+    if len(ours[".shx"]) != len(theirs[".shx"]):
+        differences.append(".shx is %i bytes, expected %i" % (len(ours[".shx"]), len(theirs[".shx"])))
+
+    our_fields, our_records = read_dbf(ours[".dbf"])
+    their_fields, their_records = read_dbf(theirs[".dbf"])
+    if [field[:2] for field in our_fields] != [field[:2] for field in their_fields]:
+        differences.append("Fields %s, expected %s" % ([field[:2] for field in our_fields], [field[:2] for field in their_fields]))
+    elif len(our_records) != len(their_records):
+        differences.append("%i records, expected %i" % (len(our_records), len(their_records)))
+    else:
+        for i, (our_record, their_record) in enumerate(zip(our_records, their_records)):
+            for (name, field_type, width, decimals), ours_value, theirs_value in zip(our_fields, our_record, their_record):
+                if field_type in "NF" and ours_value and theirs_value:
+                    same = abs(float(ours_value) - float(theirs_value)) <= tolerance * max(1.0, abs(float(theirs_value)))
+                else:
+                    same = ours_value == theirs_value
+                if not same:
+                    differences.append("Record %i: %s is %r, expected %r" % (i, name, ours_value, theirs_value))
+
+    if ours[".prj"].strip() != theirs[".prj"].strip():
+        differences.append(".prj differs")
+    return differences
@@ -0,0 +1,210 @@
+# Name: snapshot.py
+# Description: Read-only, columnar copy of the datasets a report run uses. Each
+# feature class (and the CUSI customer sheet) is read once, with every field any
+# module needs, into NumPy arrays: OBJECTIDs, one array per attribute field and
+# flat coordinate buffers. Modules then select and read rows out of the snapshot
+# instead of each making its own feature layers and cursors, and the snapshot can
+# be handed to worker processes whole.
+
+import numpy as np
+from hnglib import backend
+from hnglib import customers
+from hnglib import gdb
+from hnglib import kernels
+# Where clauses are compiled by the backend module, which also answers the
+# in-memory backend's attribute selections with them
+from hnglib.backend import translate_where, where_fields, compile_where
+
+# Stores a column of values as a NumPy array: int64 or float64 when every value is
+# a number, object otherwise (text, dates, NULLs)
+def column_array(values):
+    if values and all([type(value) in (int, long) for value in values]):
+        array = np.array(values, dtype=np.int64)
+    elif values and all([type(value) in (int, long, float) for value in values]):
+        array = np.array(values, dtype=np.float64)
+    else:
+        array = np.empty(len(values), dtype=object)
+        array[:] = values
+    array.flags.writeable = False
+    return array
+
+# A read-only, columnar copy of one point or line feature class.
+#   oids - OBJECTIDs in cursor order
+#   columns - {field name: array of values}
+#   xs, ys - point coordinates (NaN for a missing point), or for lines the flat
+#            vertex buffers from kernels.flatten_lines with part_offsets,
+#            part_feature and feature_offsets (where each feature's parts start)
+class Table(object):
+    def __init__(self, oids, columns, xs, ys, part_offsets=None, part_feature=None):
+        self.oids = oids
+        self.columns = columns
+        self.xs = xs
+        self.ys = ys
+        self.part_offsets = part_offsets
+        self.part_feature = part_feature
+        if part_feature is not None:
+            self.feature_offsets = np.searchsorted(part_feature, np.arange(len(oids) + 1))
+        self.predicates = {}
+        self.freeze()
+
+    # Marks every array read-only, so a module can't change what the others see
+    def freeze(self):
+        for array in [self.oids, self.xs, self.ys, self.part_offsets, self.part_feature] + self.columns.values():
+            if array is not None:
+                array.flags.writeable = False
+
+    # Compiled where clauses can't be pickled, so a copy sent to a worker process
+    # leaves them behind and compiles its own
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state["predicates"] = {}
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.freeze()
+
+    def __len__(self):
+        return len(self.oids)
+
+    # A column by field name; OID@, SHAPE@X and SHAPE@Y give the OBJECTIDs and
+    # point coordinates
+    def column(self, field):
+        if field == "OID@":
+            return self.oids
+        if field == "SHAPE@X":
+            return self.xs
+        if field == "SHAPE@Y":
+            return self.ys
+        return self.columns[field]
+
+    # Indexes of the rows matching a where clause (every row for None)
+    def select(self, where_clause=None):
+        if not where_clause:
+            return range(len(self))
+        if where_clause not in self.predicates:
+            self.predicates[where_clause] = compile_where(where_clause)
+        predicate, fields = self.predicates[where_clause]
+        values = zip(*[self.column(field).tolist() for field in fields])
+        return [i for i, row in enumerate(values) if predicate(row)]
+
+    # Values of the given fields for the rows matching a where clause, as tuples of
+    # plain Python values (a missing point's coordinates come back None), like an
+    # arcpy.da.SearchCursor would give
+    def rows(self, fields, where_clause=None):
+        indexes = self.select(where_clause)
+        columns = []
+        for field in fields:
+            values = self.column(field)
+            if field in ("SHAPE@X", "SHAPE@Y"):
+                values = [None if value != value else value for value in values[indexes].tolist()]
+            else:
+                values = values[indexes].tolist()
+            columns.append(values)
+        return zip(*columns) if columns else [() for i in indexes]
+
+    # Same as rows with x and y first, like gdb.read_points
+    def points(self, fields=(), where_clause=None):
+        return self.rows(["SHAPE@X", "SHAPE@Y"] + list(fields), where_clause)
+
+    # The parts (lists of (x, y) vertices) of one line
+    def parts(self, i):
+        parts = []
+        for p in range(self.feature_offsets[i], self.feature_offsets[i + 1]):
+            start, end = self.part_offsets[p], self.part_offsets[p + 1]
+            parts.append(zip(self.xs[start:end].tolist(), self.ys[start:end].tolist()))
+        return parts
+
+    # Lines matching a where clause as (parts, field1, field2, ...) tuples, like
+    # gdb.read_polylines
+    def lines(self, fields=(), where_clause=None):
+        indexes = self.select(where_clause)
+        values = self.rows(fields, where_clause) if fields else [() for i in indexes]
+        return [(self.parts(i),) + tuple(row) for i, row in zip(indexes, values)]
+
+    # Planar length of every line in coordinate units, in row order
+    def lengths(self):
+        return kernels.polyline_lengths(self.xs, self.ys, self.part_offsets, self.part_feature, len(self))
+
+# Reads a point feature class into a Table, in spatial_reference (the layer's own
+# when None)
+def read_points(layer, fields=(), spatial_reference=None):
+    fields = list(fields)
+    oids, xs, ys = [], [], []
+    values = [[] for field in fields]
+    for row in backend.active().search_cursor(layer, ["OID@", "SHAPE@XY"] + fields, None, spatial_reference):
+        oids.append(row[0])
+        x, y = row[1] if row[1] is not None else (None, None)
+        xs.append(np.nan if x is None else x)
+        ys.append(np.nan if y is None else y)
+        for column, value in zip(values, row[2:]):
+            column.append(value)
+    return Table(np.array(oids, dtype=np.int64), dict(zip(fields, [column_array(column) for column in values])),
+                 np.array(xs, dtype=np.float64), np.array(ys, dtype=np.float64))
+
+# Reads a line feature class into a Table, in spatial_reference (the layer's own
+# when None)
+def read_lines(layer, fields=(), spatial_reference=None):
+    fields = list(fields)
+    oids, lines = [], []
+    values = [[] for field in fields]
+    for row in gdb.read_polylines(layer, ["OID@"] + fields, None, spatial_reference):
+        lines.append(row[0])
+        oids.append(row[1])
+        for column, value in zip(values, row[2:]):
+            column.append(value)
+    xs, ys, part_offsets, part_feature = kernels.flatten_lines(lines)
+    return Table(np.array(oids, dtype=np.int64), dict(zip(fields, [column_array(column) for column in values])),
+                 xs, ys, part_offsets, part_feature)
+
+# The datasets of one run, each loaded once. Datasets are described by
+# {name: [kind, source, fields]} where kind is "points", "lines", "polygons" (a
+# gdb.load_polygon_index SpatialIndex) or "customers" (customers.read_customers
+# rows, with source the workbook path and no fields). Every layer is read in the
+# spatial reference of the frame layer, so their coordinates can be compared with
+# each other (with no frame each is read in its own).
+class Snapshot(object):
+    def __init__(self, datasets, cache_folder=None, frame=None):
+        self.datasets = datasets
+        self.cache_folder = cache_folder
+        self.frame = frame
+        self.data = {}
+
+    # Loads the named datasets (every one when names is None) not loaded yet
+    def load(self, names=None):
+        spatial_reference = None
+        for name in sorted(self.datasets if names is None else names):
+            if name in self.data:
+                continue
+            kind, source, fields = self.datasets[name]
+            if kind in ("points", "lines", "polygons") and self.frame is not None and spatial_reference is None:
+                spatial_reference = gdb.spatial_reference(self.frame)
+            if kind == "points":
+                self.data[name] = read_points(source, fields, spatial_reference)
+            elif kind == "lines":
+                self.data[name] = read_lines(source, fields, spatial_reference)
+            elif kind == "polygons":
+                self.data[name] = gdb.load_polygon_index(source, fields, self.cache_folder, spatial_reference)
+            elif kind == "customers":
+                self.data[name] = tuple(customers.read_customers(source))
+            else:
+                raise ValueError("Unknown dataset kind %s for %s" % (kind, name))
+
+    # Forgets the named datasets, so their next use reads them again (after they
+    # were written to)
+    def invalidate(self, names):
+        for name in names:
+            self.data.pop(name, None)
+
+    # A snapshot of just the named datasets (sharing whatever is loaded of them),
+    # e.g. to hand a worker process only what its modules read
+    def subset(self, names):
+        part = Snapshot(dict((name, self.datasets[name]) for name in names if name in self.datasets),
+                        self.cache_folder, self.frame)
+        part.data = dict((name, self.data[name]) for name in names if name in self.data)
+        return part
+
+    def __getitem__(self, name):
+        if name not in self.data:
+            self.load([name])
+        return self.data[name]
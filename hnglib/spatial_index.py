@@ -0,0 +1,59 @@
+# Name: spatial_index.py
+# Description: Grid index over a set of polygons. Each polygon's extent is
+# registered in every grid cell it overlaps, so finding the polygon containing a
+# point is a lookup of one cell followed by exact tests on the few polygons
+# registered there, instead of a scan of the whole layer.
+
+import math
+
+class SpatialIndex(object):
+    # cells_per_polygon controls the grid resolution: the grid is sized so there
+    # are roughly that many cells for each polygon in the layer
+    def __init__(self, polygons, cells_per_polygon=4):
+        self.polygons = list(polygons)
+        extents = [p.extent for p in self.polygons if p.extent[0] <= p.extent[2]]
+        if extents:
+            self.xmin = min(e[0] for e in extents)
+            self.ymin = min(e[1] for e in extents)
+            xmax = max(e[2] for e in extents)
+            ymax = max(e[3] for e in extents)
+            area = max((xmax - self.xmin) * (ymax - self.ymin), 1.0)
+            self.cellsize = math.sqrt(area / (len(extents) * cells_per_polygon)) or 1.0
+        else:
+            self.xmin, self.ymin, self.cellsize = 0.0, 0.0, 1.0
+
+        # Polygons are appended in list order, so every cell's candidate list stays
+        # sorted and "first polygon containing the point" keeps its meaning
+        self.cells = {}
+        for i, polygon in enumerate(self.polygons):
+            xmin, ymin, xmax, ymax = polygon.extent
+            if xmin > xmax:
+                continue
+            col0, row0 = self.cell(xmin, ymin)
+            col1, row1 = self.cell(xmax, ymax)
+            for col in range(col0, col1 + 1):
+                for row in range(row0, row1 + 1):
+                    self.cells.setdefault((col, row), []).append(i)
+
+    def __len__(self):
+        return len(self.polygons)
+
+    def __iter__(self):
+        return iter(self.polygons)
+
+    def __getitem__(self, i):
+        return self.polygons[i]
+
+    def cell(self, x, y):
+        return (int(math.floor((x - self.xmin) / self.cellsize)),
+                int(math.floor((y - self.ymin) / self.cellsize)))
+
+    # Indexes of the polygons whose extent overlaps the (xmin, ymin, xmax, ymax) box
+    def candidates_in_extent(self, extent):
+        col0, row0 = self.cell(extent[0], extent[1])
+        col1, row1 = self.cell(extent[2], extent[3])
+        found = set()
+        for col in range(col0, col1 + 1):
+            for row in range(row0, row1 + 1):
+                found.update(self.cells.get((col, row), []))
+        return sorted(found)
@@ -0,0 +1,283 @@
+# Name: taxing.py
+# Description: Single pass taxing districts engine. Every meter is assigned to
+# its ISD and ESD once, and the County/ISD/ESD/ACTIVE-ON/INACTIVE-ON/OFF/TOTAL
+# rows of the taxing report are built from those assignments instead of from a
+# SelectLayerByLocation/GetCount round trip per ISD/ESD pair.
+#
+# The assignments can also be kept between runs (see update below), so the next
+# run only re-assigns meters that moved, or that sit in a district which changed,
+# and patches the counts instead of rebuilding them.
+
+import cPickle
+import hashlib
+import os
+import numpy as np
+from hnglib import kernels
+from hnglib import parallel
+
+HEADER = ["County","ISD","ESD","ACTIVE/ON","INACTIVE/ON","OFF","TOTAL"]
+
+# Index of each counter kept per ISD/ESD pair and per ISD. The ISD counters mirror
+# the selections the old report used for the "ISD w/o an ESD" row, which are not
+# quite the same as the pair counters (ACTIVE is counted regardless of meter_on,
+# and OFF only counts INACTIVE meters).
+COUNT, ACTIVE_ON, INACTIVE_ON, OFF = 0, 1, 2, 3
+ISD_TOTAL, ISD_ACTIVE, ISD_INACTIVE_ON, ISD_INACTIVE_OFF = 0, 1, 2, 3
+
+# Assigns each meter to the first polygon containing it, returning a list of
+# polygon indexes (None for meters outside every polygon). With workers > 1 the
+# polygon list is split into contiguous shards which are located in separate
+# processes; each meter then takes the hit from the earliest shard, so the result
+# is identical to the serial run.
+def assign(meters, polygons, workers=1):
+    xs, ys = kernels.coordinate_arrays(meters)
+    if workers <= 1:
+        located = kernels.locate_points(xs, ys, polygons)
+    else:
+        tasks = [(xs, ys, offset, polygon_shard)
+                 for offset, polygon_shard in parallel.shard(polygons, workers)]
+        located = np.empty(len(xs), dtype=np.int64)
+        located.fill(-1)
+        for shard_located in parallel.map_in_order(locate_shard, tasks, workers):
+            located = np.where(located == -1, shard_located, located)
+    return [None if i < 0 else i for i in located.tolist()]
+
+# Worker side of assign: locates the meters in one shard of polygons and returns
+# indexes into the full polygon list
+def locate_shard(task):
+    xs, ys, offset, polygons = task
+    located = kernels.locate_points(xs, ys, polygons)
+    located[located >= 0] += offset
+    return located
+
+# Adds one meter (or removes it, with sign=-1) to the pair and ISD counters, which
+# are keyed by ISD OBJECTID and (ISD OBJECTID, ESD OBJECTID)
+def tally(pair_counts, ISD_counts, ISD_oid, ESD_oid, serv_stat, meter_on, sign=1):
+    if ISD_oid is None:
+        return
+    counts = ISD_counts.setdefault(ISD_oid, [0, 0, 0, 0])
+    counts[ISD_TOTAL] += sign
+    if serv_stat == 'ACTIVE':
+        counts[ISD_ACTIVE] += sign
+    elif serv_stat == 'INACTIVE':
+        if meter_on == 1:
+            counts[ISD_INACTIVE_ON] += sign
+        elif meter_on == 0:
+            counts[ISD_INACTIVE_OFF] += sign
+    if ESD_oid is None:
+        return
+    counts = pair_counts.setdefault((ISD_oid, ESD_oid), [0, 0, 0, 0])
+    counts[COUNT] += sign
+    if meter_on == 1:
+        if serv_stat == 'ACTIVE':
+            counts[ACTIVE_ON] += sign
+        elif serv_stat == 'INACTIVE':
+            counts[INACTIVE_ON] += sign
+    elif meter_on == 0:
+        counts[OFF] += sign
+
+# Builds the report rows from the pair and ISD counters.
+# Returns (rows, totals) where totals is [ACTIVE/ON, INACTIVE/ON, OFF, TOTAL]
+def rows_from_counts(ISDs, ESDs, pair_counts, ISD_counts):
+    # The old report walked the ESDs in the order of a dict keyed by OBJECTID, so
+    # rebuild that dict here to keep the rows in the same order
+    ESD_OBJECTID = {}
+    for ESD in ESDs:
+        ESD_OBJECTID[ESD.oid] = ESD
+
+    rows = []
+    totals = [0, 0, 0, 0]
+    for ISD in ISDs:
+        ISD_total = ISD_counts.get(ISD.oid, [0, 0, 0, 0])
+        counted = [0, 0, 0, 0]
+        for oid in ESD_OBJECTID:
+            counts = pair_counts.get((ISD.oid, oid))
+            if counts is None or counts[COUNT] == 0:
+                continue
+            ESD = ESD_OBJECTID[oid]
+            rows.append([ESD["COUNTY"],ISD["NAME2"],ESD["COUNTY"] + " " + ESD["NUMBER"],
+                         counts[ACTIVE_ON],counts[INACTIVE_ON],counts[OFF],counts[COUNT]])
+            counted = [a + b for a, b in zip(counted, counts)]
+        if counted[COUNT] != ISD_total[ISD_TOTAL] and ISD_total[ISD_TOTAL] > 0:
+            count = ISD_total[ISD_TOTAL] - counted[COUNT]
+            activeoncount = ISD_total[ISD_ACTIVE] - counted[ACTIVE_ON]
+            inactiveoncount = ISD_total[ISD_INACTIVE_ON] - counted[INACTIVE_ON]
+            offcount = ISD_total[ISD_INACTIVE_OFF] - counted[OFF]
+            rows.append(["",ISD["NAME2"],"",activeoncount,inactiveoncount,offcount,count])
+            counted = [count + counted[COUNT], activeoncount + counted[ACTIVE_ON],
+                       inactiveoncount + counted[INACTIVE_ON], offcount + counted[OFF]]
+        totals[0] += counted[ACTIVE_ON]
+        totals[1] += counted[INACTIVE_ON]
+        totals[2] += counted[OFF]
+        totals[3] += counted[COUNT]
+    return rows, totals
+
+# Builds the taxing report rows from scratch.
+#   ISDs   - SpatialIndex (or geometry.Polygon list) in ISD cursor order, with
+#            NAME2 attributes
+#   ESDs   - SpatialIndex (or geometry.Polygon list) in ESD cursor order, with
+#            COUNTY and NUMBER attributes
+#   meters - (x, y, serv_stat, meter_on, ...) tuples
+#   workers - number of processes to spread the district lookups over
+# Returns (rows, totals) where totals is [ACTIVE/ON, INACTIVE/ON, OFF, TOTAL]
+def build_rows(ISDs, ESDs, meters, workers=1):
+    ISD_of = assign(meters, ISDs, workers)
+    ESD_of = assign(meters, ESDs, workers)
+    pair_counts, ISD_counts = {}, {}
+    for meter, i, e in zip(meters, ISD_of, ESD_of):
+        tally(pair_counts, ISD_counts,
+              None if i is None else ISDs[i].oid,
+              None if e is None else ESDs[e].oid,
+              meter[2], meter[3])
+    return rows_from_counts(ISDs, ESDs, pair_counts, ISD_counts)
+
+
+### INCREMENTAL RUNS
+# The state kept between runs is a dict holding:
+#   "districts"   - {"ISD"/"ESD": {OBJECTID: (digest, extent)}} for every polygon
+#   "meters"      - {OBJECTID: (serv_id, (x, y), ISD OBJECTID, ESD OBJECTID,
+#                    serv_stat, meter_on)} for every meter
+#   "pair_counts" and "ISD_counts" - the counters used by rows_from_counts
+STATE_VERSION = 1
+
+# Fingerprint of a polygon's rings and attributes
+def polygon_digest(polygon):
+    return hashlib.md5(repr((polygon.rings, sorted(polygon.attributes.items())))).hexdigest()
+
+def district_state(polygons):
+    return dict((p.oid, (polygon_digest(p), p.extent)) for p in polygons)
+
+# Extents of every polygon which was added, removed or edited since the last run
+def changed_extents(old, new):
+    extents = []
+    for oid in set(old) | set(new):
+        if old.get(oid, (None,))[0] != new.get(oid, (None,))[0]:
+            extents.extend([entry[1] for entry in (old.get(oid), new.get(oid)) if entry])
+    return extents
+
+def load_state(filepath):
+    if not os.path.exists(filepath):
+        return None
+    f = open(filepath, 'rb')
+    try:
+        state = cPickle.load(f)
+    finally:
+        f.close()
+    if state.get("version") != STATE_VERSION:
+        return None
+    return state
+
+def save_state(state, filepath):
+    folder = os.path.dirname(filepath)
+    if folder and not os.path.isdir(folder):
+        os.makedirs(folder)
+    f = open(filepath, 'wb')
+    try:
+        cPickle.dump(state, f, 2)
+    finally:
+        f.close()
+
+# Brings the previous run's state up to date with the current meters and districts.
+#   meters - (x, y, serv_stat, meter_on, serv_id, OBJECTID) tuples
+# Only meters which are new, moved, or lie inside the old or new extent of an
+# edited district are re-assigned; every other meter keeps its ISD and ESD. The
+# counters are patched by removing each changed meter's old contribution and
+# adding its new one. With no previous state everything is assigned.
+# Returns (state, rows, totals, summary) where summary counts the meters which
+# were reassigned, changed status only, were removed, or were left alone.
+def update(state, ISDs, ESDs, meters, workers=1):
+    districts = {"ISD": district_state(ISDs), "ESD": district_state(ESDs)}
+    if state is None:
+        state = {"version": STATE_VERSION, "districts": {"ISD": {}, "ESD": {}},
+                 "meters": {}, "pair_counts": {}, "ISD_counts": {}}
+    old_meters = state["meters"]
+    pair_counts = state["pair_counts"]
+    ISD_counts = state["ISD_counts"]
+    extents = (changed_extents(state["districts"]["ISD"], districts["ISD"]) +
+               changed_extents(state["districts"]["ESD"], districts["ESD"]))
+
+    def near_changed_district(x, y):
+        if x is None or y is None:
+            return False
+        for xmin, ymin, xmax, ymax in extents:
+            if xmin <= x <= xmax and ymin <= y <= ymax:
+                return True
+        return False
+
+    new_meters = {}
+    reassign = []
+    summary = {"reassigned": 0, "status": 0, "removed": 0, "unchanged": 0}
+    for x, y, serv_stat, meter_on, serv_id, oid in meters:
+        old = old_meters.get(oid)
+        if old is None or old[1] != (x, y) or near_changed_district(x, y):
+            reassign.append((x, y, serv_stat, meter_on, serv_id, oid))
+            continue
+        if old[0] != serv_id or old[4] != serv_stat or old[5] != meter_on:
+            tally(pair_counts, ISD_counts, old[2], old[3], old[4], old[5], -1)
+            tally(pair_counts, ISD_counts, old[2], old[3], serv_stat, meter_on)
+            summary["status"] += 1
+        else:
+            summary["unchanged"] += 1
+        new_meters[oid] = (serv_id, (x, y), old[2], old[3], serv_stat, meter_on)
+
+    # Meters which are gone or are being reassigned give back their old counts
+    seen = set(new_meters)
+    for meter in reassign:
+        seen.add(meter[5])
+    for oid, old in old_meters.items():
+        if oid not in new_meters:
+            tally(pair_counts, ISD_counts, old[2], old[3], old[4], old[5], -1)
+            if oid not in seen:
+                summary["removed"] += 1
+
+    ISD_of = assign(reassign, ISDs, workers)
+    ESD_of = assign(reassign, ESDs, workers)
+    for meter, i, e in zip(reassign, ISD_of, ESD_of):
+        x, y, serv_stat, meter_on, serv_id, oid = meter
+        ISD_oid = None if i is None else ISDs[i].oid
+        ESD_oid = None if e is None else ESDs[e].oid
+        tally(pair_counts, ISD_counts, ISD_oid, ESD_oid, serv_stat, meter_on)
+        new_meters[oid] = (serv_id, (x, y), ISD_oid, ESD_oid, serv_stat, meter_on)
+    summary["reassigned"] = len(reassign)
+
+    state["districts"] = districts
+    state["meters"] = new_meters
+    rows, totals = rows_from_counts(ISDs, ESDs, pair_counts, ISD_counts)
+    return state, rows, totals, summary
+
+# Runs the report incrementally from the state kept in state_file (see update).
+# With check the result is compared against a full recompute (see verify); when
+# they differ the recompute is used and the state is dropped, so the next run
+# starts over. Otherwise the brought up to date state is saved back.
+# Returns (rows, totals, summary, differences), summary also saying whether there
+# was a previous state to start from ("previous").
+def incremental_rows(state_file, ISDs, ESDs, meters, check=False, workers=1):
+    state = load_state(state_file)
+    previous = state is not None
+    state, rows, totals, summary = update(state, ISDs, ESDs, meters, workers)
+    summary["previous"] = previous
+    differences = []
+    if check:
+        differences = verify(ISDs, ESDs, meters, rows, totals, workers)
+        if differences:
+            rows, totals = build_rows(ISDs, ESDs, meters, workers)
+            state = None
+    if state is not None:
+        save_state(state, state_file)
+    elif os.path.exists(state_file):
+        os.remove(state_file)
+    return rows, totals, summary, differences
+
+# Full recompute used to check an incremental run. Returns a list of
+# human-readable differences (empty when both agree).
+def verify(ISDs, ESDs, meters, rows, totals, workers=1):
+    full_rows, full_totals = build_rows(ISDs, ESDs, meters, workers)
+    differences = []
+    for n in range(max(len(rows), len(full_rows))):
+        incremental = rows[n] if n < len(rows) else None
+        full = full_rows[n] if n < len(full_rows) else None
+        if incremental != full:
+            differences.append("Row %i: incremental %s, full %s" % (n + 1, incremental, full))
+    if totals != full_totals:
+        differences.append("TOTAL: incremental %s, full %s" % (totals, full_totals))
+    return differences
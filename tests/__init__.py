@@ -0,0 +1,3 @@
+# Name: tests
+# Description: Offline tests of hnglib, run against the in-memory backend (no
+# ArcGIS needed): python -m unittest discover -s tests -t .
@@ -0,0 +1,44 @@
+# Name: test_duplicates.py
+# Description: The length find_overlaps reports as counted more than once must not
+# depend on which of two overlapping lines is the longer one.
+
+import unittest
+from hnglib import duplicates
+
+DISTANCE = 1.0
+ANGLE = 5.0
+
+class FindOverlapsTest(unittest.TestCase):
+    def test_short_line_on_a_long_earlier_line_at_an_angle(self):
+        # A 50 foot line lying along a 1000 foot line drawn 0.57 degrees off it: the
+        # ends of the long line are 5 feet from the short line's axis
+        lines = [(1, [[(-500.0, -5.0), (500.0, 5.0)]]),
+                 (2, [[(0.0, 0.0), (50.0, 0.0)]])]
+        overlaps, excess = duplicates.find_overlaps(lines, DISTANCE, ANGLE)
+        self.assertAlmostEqual(overlaps[(1, 2)], 50.0, 2)
+        self.assertAlmostEqual(excess, 50.0, 2)
+
+    def test_long_line_on_a_short_earlier_line_at_an_angle(self):
+        lines = [(1, [[(0.0, 0.0), (50.0, 0.0)]]),
+                 (2, [[(-500.0, -5.0), (500.0, 5.0)]])]
+        overlaps, excess = duplicates.find_overlaps(lines, DISTANCE, ANGLE)
+        self.assertAlmostEqual(overlaps[(1, 2)], 50.0, 2)
+        self.assertAlmostEqual(excess, 50.0, 2)
+
+    def test_copies_count_once_each(self):
+        # Three copies of a stretch, the middle one split in two: 2 x 100 counted twice
+        lines = [(1, [[(0.0, 0.0), (100.0, 0.0)]]),
+                 (2, [[(0.0, 0.2), (60.0, 0.2), (100.0, 0.2)]]),
+                 (3, [[(100.0, -0.2), (0.0, -0.2)]])]
+        overlaps, excess = duplicates.find_overlaps(lines, DISTANCE, ANGLE)
+        self.assertAlmostEqual(excess, 200.0, 6)
+        self.assertAlmostEqual(overlaps[(1, 3)], 100.0, 6)
+
+    def test_lines_apart_do_not_overlap(self):
+        lines = [(1, [[(0.0, 0.0), (100.0, 0.0)]]),
+                 (2, [[(0.0, 5.0), (100.0, 5.0)]]),
+                 (3, [[(0.0, 0.0), (0.0, 100.0)]])]
+        self.assertEqual(duplicates.find_overlaps(lines, DISTANCE, ANGLE), ({}, 0.0))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,60 @@
+# Name: test_kernels.py
+# Description: kernels.locate_points only tests each polygon against the meters in
+# the grid cells it is registered in, and must assign every meter exactly as a
+# test against every polygon in list order would.
+
+import random
+import unittest
+import numpy as np
+from hnglib import geometry
+from hnglib import kernels
+from hnglib.spatial_index import SpatialIndex
+
+# Reference assignment: every point tested against every polygon, first one wins
+def scan(xs, ys, polygons):
+    located = []
+    for x, y in zip(xs.tolist(), ys.tolist()):
+        hit = -1
+        if x == x and y == y:
+            for i, polygon in enumerate(polygons):
+                if kernels.points_in_rings(np.array([x]), np.array([y]), polygon.rings)[0]:
+                    hit = i
+                    break
+        located.append(hit)
+    return located
+
+def box(oid, xmin, ymin, xmax, ymax):
+    return geometry.Polygon(oid, [[(xmin, ymin), (xmin, ymax), (xmax, ymax), (xmax, ymin)]])
+
+class LocatePointsTest(unittest.TestCase):
+    def setUp(self):
+        rand = random.Random(7)
+        # A tiling of 10 x 10 squares sharing borders, then larger squares
+        # overlapping them, a square with a hole, and an empty polygon
+        self.polygons = [box(n, (n % 8) * 10.0, (n // 8) * 10.0, (n % 8) * 10.0 + 10.0,
+                             (n // 8) * 10.0 + 10.0) for n in range(48)]
+        for n in range(10):
+            x, y = rand.uniform(-20.0, 80.0), rand.uniform(-20.0, 60.0)
+            self.polygons.append(box(48 + n, x, y, x + rand.uniform(1.0, 40.0), y + rand.uniform(1.0, 40.0)))
+        self.polygons.append(geometry.Polygon(58, [[(100.0, 0.0), (100.0, 30.0), (130.0, 30.0), (130.0, 0.0)],
+                                                   [(110.0, 10.0), (110.0, 20.0), (120.0, 20.0), (120.0, 10.0)]]))
+        self.polygons.append(geometry.Polygon(59, []))
+
+        points = [(rand.uniform(-30.0, 140.0), rand.uniform(-30.0, 70.0)) for n in range(2000)]
+        # Meters on shared borders and corners, and missing coordinates
+        points += [(10.0, 5.0), (10.0, 10.0), (0.0, 0.0), (80.0, 60.0), (115.0, 15.0), (None, 5.0), (5.0, None)]
+        self.xs, self.ys = kernels.coordinate_arrays(points)
+
+    def test_matches_a_full_scan(self):
+        expected = scan(self.xs, self.ys, self.polygons)
+        self.assertEqual(kernels.locate_points(self.xs, self.ys, self.polygons).tolist(), expected)
+        index = SpatialIndex(self.polygons, cells_per_polygon=1)
+        self.assertEqual(kernels.locate_points(self.xs, self.ys, index).tolist(), expected)
+
+    def test_no_points_or_polygons(self):
+        empty = np.zeros(0, dtype=np.float64)
+        self.assertEqual(kernels.locate_points(empty, empty, self.polygons).tolist(), [])
+        self.assertEqual(kernels.locate_points(self.xs, self.ys, []).tolist(), [-1] * len(self.xs))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,73 @@
+# Name: test_polygon_index.py
+# Description: The cached polygon index is reloaded without reading the layer's
+# shapes while its editor tracking signature holds, and rebuilt once it changes.
+
+import shutil
+import tempfile
+import unittest
+from hnglib import backend
+from hnglib import gdb
+
+# A MemoryBackend whose feature classes report editor tracking on a
+# last_edited_date field, counting the cursors which read shapes
+class TrackedBackend(backend.MemoryBackend):
+    def __init__(self):
+        backend.MemoryBackend.__init__(self)
+        self.shape_reads = 0
+
+    def describe(self, value):
+        desc = backend.MemoryBackend.describe(self, value)
+        desc.editorTrackingEnabled = True
+        desc.editedAtFieldName = "last_edited_date"
+        return desc
+
+    def search_cursor(self, in_table, field_names, where_clause=None, spatial_reference=None):
+        if "SHAPE@" in field_names:
+            self.shape_reads += 1
+        return backend.MemoryBackend.search_cursor(self, in_table, field_names, where_clause, spatial_reference)
+
+def square(x, y, size=10.0):
+    return [[[(x, y), (x, y + size), (x + size, y + size), (x + size, y)]]]
+
+class PolygonIndexCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.memory = backend.use(TrackedBackend())
+        self.memory.add_table("ISDs", "Polygon", ["NAME2", "last_edited_date"],
+                              [(square(0.0, 0.0), {"NAME2": "Edinburg", "last_edited_date": "2015-01-01"}),
+                               (square(10.0, 0.0), {"NAME2": "Mission", "last_edited_date": "2015-01-02"})])
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, True)
+        del backend._active[:]
+
+    def test_hit_skips_reading_shapes(self):
+        built = gdb.load_polygon_index("ISDs", ["NAME2"], self.folder)
+        self.assertEqual(self.memory.shape_reads, 1)
+        cached = gdb.load_polygon_index("ISDs", ["NAME2"], self.folder)
+        self.assertEqual(self.memory.shape_reads, 1)
+        self.assertEqual([p["NAME2"] for p in cached], [p["NAME2"] for p in built])
+
+    def test_edit_rebuilds(self):
+        gdb.load_polygon_index("ISDs", ["NAME2"], self.folder)
+        with self.memory.update_cursor("ISDs", ["SHAPE@", "last_edited_date"], "NAME2 = 'Mission'") as rows:
+            for row in rows:
+                rows.updateRow([backend.Geometry("Polygon", square(12.0, 0.0)), "2015-02-01"])
+        index = gdb.load_polygon_index("ISDs", ["NAME2"], self.folder)
+        self.assertEqual(self.memory.shape_reads, 2)
+        self.assertEqual(index[1].extent, (12.0, 0.0, 22.0, 10.0))
+
+    def test_fields_are_part_of_the_signature(self):
+        gdb.load_polygon_index("ISDs", ["NAME2"], self.folder)
+        index = gdb.load_polygon_index("ISDs", ["NAME2", "last_edited_date"], self.folder)
+        self.assertEqual(self.memory.shape_reads, 2)
+        self.assertEqual(index[0]["last_edited_date"], "2015-01-01")
+
+    def test_untracked_layer_is_not_cached(self):
+        untracked = backend.use(backend.MemoryBackend())
+        untracked.tables = self.memory.tables
+        gdb.load_polygon_index("ISDs", ["NAME2"], self.folder)
+        self.assertEqual(len(gdb.os.listdir(self.folder)), 0)
+
+if __name__ == "__main__":
+    unittest.main()
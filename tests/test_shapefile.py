@@ -0,0 +1,27 @@
+# Name: test_shapefile.py
+# Description: Values written into the OneCall shapefiles' dBASE fields must fit
+# their width the way ArcGIS fits them.
+
+import unittest
+from hnglib import shapefile
+
+class DbfValueTest(unittest.TestCase):
+    def test_fits_the_field_decimals(self):
+        self.assertEqual(shapefile.dbf_value(1234.5, "N", 19, 11, "latin-1"), "   1234.50000000000")
+
+    def test_wide_number_keeps_fewer_decimals(self):
+        text = shapefile.dbf_value(123456789012.345678, "N", 19, 11, "latin-1")
+        self.assertEqual(len(text), 19)
+        self.assertEqual(text, "123456789012.345673")
+        self.assertEqual(shapefile.dbf_value(-123456789012345678.0, "N", 19, 11, "latin-1"), "-123456789012345680")
+
+    def test_integer_part_too_wide_raises(self):
+        self.assertRaises(ValueError, shapefile.dbf_value, 1e20, "N", 19, 11, "latin-1")
+
+    def test_records_read_back(self):
+        fields = [("Shape_Area", "F", 19, 11)]
+        dbf = shapefile.dbf_file(fields, [(12.25,), (98765432109876.5,)])
+        self.assertEqual(shapefile.read_dbf(dbf)[1], [["12.25000000000"], ["98765432109876.5000"]])
+
+if __name__ == "__main__":
+    unittest.main()
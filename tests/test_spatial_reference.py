@@ -0,0 +1,91 @@
+# Name: test_spatial_reference.py
+# Description: Layers stored in different spatial references must be read in one
+# before their coordinates are compared: arcpy projects them when asked to, and
+# the in-memory backend, which can't, refuses rather than mix the two.
+
+import sys
+import types
+import unittest
+from hnglib import backend
+from hnglib import gdb
+from hnglib import snapshot
+
+GEOGRAPHIC = backend.SpatialReference("GCS_North_American_1983", 111319.49079327357, 8.983152841195215e-09,
+                                      "Geographic", 4269)
+PROJECTED = backend.SpatialReference(factoryCode=2279)
+
+def districts_backend(meters_sr):
+    memory = backend.MemoryBackend()
+    square = [[[(0.0, 0.0), (0.0, 10.0), (10.0, 10.0), (10.0, 0.0)]]]
+    memory.add_table("ISDs", "Polygon", ["NAME2"], [(square, {"NAME2": "Edinburg"})], PROJECTED)
+    memory.add_table("meter_ref", "Point", ["serv_id"], [((5.0, 5.0), {"serv_id": 1})], meters_sr)
+    return memory
+
+class MemoryBackendTest(unittest.TestCase):
+    def tearDown(self):
+        del backend._active[:]
+
+    def test_same_spatial_reference_reads(self):
+        backend.use(districts_backend(PROJECTED))
+        self.assertEqual(gdb.read_points("meter_ref", ["serv_id"], gdb.spatial_reference("ISDs")), [(5.0, 5.0, 1)])
+
+    def test_mismatched_spatial_reference_raises(self):
+        backend.use(districts_backend(GEOGRAPHIC))
+        self.assertRaises(ValueError, gdb.read_points, "meter_ref", ["serv_id"], gdb.spatial_reference("ISDs"))
+        # Read in its own spatial reference the layer still comes through
+        self.assertEqual(gdb.read_points("meter_ref", ["serv_id"]), [(5.0, 5.0, 1)])
+
+    def test_meters_located_in_the_areas_frame(self):
+        backend.use(districts_backend(PROJECTED))
+        meters = gdb.read_points("meter_ref", ["OID@"], gdb.spatial_reference("meter_ref"))
+        xs, ys = gdb.point_arrays("meter_ref", [2, meters[0][2]], gdb.spatial_reference("ISDs"))
+        self.assertTrue(xs[0] != xs[0])
+        self.assertEqual((xs[1], ys[1]), (5.0, 5.0))
+        backend.use(districts_backend(GEOGRAPHIC))
+        self.assertTrue(gdb.spatial_reference("meter_ref").GCS is GEOGRAPHIC)
+        self.assertRaises(ValueError, gdb.point_arrays, "meter_ref", [1], gdb.spatial_reference("ISDs"))
+
+    def test_snapshot_reads_every_layer_in_its_frame(self):
+        backend.use(districts_backend(GEOGRAPHIC))
+        datasets = {"meter_ref": ["points", "meter_ref", ["serv_id"]], "ISDs": ["polygons", "ISDs", ["NAME2"]]}
+        data = snapshot.Snapshot(datasets, None, "ISDs")
+        self.assertRaises(ValueError, data.load, ["meter_ref"])
+        self.assertEqual(len(data["ISDs"]), 1)
+
+    def test_spatial_references_compare_by_factory_code(self):
+        self.assertTrue(backend.same_spatial_reference(PROJECTED, backend.SpatialReference(factoryCode=2279)))
+        self.assertFalse(backend.same_spatial_reference(PROJECTED, GEOGRAPHIC))
+        self.assertTrue(backend.same_spatial_reference(backend.SpatialReference(), backend.SpatialReference()))
+
+# Just enough of arcpy to see what the ArcpyBackend asks its cursors for
+class RecordingCursor(object):
+    calls = []
+    def __init__(self, in_table, field_names, where_clause=None, spatial_reference=None):
+        RecordingCursor.calls.append((in_table, spatial_reference))
+    def __iter__(self):
+        return iter([((5.0, 5.0), 1)])
+
+class ArcpyBackendTest(unittest.TestCase):
+    def setUp(self):
+        arcpy = types.ModuleType("arcpy")
+        arcpy.da = types.ModuleType("arcpy.da")
+        arcpy.da.SearchCursor = RecordingCursor
+        self.saved = sys.modules.get("arcpy")
+        sys.modules["arcpy"] = arcpy
+        del RecordingCursor.calls[:]
+
+    def tearDown(self):
+        if self.saved is None:
+            del sys.modules["arcpy"]
+        else:
+            sys.modules["arcpy"] = self.saved
+        del backend._active[:]
+
+    def test_cursor_projects_into_the_requested_spatial_reference(self):
+        backend.use(backend.ArcpyBackend())
+        gdb.read_points("meter_ref", ["serv_id"], PROJECTED)
+        gdb.read_points("meter_ref", ["serv_id"])
+        self.assertEqual(RecordingCursor.calls, [("meter_ref", PROJECTED), ("meter_ref", None)])
+
+if __name__ == "__main__":
+    unittest.main()